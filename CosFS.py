@@ -8,6 +8,10 @@ import errno
 import sys
 import traceback
 import time
+import heapq
+import tempfile
+import uuid
+import itertools
 import requests
 
 import Queue
@@ -17,27 +21,84 @@ import threading
 import qcloud_cos
 
 from qcloud_cos import CosClient
+from qcloud_cos import AsyncCosClient
 from qcloud_cos import UploadFileRequest
+from qcloud_cos import UploadStreamRequest
 from qcloud_cos import DelFileRequest
 from qcloud_cos import MoveFileRequest
 from qcloud_cos import DelFolderRequest
 from qcloud_cos import CreateFolderRequest
 from qcloud_cos import StatFileRequest
 from qcloud_cos import ListFolderRequest
+from qcloud_cos.cos_retry import RetryPolicy, RETRYABLE, classify_exception
+from qcloud_cos.cos_metrics import RequestTimer, TTFB, BODY
+from qcloud_cos.cos_err import CosErr
+
+from cosfs_cache import KIND_LIST, KIND_STAT
+from cosfs_manifest import SyncManifest
+from cosfs_mvplan import MovePlan
+from cosfs_file import CosFile, BLOCK_SIZE, CACHE_BLOCKS
+from cosfs_pack import PackIndex, PackWriter, plan_ranges, extract_members
+from cosfs_pack import PACK_DIR, INDEX_NAME, PACK_THRESHOLD
 
 SIGN_EXPIRE = 86400 #seconds
-SLEEP_INTERVAL = 1.0 #seconds
+SLEEP_INTERVAL = 1.0 #seconds, 第一次重试前等待时间的上限，之后每次翻倍(实际等待时间在0到上限之间随机)
+MAX_SLEEP_INTERVAL = 8.0 #seconds
 
 CODE_SAME_FILE          = -4018
 CODE_EXISTED            = -177
+CODE_NOT_EXIST          = -197
 CODE_ERR_OFF_GOBACK     = -4024
 
 #并发线程数量 Concurrency Thread Number
 NR_THREAD           = 10
 
+#任务类别 => (优先级, 最大并发数)，优先级数值小的先执行
+#目录要在上传文件之前创建，但不能占满所有线程
+TASK_DEFAULT        = 'default'
+TASK_MKDIR          = 'mkdir'
+TASK_UPLOAD         = 'upload'
+TASK_DOWNLOAD       = 'download'
+TASK_DELETE         = 'delete'
+TASK_MOVE           = 'move'
+TASK_CLASSES        = {
+    TASK_DEFAULT:   (1, NR_THREAD),
+    TASK_MKDIR:     (0, 4),
+    TASK_UPLOAD:    (1, NR_THREAD),
+    TASK_DOWNLOAD:  (1, NR_THREAD),
+    TASK_DELETE:    (1, NR_THREAD),
+    TASK_MOVE:      (1, NR_THREAD),
+}
+
+#并发遍历cos目录的线程数
+NR_WALK_THREAD      = 8
+
+#rmdir -r在一个事件循环(AsyncCosClient)上同时进行的删除请求数，0表示改用NR_THREAD个线程
+NR_ASYNC_DELETE     = 100
+
+#元数据缓存最多缓存的单个目录列表长度
+MAX_CACHED_LIST     = 10000
+
 #失败重试次数
 RETRY_COUNT         = 6
 
+#大于该值的文件按Range分片并发下载
+PARALLEL_DOWNLOAD_THRESHOLD = 32 * 1024 * 1024
+DOWNLOAD_PART_SIZE          = 8 * 1024 * 1024
+#单个文件的分片下载并发数
+NR_DOWNLOAD_THREAD          = 4
+#流式上传(cos内复制、put)单个文件时分片上传的并发数，内存中最多有这么多+1个分片
+NR_STREAM_SLICE_THREAD      = 4
+
+#分片上传断点记录的存放目录，设为None则不支持续传
+JOURNAL_DIR         = os.path.expanduser('~/.cosfs/journal')
+
+#sync的文件清单存放目录，设为None则每次都按sha1比较
+MANIFEST_DIR        = os.path.expanduser('~/.cosfs/manifest')
+
+#mv -r的改名计划和进度存放目录，设为None则不支持续传
+MVPLAN_DIR          = os.path.expanduser('~/.cosfs/mvplan')
+
 
 CONFLICT_ERROR      = 1
 CONFLICT_SKIP       = 2
@@ -51,86 +112,473 @@ def localMkdir(path):
             return
         raise e
 
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(size) < 1024:
+            return '%.1f%s' % (size, unit)
+        size /= 1024.0
+    return '%.1fTB' % size
+
 def to_unicode(x):
     if type(x) is str:
         return x.decode('utf-8')
     return x
 
-def retry(func, *args, **kwargs):
-    for i in range(RETRY_COUNT):
-        try:
-            return func(*args, **kwargs)
-        except Exception, e:
-            print >>sys.stderr, '[retry] %s(%s, %s) failed @ round %d' % (func, str(args), str(kwargs), i)
-            print >>sys.stderr, traceback.format_exc()
-            if i == RETRY_COUNT - 1:
-                raise
-            time.sleep(SLEEP_INTERVAL)
+#cosfs和sdk(分片上传)共享的重试策略：指数退避+随机等待，按错误码分类，共用一个重试预算
+RETRY_POLICY = RetryPolicy(max_attempts=RETRY_COUNT, base_delay=SLEEP_INTERVAL, max_delay=MAX_SLEEP_INTERVAL)
+
+def classify_error(e):
+    #CosFSException(-1, ...)是cosfs自己发现的错误(大小不符、数据不完整等)，可以重试
+    if isinstance(e, CosFSException) and e[0] == -1:
+        return RETRYABLE
+    return classify_exception(e)
 
-def download_file(url, filename, headers=None):
-    r = requests.get(url, headers=headers, stream=True)
+def retry(func, *args, **kwargs):
+    #已存在、参数错误等重试也不会成功的错误直接抛出
+    def on_error(e, i, kind):
+        print >>sys.stderr, '[retry] %s(%s, %s) failed @ round %d, %s error' % (func, str(args), str(kwargs), i, kind)
+        print >>sys.stderr, traceback.format_exc()
+    return RETRY_POLICY.call(func, args, kwargs, classifier=classify_error, on_error=on_error)
+
+#rate_limiter: qcloud_cos的RateLimiter，下载请求也计入请求数限速，数据按下载限速读取
+#metrics: qcloud_cos的Metrics，按download统计耗时和流量；stream=True的成功响应在iter_chunks读完(或放弃)时才记录
+def rate_limited_get(session, url, rate_limiter=None, metrics=None, **kwargs):
+    if rate_limiter is not None:
+        rate_limiter.acquire_request()
+    timer = RequestTimer('download')
+    try:
+        r = session.get(url, **kwargs)
+    except:
+        timer.mark_failed((TTFB,))
+        if metrics is not None:
+            metrics.record(timer, CosErr.SERVER_ERROR)
+        raise
+    timer.mark(TTFB)
+    if metrics is not None:
+        if kwargs.get('stream') and r.status_code in [200, 206]:
+            r.cosfs_timer = (metrics, timer)
+        else:
+            timer.bytes_in = len(r.content)
+            code = 0 if r.status_code in [200, 206] else CosErr.NETWORK_ERROR
+            metrics.record(timer, code, r.status_code)
+    return r
+
+def iter_chunks(r, chunk_size, rate_limiter=None):
+    chunks = r.iter_content(chunk_size=chunk_size)
+    if rate_limiter is not None:
+        chunks = rate_limiter.iter_download(chunks)
+    if getattr(r, 'cosfs_timer', None) is not None:
+        chunks = timed_chunks(chunks, r.status_code, *r.cosfs_timer)
+    return chunks
+
+def timed_chunks(chunks, status_code, metrics, timer):
+    #没读完就出错或被放弃时记为网络错误
+    code = CosErr.NETWORK_ERROR
+    try:
+        for chunk in chunks:
+            timer.bytes_in += len(chunk)
+            yield chunk
+        code = 0
+    finally:
+        timer.mark(BODY)
+        metrics.record(timer, code, status_code)
+
+def download_file(url, filename, headers=None, session=None, rate_limiter=None, metrics=None):
+    session = session or requests
+    r = rate_limited_get(session, url, rate_limiter, metrics, headers=headers, stream=True)
+    #出错时响应体是错误信息，不能写进文件
+    expected = 206 if headers and 'Range' in headers else 200
+    if r.status_code != expected:
+        raise CosFSException(-1, 'download %s: unexpected status code %d' % (filename, r.status_code))
     with open(filename, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=1024): 
+        for chunk in iter_chunks(r, 1024, rate_limiter):
             if chunk: # filter out keep-alive new chunks
                 f.write(chunk)
         f.flush()
 
-class CosThread(threading.Thread):
-    def __init__(self, tid, queue):
-        threading.Thread.__init__(self)
-        self.tid    = tid
-        self.t_queue= queue
-        self.fail_list = []
-
-    def run(self):
-        print >>sys.stderr, 'Thread %d starts' % (self.tid)
-        while not self.t_queue.empty():
-            func, arg = self.t_queue.get(block=True, timeout=1)
+def download_range(url, filename, begin, end, session=None, rate_limiter=None, metrics=None):
+    session = session or requests
+    r = rate_limited_get(session, url, rate_limiter, metrics, headers={'Range': 'bytes=%d-%d' % (begin, end)}, stream=True)
+    if r.status_code != 206:
+        raise CosFSException(-1, 'range %d-%d: unexpected status code %d' % (begin, end, r.status_code))
+
+    received = 0
+    #每个分片用独立的文件句柄写到自己的偏移处(python2没有os.pwrite)
+    with open(filename, 'r+b') as f:
+        f.seek(begin)
+        for chunk in iter_chunks(r, 64 * 1024, rate_limiter):
+            if chunk:
+                received += len(chunk)
+                f.write(chunk)
+
+    if received != end - begin + 1:
+        raise CosFSException(-1, 'range %d-%d: incomplete, got %d bytes' % (begin, end, received))
+
+def download_file_parallel(url, filename, filesize, part_size=DOWNLOAD_PART_SIZE, nr_thread=NR_DOWNLOAD_THREAD, session=None, rate_limiter=None, metrics=None):
+    with open(filename, 'wb') as f:
+        f.truncate(filesize)
+
+    nr_part = (filesize + part_size - 1) // part_size
+    scheduler = CosScheduler(min(nr_thread, nr_part), order_by_size=False)
+    for begin in range(0, filesize, part_size):
+        end = min(begin + part_size, filesize) - 1
+        scheduler.submit(download_range, (url, filename, begin, end, session, rate_limiter, metrics), TASK_DOWNLOAD, end - begin + 1)
+    #文件预先分配了大小，没下载成功的分片是一段0；重试后仍失败的分片会让run()抛出异常
+    scheduler.run()
+
+class CosRangeReader(object):
+    #按顺序读出cos上的一个文件(有read方法，可以作为UploadStreamRequest的stream)
+    #每次发一个Range请求取part_size字节，请求出错时从已读到的位置重新请求
+    def __init__(self, url, filesize, part_size=DOWNLOAD_PART_SIZE, session=None, rate_limiter=None, metrics=None):
+        self.url = url
+        self.filesize = filesize
+        self.part_size = part_size
+        self.session = session or requests
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.offset = 0 #已经交给调用者的字节数
+        self._pos = 0 #当前Range请求已经收到的位置
+        self._end = 0 #当前Range请求的结束位置(不含)
+        self._chunks = None
+        self._buf = ''
+
+    def read(self, size):
+        parts = []
+        while size > 0 and self.offset < self.filesize:
+            data = retry(self._next_chunk, size)
+            if data:
+                parts.append(data)
+                size -= len(data)
+                self.offset += len(data)
+        return ''.join(parts)
+
+    def _next_chunk(self, size):
+        if self._buf:
+            data, self._buf = self._buf[:size], self._buf[size:]
+            return data
+
+        try:
+            if self._chunks is None:
+                self._pos = self.offset
+                self._end = min(self.offset + self.part_size, self.filesize)
+                r = rate_limited_get(self.session, self.url, self.rate_limiter, self.metrics,
+                                     headers={'Range': 'bytes=%d-%d' % (self.offset, self._end - 1)}, stream=True)
+                if r.status_code != 206:
+                    raise CosFSException(-1, 'range %d-%d: unexpected status code %d' % (self.offset, self._end - 1, r.status_code))
+                self._chunks = iter_chunks(r, 64 * 1024, self.rate_limiter)
+
+            data = next(self._chunks, None)
+            if data is None:
+                raise CosFSException(-1, 'range: incomplete, got %d bytes, expect %d' % (self._pos, self._end))
+            self._pos += len(data)
+            if self._pos >= self._end:
+                #收完后让迭代器正常结束，请求按成功统计
+                next(self._chunks, None)
+                self._chunks = None
+        except:
+            #丢弃当前请求，重试时从self.offset重新请求
+            self.close()
+            raise
+
+        data, self._buf = data[:size], data[size:]
+        return data
+
+    def close(self):
+        if self._chunks is not None:
+            self._chunks.close()
+            self._chunks = None
+
+class CosScheduler(object):
+    #用nr_thread个worker执行任务，按类别的优先级和并发上限挑选任务，同一类别里大文件优先，缩短最后的长尾
+    #任务都在一个堆里，空闲的worker直接取下一个，不需要每个线程各自的队列
+    def __init__(self, nr_thread=NR_THREAD, classes=None, order_by_size=True, progress_interval=0):
+        self.nr_thread = nr_thread
+        self.classes = dict(TASK_CLASSES)
+        self.classes.update(classes or {})
+        self.order_by_size = order_by_size
+        #大于0时每隔这么多秒往stderr输出一次进度
+        self.progress_interval = progress_interval
+
+        self._cond = threading.Condition()
+        self._heaps = {}    #类别 => [(-size, seq, func, args)]
+        self._running = {}  #类别 => 正在执行的任务数
+        self._seq = itertools.count()
+        self._done = False  #producer已经结束
+        self._aborted = False
+        self._fail_list = []
+        self._stats = {'queued': 0, 'finished': 0, 'failed': 0, 'queued_bytes': 0, 'finished_bytes': 0}
+
+    def submit(self, func, args, kind=TASK_DEFAULT, size=0):
+        #size: 任务处理的字节数，用于排序和统计进度
+        item = (-size if self.order_by_size else 0, next(self._seq), func, args, size)
+        with self._cond:
+            heapq.heappush(self._heaps.setdefault(kind, []), item)
+            self._stats['queued'] += 1
+            self._stats['queued_bytes'] += size
+            self._cond.notify()
+
+    def get_stats(self):
+        with self._cond:
+            return dict(self._stats)
+
+    def run(self, producer=None):
+        #producer: 在当前线程执行、边执行边submit任务的函数，worker会等它结束且任务都完成后才退出
+        threads = []
+        for i in range(self.nr_thread):
+            t = threading.Thread(target=self._worker, args=(i + 1,))
+            t.start()
+            threads.append(t)
+
+        progress = None
+        if self.progress_interval > 0:
+            progress = threading.Thread(target=self._report_progress)
+            progress.daemon = True
+            progress.start()
+
+        producer_exc = None
+        try:
+            if producer is not None:
+                try:
+                    producer()
+                except Exception:
+                    producer_exc = sys.exc_info()
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+            #带超时的join才能响应Ctrl-C
+            for t in threads:
+                while t.is_alive():
+                    t.join(1)
+        except KeyboardInterrupt:
+            with self._cond:
+                self._done = True
+                self._aborted = True
+                self._cond.notify_all()
+            raise
+
+        if progress is not None:
+            self._print_progress()
+
+        #所有worker都结束后再读失败列表
+        if self._fail_list:
+            print >>sys.stderr, "=== FAILED LIST ==="
+            for func, arg, exc in self._fail_list:
+                print >>sys.stderr, " %s => %s" % (str(arg), str(exc))
+            raise Exception("%d entries failed" % len(self._fail_list))
+
+        if producer_exc is not None:
+            raise producer_exc[0], producer_exc[1], producer_exc[2]
+
+    def _next_task(self):
+        #调用时需持有self._cond；挑选优先级最高、还没到并发上限的类别里最大的任务
+        best = None
+        for kind, heap in self._heaps.items():
+            if not heap:
+                continue
+            priority, limit = self.classes.get(kind, self.classes[TASK_DEFAULT])
+            if self._running.get(kind, 0) >= limit:
+                continue
+            key = (priority,) + heap[0][:2]
+            if best is None or key < best[0]:
+                best = (key, kind)
+        if best is None:
+            return None
+        kind = best[1]
+        self._running[kind] = self._running.get(kind, 0) + 1
+        return kind, heapq.heappop(self._heaps[kind])
+
+    def _worker(self, tid):
+        while True:
+            with self._cond:
+                while True:
+                    if self._aborted:
+                        return
+                    task = self._next_task()
+                    if task is not None:
+                        break
+                    #正在执行的任务结束后可能解除并发限制，所以要等它们都结束
+                    if self._done and not any(self._heaps.values()) and not any(self._running.values()):
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait(1)
+
+            kind, (_, _, func, args, size) = task
+            failed = False
             try:
-                retry(func, *arg)
+                retry(func, *args)
             except Exception, exc:
-                self.fail_list.append([func, arg, exc])
-        print >>sys.stderr, 'Thread %d ends' % (self.tid)
-
-    @classmethod
-    def start_new(cls, tid, queue):
-        t = cls(tid, queue)
-        t.start()
-        return t
+                failed = True
+                with self._cond:
+                    self._fail_list.append([func, args, exc])
+
+            with self._cond:
+                self._running[kind] -= 1
+                self._stats['finished'] += 1
+                self._stats['finished_bytes'] += size
+                if failed:
+                    self._stats['failed'] += 1
+                self._cond.notify_all()
+
+    def _report_progress(self):
+        begin_at = time.time()
+        last_at, last_bytes = begin_at, 0
+        while True:
+            time.sleep(self.progress_interval)
+            with self._cond:
+                if self._done and not any(self._heaps.values()) and not any(self._running.values()):
+                    return
+            stats = self.get_stats()
+            now = time.time()
+            speed = (stats['finished_bytes'] - last_bytes) / (now - last_at)
+            last_at, last_bytes = now, stats['finished_bytes']
+            self._print_progress(stats, speed)
+
+    def _print_progress(self, stats=None, speed=None):
+        stats = stats or self.get_stats()
+        line = '[progress] tasks: %d/%d, failed: %d, size: %s/%s' % (stats['finished'], stats['queued'],
+            stats['failed'], format_size(stats['finished_bytes']), format_size(stats['queued_bytes']))
+        if speed is not None:
+            line += ', speed: %s/s' % format_size(speed)
+        sys.stderr.write(line + '\n')
+
+
+class CosWalker(object):
+    #用多个线程广度优先地遍历cos目录，每列出一个目录就把其中的文件/子目录交给回调
+    def __init__(self, fs, nr_thread=NR_WALK_THREAD):
+        self.fs = fs
+        self.nr_thread = nr_thread
+
+    def walk(self, root, on_file, on_dir=None, whole_dir=False):
+        #on_dir(dirname, level): 在列出dirname之前调用，dirname以/结尾
+        #on_file(filename, entry, level): 对每个文件调用
+        #回调会在多个线程里并发执行
+        #whole_dir: 一个目录全部列完后才回调其中的文件和子目录；回调会删除文件时需要，否则翻页的位置会因为删除而错开，漏掉文件
+        root = to_unicode(root)
+        if not root.endswith(u'/'):
+            root += u'/'
+
+        dir_queue = Queue.Queue()
+        errors = []
+
+        def list_one(dirname, level):
+            entries = self.fs.iter_dir(dirname, retry_page=True)
+            if whole_dir:
+                entries = list(entries)
+            for entry in entries:
+                name = dirname + entry['name']
+                if self.fs.isFile(entry):
+                    on_file(name, entry, level)
+                else:
+                    if on_dir is not None:
+                        on_dir(name + u'/', level + 1)
+                    dir_queue.put((name + u'/', level + 1))
+
+        def worker():
+            while True:
+                item = dir_queue.get()
+                try:
+                    if item is None:
+                        return
+                    list_one(*item)
+                except Exception, e:
+                    errors.append((item[0], e))
+                finally:
+                    dir_queue.task_done()
+
+        if on_dir is not None:
+            on_dir(root, 0)
+        dir_queue.put((root, 0))
 
-    @classmethod
-    def execute(cls, queue, nr_thread=NR_THREAD):
         threads = []
-        for i in range(nr_thread):
-            threads.append(CosThread.start_new(i + 1, queue))
+        for i in range(self.nr_thread):
+            t = threading.Thread(target=worker)
+            t.start()
+            threads.append(t)
 
-        fail_list = []
+        dir_queue.join()
+        for t in threads:
+            dir_queue.put(None)
         for t in threads:
-            fail_list += t.fail_list
             t.join()
 
-        if fail_list:
-            print >>sys.stderr, "=== FAILED LIST ==="
-            for func, arg, exc in fail_list:
-                print >>sys.stderr, " %s => %s" % (str(arg), str(exc))
-            raise Exception("%d entries failed" % len(fail_list))
+        if errors:
+            for dirname, e in errors:
+                print >>sys.stderr, '[walk] list %s failed: %s' % (dirname.encode('utf-8'), str(e))
+            raise CosFSException(-1, '%d directories failed to list' % len(errors))
+
+
+class CosAsyncBatch(object):
+    #在AsyncCosClient的事件循环上并发执行一批小请求，不占用线程；可以在多个线程里submit
+    #失败的请求按RETRY_POLICY分轮重试：一轮的结果都回来后，等待其中最长的退避时间，再重发这一轮里可以重试的请求
+    def __init__(self, client):
+        self.client = client
+        self._lock = threading.Lock()
+        self._calls = [] #[func, request, 第几次尝试, CosFuture]
+
+    def submit(self, func, request):
+        #func: client的方法，如client.del_file
+        future = func(request)
+        with self._lock:
+            self._calls.append([func, request, 0, future])
+
+    def wait(self):
+        #等所有请求结束，返回成功的数量和最终失败的[(request, ret)]
+        nr_ok, failed = 0, []
+        with self._lock:
+            calls, self._calls = self._calls, []
+        while calls:
+            retries, delay = [], 0
+            for func, request, attempt, future in calls:
+                ret = future.result()
+                seconds = RETRY_POLICY.retry_delay(ret, attempt)
+                if seconds is not None:
+                    retries.append((func, request, attempt + 1))
+                    delay = max(delay, seconds)
+                elif ret['code'] == 0:
+                    nr_ok += 1
+                else:
+                    failed.append((request, ret))
+            if retries:
+                RETRY_POLICY.sleep(delay)
+            calls = [[func, request, attempt, func(request)] for func, request, attempt in retries]
+        return nr_ok, failed
 
 
 class CosFSException(Exception):
     pass
 
 class CosFS(object):
-    def __init__(self, appid, secret_id, secret_key, bucket, region = None):
+    def __init__(self, appid, secret_id, secret_key, bucket, region = None, journal_dir = JOURNAL_DIR, meta_cache = None):
         self.appid = appid
         self.secret_id = secret_id
         self.secret_key = secret_key
         self.bucket = bucket
+        #MetaCache实例，None表示不缓存
+        self.meta_cache = meta_cache
+        #大于0时批量任务每隔这么多秒输出一次进度
+        self.progress_interval = 0
+        #rmdir -r在事件循环上的删除并发数，0表示用线程池
+        self.async_delete = NR_ASYNC_DELETE
         if region:
             self.cos_client = CosClient(appid, secret_id, secret_key, region=region)
         else:
             self.cos_client = CosClient(appid, secret_id, secret_key)
-
-    def list_dir(self, path=u'/'):
+        config = self.cos_client.get_config()
+        config.set_journal_dir(journal_dir)
+        config.set_retry_policy(RETRY_POLICY)
+        #所有请求(包括下载)共享一个连接池，每个线程都能拿到连接
+        config.set_pool_size(10, NR_THREAD * NR_DOWNLOAD_THREAD)
+        self.cos_client.set_config(config)
+        self.http_session = self.cos_client.get_http_session()
+        #请求数和上传/下载带宽的限速，sdk的请求和cosfs自己的下载共用
+        self.rate_limiter = config.get_rate_limiter()
+        #每个请求各阶段的耗时、流量和错误码，sdk的请求和cosfs自己的下载共用
+        self.metrics = config.get_metrics()
+
+    def iter_dir(self, path=u'/', retry_page=False):
+        #逐页列出目录，每收到一页就yield其中的文件/子目录(子目录名去掉末尾的/)
+        #retry_page: 单页失败时用retry()重试，已经yield的部分不会重复
         path = to_unicode(path)
 
         prefix = u''
@@ -141,16 +589,39 @@ class CosFS(object):
         if not path.endswith(u'/'):
             path += u'/'
 
+        #前缀匹配的结果不缓存
+        use_cache = self.meta_cache is not None and not prefix
+        if use_cache:
+            dataset = self.meta_cache.get(KIND_LIST, self.bucket, path)
+            if dataset is not None:
+                for entry in dataset['infos']:
+                    yield entry
+                return
+
+        #目录太大时不缓存，保证内存占用不随目录大小增长
+        cached_infos = [] if use_cache else None
         context=u''
-        arr_data = []
         while True:
-            request = ListFolderRequest(self.bucket, path, prefix=prefix, context=context)
-            result = self.cos_client.list_folder(request)
-            if result['code'] != 0:
-                raise CosFSException(result['code'], result['message'] + ': ' + path)
+            if retry_page:
+                data = retry(self._list_page, path, prefix, context)
+            else:
+                data = self._list_page(path, prefix, context)
+
+            for entry in data['infos']:
+                if not self.isFile(entry):
+                    entry['name'] = entry['name'].rstrip(u'/')
+
+            if cached_infos is not None:
+                #列表里带了下载地址的文件，顺便作为stat结果缓存
+                self.meta_cache.put_many(KIND_STAT, self.bucket, [(path + entry['name'], entry)
+                    for entry in data['infos'] if self.isFile(entry) and 'source_url' in entry])
+                cached_infos += data['infos']
+                if len(cached_infos) > MAX_CACHED_LIST:
+                    cached_infos = None
+
+            for entry in data['infos']:
+                yield entry
 
-            data = result['data']
-            arr_data.append(data)
             has_more = False
             if 'has_more' in data:
                 has_more = data['has_more']
@@ -162,28 +633,35 @@ class CosFS(object):
             else:
                 break
 
+        if cached_infos is not None:
+            dataset = {'dircount': 0, 'filecount': 0, 'infos': cached_infos}
+            for entry in cached_infos:
+                dataset['filecount' if self.isFile(entry) else 'dircount'] += 1
+            self.meta_cache.put(KIND_LIST, self.bucket, path, dataset)
+
+    def _list_page(self, path, prefix, context):
+        request = ListFolderRequest(self.bucket, path, prefix=prefix, context=context)
+        result = self.cos_client.list_folder(request)
+        if result['code'] != 0:
+            raise CosFSException(result['code'], result['message'] + ': ' + path)
+        return result['data']
+
+    def list_dir(self, path=u'/'):
         dataset = {'dircount': 0, 'filecount': 0, 'infos': []}
-        for data in arr_data:
-            if 'filecount' not in data:
-                data['filecount'] = 0
-                data['dircount'] = 0
-                for entry in data['infos']:
-                    if self.isFile(entry):
-                        data['filecount'] += 1
-                    else:
-                        entry['name'] = entry['name'].rstrip(u'/')
-                        data['dircount'] += 1
-            dataset['dircount'] += data['dircount']
-            dataset['filecount'] += data['filecount']
-            dataset['infos'] += data['infos']
+        for entry in self.iter_dir(path):
+            if self.isFile(entry):
+                dataset['filecount'] += 1
+            else:
+                dataset['dircount'] += 1
+            dataset['infos'].append(entry)
         return dataset
 
     def ls(self, path=u'/', detail=False, recursive=False):
-        content = self.list_dir(path)
         if recursive:
             print '%s:' % (path.encode('utf-8'))
 
-        for entry in content['infos']:
+        subdirs = []
+        for entry in self.iter_dir(path):
             isFile = self.isFile(entry)
             name = entry['name'].encode('utf-8')
             if detail:
@@ -191,24 +669,114 @@ class CosFS(object):
                 print './%s%s: [size:%d] [created_at:%s]' % (name, '' if isFile else '/', entry['filesize'] if isFile else 0, ctime)
             else:
                 print name + ('' if isFile else '/')
+            if recursive and not isFile:
+                subdirs.append(entry['name'])
 
-        if recursive and content['dircount'] > 0:
+        if recursive and subdirs:
             print ''
-            for info in content['infos']:
-                if 'sha' not in info:
-                    self.ls(path.rstrip(u'/') + u'/' + info['name'], detail, recursive)
-                    print ''
+            for name in subdirs:
+                self.ls(path.rstrip(u'/') + u'/' + name, detail, recursive)
+                print ''
 
     def mv(self, src, dest, overwrite=False):
         src = to_unicode(src)
         dest = to_unicode(dest)
         if dest.endswith(u'/'):
             dest += os.path.basename(src)
-        request = MoveFileRequest(self.bucket, src, dest)
+        request = MoveFileRequest(self.bucket, src, dest, overwrite)
         result = self.cos_client.move_file(request)
+        self.invalidate_cache(src, dest)
         if result['code'] != 0:
             raise CosFSException(result['code'], result['message'])
     
+    #将cos上src目录移动到dest目录下，src/dest末尾/的含义和uploadDir相同(src以/结尾时移动其中的内容，保留src)
+    #先列出整个源目录生成改名计划再执行：边列边移动，分页列表会漏掉文件
+    #计划和进度保存在plan_dir里，中途失败后重新执行同样的命令会接着移动剩下的文件
+    def mvdir(self, src, dest, overwrite=False, plan_dir=MVPLAN_DIR):
+        begin_at = time.time()
+        src = to_unicode(src)
+        dest = to_unicode(dest)
+        keep_src = src.endswith(u'/')
+        if not dest.endswith(u'/'):
+            dest += u'/'
+        if not keep_src:
+            dest += os.path.basename(src) + u'/'
+            src += u'/'
+        if dest.startswith(src):
+            raise CosFSException(-1, "cannot move %s into itself" % src)
+
+        plan = MovePlan(plan_dir, self.bucket, src, dest)
+        if plan.load():
+            print >>sys.stderr, '[mvdir] resume from %s, %d/%d files moved' % (plan.path, len(plan.done), len(plan.files))
+        else:
+            dirs, files = [], []
+            lock = threading.Lock()
+            def on_dir(dirname, level):
+                with lock:
+                    dirs.append((dirname[len(src):], level))
+
+            def on_file(filename, entry, level):
+                with lock:
+                    files.append(filename[len(src):])
+
+            CosWalker(self).walk(src, on_file, on_dir)
+            plan.create(dirs, files)
+            print >>sys.stderr, '[mvdir] plan: %d dirs, %d files' % (len(dirs), len(files))
+
+        #目标目录先逐层创建好，移动文件时不用关心父目录是否存在
+        dirs_by_level = {}
+        for relpath, level in plan.dirs:
+            dirs_by_level.setdefault(level, []).append(relpath)
+        for level in sorted(dirs_by_level):
+            scheduler = self.new_scheduler()
+            for relpath in dirs_by_level[level]:
+                scheduler.submit(self.mkdir, (dest + relpath,), TASK_MKDIR)
+            scheduler.run()
+
+        def moveFile(i, relpath):
+            try:
+                self.mv(src + relpath, dest + relpath, overwrite)
+            except CosFSException, e:
+                #上次已经移动成功(响应丢失或者没来得及记录)
+                if e[0] != CODE_NOT_EXIST or not self.exists(dest + relpath):
+                    raise
+            plan.mark_done(i)
+
+        scheduler = self.new_scheduler()
+        for i, relpath in plan.pending():
+            scheduler.submit(moveFile, (i, relpath), TASK_MOVE)
+        try:
+            scheduler.run()
+        except Exception:
+            if plan.path is not None:
+                print >>sys.stderr, '[mvdir] %d/%d files moved, run the same command again to resume' % (len(plan.done), len(plan.files))
+            raise
+        finally:
+            plan.close()
+
+        #源目录已经空了，从最深的一层开始逐层删除；删不掉(比如期间有新文件写入)只提示，不算失败
+        for level in sorted(dirs_by_level, reverse=True):
+            scheduler = self.new_scheduler()
+            for relpath in dirs_by_level[level]:
+                if relpath or not keep_src:
+                    scheduler.submit(self.delFolder, (src + relpath,), TASK_DELETE)
+            try:
+                scheduler.run()
+            except Exception, e:
+                print >>sys.stderr, '[mvdir] failed to remove source dirs: %s' % e
+
+        plan.remove()
+        print >>sys.stderr, '[mvdir] moved %d files in %.3fs' % (len(plan.files), time.time() - begin_at)
+
+    def exists(self, path):
+        try:
+            self.stat(path)
+            return True
+        except CosFSException, e:
+            if e[0] == CODE_NOT_EXIST:
+                return False
+            raise
+
     def download(self, remote, local, overwrite=False):
         local = to_unicode(local)
         remote = to_unicode(remote)
@@ -227,12 +795,88 @@ class CosFS(object):
 
         fileattr = self.stat(remote)
         url = fileattr['source_url'] + '?sign=' + fileattr['sign']
-        download_file(url, local)
+        filesize = int(fileattr['filesize'])
+        try:
+            if filesize >= PARALLEL_DOWNLOAD_THRESHOLD:
+                download_file_parallel(url, local, filesize, session=self.http_session, rate_limiter=self.rate_limiter, metrics=self.metrics)
+            else:
+                download_file(url, local, session=self.http_session, rate_limiter=self.rate_limiter, metrics=self.metrics)
 
-    def cat(self, path):
+            if os.path.getsize(local) != filesize:
+                raise CosFSException(-1, 'size mismatch: %s has %d bytes, expect %d' % (local, os.path.getsize(local), filesize))
+        except:
+            #删除不完整的文件，以便重试
+            if os.path.exists(local):
+                os.unlink(local)
+            raise
+
+    #byte_range: (begin, end)闭区间，begin为None时end表示最后的字节数(同http的Range: bytes=-N)
+    def cat(self, path, pack_root=None, byte_range=None):
+        if pack_root is not None:
+            return self.catPacked(path, pack_root)
+        if byte_range is not None:
+            return self.catRange(path, byte_range)
         fileattr = self.stat(to_unicode(path))
         url = fileattr['source_url'] + '?sign=' + fileattr['sign']
-        download_file(url, '/dev/stdout')
+        download_file(url, '/dev/stdout', session=self.http_session, rate_limiter=self.rate_limiter, metrics=self.metrics)
+
+    #只读的文件对象，按块用Range请求随机读取，带LRU缓存和顺序读预读(见cosfs_file)
+    def open(self, path, block_size=BLOCK_SIZE, cache_blocks=CACHE_BLOCKS):
+        path = to_unicode(path)
+        fileattr = self.stat(path)
+        url = fileattr['source_url'] + '?sign=' + fileattr['sign']
+        return CosFile(lambda begin, end: retry(self.fetchRange, url, begin, end), int(fileattr['filesize']), path, block_size, cache_blocks)
+
+    #取文件[begin, end]闭区间的数据，url是带签名的下载地址
+    def fetchRange(self, url, begin, end):
+        r = rate_limited_get(self.http_session, url, self.rate_limiter, self.metrics,
+                             headers={'Range': 'bytes=%d-%d' % (begin, end)}, stream=True)
+        if r.status_code != 206:
+            raise CosFSException(-1, 'range %d-%d: unexpected status code %d' % (begin, end, r.status_code))
+        data = ''.join(iter_chunks(r, 64 * 1024, self.rate_limiter))
+        if len(data) != end - begin + 1:
+            raise CosFSException(-1, 'range %d-%d: incomplete, got %d bytes' % (begin, end, len(data)))
+        return data
+
+    def catRange(self, path, byte_range):
+        f = self.open(path)
+        begin, end = byte_range
+        if begin is None:
+            begin, end = max(f.size - end, 0), f.size - 1
+        f.seek(begin)
+        left = min(end, f.size - 1) - begin + 1
+        while left > 0:
+            data = f.read(min(left, f.block_size))
+            if not data:
+                break
+            sys.stdout.write(data)
+            left -= len(data)
+        f.close()
+
+    #输出cpdir --pack打包上传到pack_root下的一个小文件，只发一个Range请求
+    def catPacked(self, path, pack_root):
+        path = to_unicode(path)
+        pack_root = to_unicode(pack_root).rstrip(u'/')
+        if not path.startswith(pack_root + u'/'):
+            raise CosFSException(-1, '%s is not under %s' % (path, pack_root))
+
+        index = self.loadPackIndex(pack_root)
+        if index is None:
+            raise CosFSException(CODE_NOT_EXIST, 'no pack index in %s' % pack_root)
+        entry = index.get(path[len(pack_root) + 1:])
+        if entry is None:
+            raise CosFSException(CODE_NOT_EXIST, '%s not found in pack index' % path)
+
+        name, offset, size, mtime = entry
+        if size == 0:
+            return
+        url = self.signedUrl(pack_root + u'/' + PACK_DIR + u'/' + name)
+        r = rate_limited_get(self.http_session, url, self.rate_limiter, self.metrics,
+                             headers={'Range': 'bytes=%d-%d' % (offset, offset + size - 1)}, stream=True)
+        if r.status_code != 206:
+            raise CosFSException(-1, 'unexpected status code %d' % r.status_code)
+        for chunk in iter_chunks(r, 64 * 1024, self.rate_limiter):
+            sys.stdout.write(chunk)
 
     def upload(self, local, remote, overwrite=False, silent=False):
         local = to_unicode(local)
@@ -244,24 +888,78 @@ class CosFS(object):
         if overwrite:
             request.set_insert_only(0)
         result = self.cos_client.upload_file(request)
+        self.invalidate_cache(remote)
+        if overwrite and result['code'] == CODE_ERR_OFF_GOBACK:
+            print >>sys.stderr, "fix tencent bug: remove remote file when ErrOffGoBack occurs"
+            """
+            上传出现这个4024的错误之后，覆盖（insertonly=0）参数也不能成功，只能删除文件后重新上传
+            建议您将分片大小改为1M 分片上传之间sleep 100ms 出现错误的概率会小很多
+            抱歉，这个问题暂时无法彻底解决，给您带来了不便。
+            """
+            #-4024重试也不会成功(retry不会重试)，删除后在这里重新上传。SDK覆盖失败时自己删过一次，文件可能已经不在了
+            try:
+                self.rm(remote)
+            except CosFSException, e:
+                if e[0] != CODE_NOT_EXIST:
+                    raise
+            result = self.cos_client.upload_file(request)
+            self.invalidate_cache(remote)
+        if result['code'] != 0:
+            if result['code'] == CODE_SAME_FILE:
+                if not silent:
+                    print >>sys.stderr, "skipped: same file on COS"
+                return
+            raise CosFSException(result['code'], result['message'])
+
+    #cos内复制文件。v4接口没有服务端复制，边按Range下载边分片上传，数据只经过内存，不落本地磁盘
+    def copy(self, src, dest, overwrite=False, silent=False):
+        src = to_unicode(src)
+        dest = to_unicode(dest)
+        if dest.endswith(u'/'):
+            dest += os.path.basename(src)
+        if src == dest:
+            raise CosFSException(CODE_SAME_FILE, 'cannot copy %s to itself' % src)
+
+        fileattr = self.stat(src)
+        url = fileattr['source_url'] + '?sign=' + fileattr['sign']
+        filesize = int(fileattr['filesize'])
+        reader = CosRangeReader(url, filesize, session=self.http_session, rate_limiter=self.rate_limiter, metrics=self.metrics)
+
+        request = UploadStreamRequest(self.bucket, dest, reader, filesize, max_con=NR_STREAM_SLICE_THREAD)
+        request.set_biz_attr(to_unicode(fileattr.get('biz_attr') or u''))
+        if overwrite:
+            request.set_insert_only(0)
+        try:
+            result = self.cos_client.upload_stream(request)
+        finally:
+            reader.close()
+        self.invalidate_cache(dest)
         if result['code'] != 0:
             if result['code'] == CODE_SAME_FILE:
                 if not silent:
                     print >>sys.stderr, "skipped: same file on COS"
                 return
-            if overwrite and result['code'] == CODE_ERR_OFF_GOBACK:
-                print >>sys.stderr, "fix tencent bug: remove remote file when ErrOffGoBack occurs"
-                """
-                上传出现这个4024的错误之后，覆盖（insertonly=0）参数也不能成功，只能删除文件后重新上传
-                建议您将分片大小改为1M 分片上传之间sleep 100ms 出现错误的概率会小很多
-                抱歉，这个问题暂时无法彻底解决，给您带来了不便。
-                """
-                self.rm(remote)
+            raise CosFSException(result['code'], result['message'])
+
+    #把流(如sys.stdin)里的数据上传到remote，不落本地磁盘
+    #size: 数据的总大小；分片上传开始前就要告诉cos文件大小，为None时只支持不超过20MB的数据
+    #max_con: 分片上传的并发数
+    def put(self, stream, remote, size=None, overwrite=False, max_con=NR_STREAM_SLICE_THREAD):
+        remote = to_unicode(remote)
+        if remote.endswith(u'/'):
+            raise CosFSException(-1, "please specify the remote file name")
+
+        request = UploadStreamRequest(self.bucket, remote, stream, size, max_con=max_con)
+        if overwrite:
+            request.set_insert_only(0)
+        result = self.cos_client.upload_stream(request)
+        self.invalidate_cache(remote)
+        if result['code'] != 0:
             raise CosFSException(result['code'], result['message'])
 
     def cp(self, src, dest, overwrite=False):
-        if src.startswith('cos:') and dest.startswith('cos:'): #move in cos
-            raise CosFSException(-1, "not supported yet, use mv please")
+        if src.startswith('cos:') and dest.startswith('cos:'): #copy in cos
+            self.copy(src[4:], dest[4:], overwrite)
         elif src.startswith('cos:'): #download
             self.download(src[4:], dest, overwrite)
         elif dest.startswith('cos:'): #upload
@@ -269,47 +967,84 @@ class CosFS(object):
         else:
             raise CosFSException(-1, "at least one of src/dest should start with `cos:`")
 
-    def cpdir(self, src, dest, conflict=CONFLICT_ERROR):
+    #pack=True时小文件打包上传(见cosfs_pack)，下载时按索引从包里取出
+    def cpdir(self, src, dest, conflict=CONFLICT_ERROR, pack=False):
         begin_at = time.time()
         src = to_unicode(src)
         dest = to_unicode(dest)
-        if src.startswith(u'cos:') and dest.startswith(u'cos:'):
-            raise CosFSException(-1, "not supported")
+        if src.startswith(u'cos:') and dest.startswith(u'cos:'): #copy in cos
+            if pack:
+                raise CosFSException(-1, "--pack is not supported when copying in cos")
+            self.copyDir(src[4:], dest[4:], conflict)
         elif src.startswith(u'cos:'): #download
-            self.downloadDir(src[4:], dest, conflict)
+            self.downloadDir(src[4:], dest, conflict, pack)
         elif dest.startswith(u'cos:'): #upload
-            self.uploadDir(src, dest[4:], conflict)
+            self.uploadDir(src, dest[4:], conflict, pack)
         else:
             raise CosFSException(-1, "at least one of src/dest should start with `cos:`")
         usage = time.time() - begin_at
-        #print '[Time Usage: %.6f]' % usage
+        print >>sys.stderr, '[cpdir] finished in %.3fs' % usage
 
     #将[cos上remote目录里]的内容下载到[本地local目录里]，如果local目录不存在，会被创建
-    def downloadDir(self, remote, local, conflict):
+    def downloadDir(self, remote, local, conflict, pack=False):
         remote = remote.rstrip(u'/')
         local = local.rstrip(u'/')
-
-        file_queue = Queue.Queue()
-        def walk(path = u'/', level = 0):
-            print '[mkdir] ' + ' ' * level + local + path
+        overwrite = conflict == CONFLICT_OVERWRITE
+
+        pack_dir = remote + u'/' + PACK_DIR + u'/'
+        index = None
+        if pack:
+            index = self.loadPackIndex(remote)
+            if index is None:
+                raise CosFSException(CODE_NOT_EXIST, 'no pack index in %s' % remote)
+
+        scheduler = self.new_scheduler()
+        #回调在多个线程里执行，用一次write输出整行，避免print的内容和换行被其它线程打断
+        def on_dir(dirname, level):
+            if pack and dirname.startswith(pack_dir):
+                return
+            path = dirname[len(remote):]
+            sys.stdout.write(('[mkdir] ' + ' ' * level + local + path + '\n').encode('utf-8'))
             localMkdir(local + path)
 
-            content = self.list_dir(remote + path)
-
-            for entry in content['infos']:
-                name = path + entry['name'].encode('utf-8')
-                if self.isFile(entry):
-                    print '[copy]  ' + ' ' * level + local + name
-                    overwrite = conflict == CONFLICT_OVERWRITE
-                    file_queue.put([self.download, (remote + name, local + name, overwrite)])
-                else:
-                    walk(name + '/', level + 1)
-
-        walk()
-        CosThread.execute(file_queue)
+        def on_file(filename, entry, level):
+            if pack and filename.startswith(pack_dir):
+                return
+            name = filename[len(remote):]
+            sys.stdout.write(('[copy]  ' + ' ' * level + local + name + '\n').encode('utf-8'))
+            scheduler.submit(self.download, (remote + name, local + name, overwrite), TASK_DOWNLOAD, int(entry['filesize']))
+
+        def restorePack(name, members):
+            existed = set(m for m in members if os.path.exists(os.path.join(local, m[0])))
+            if not overwrite:
+                members = [m for m in members if m not in existed]
+            ranges = plan_ranges(members)
+            url = self.signedUrl(pack_dir + name) if ranges else None
+            for begin, end, group in ranges:
+                sys.stdout.write(('[unpack] %s%s bytes %d-%d, %d files\n' % (pack_dir, name, begin, end, len(group))).encode('utf-8'))
+                chunks = []
+                if end > begin:
+                    r = rate_limited_get(self.http_session, url, self.rate_limiter, self.metrics,
+                                         headers={'Range': 'bytes=%d-%d' % (begin, end - 1)}, stream=True)
+                    if r.status_code != 206:
+                        raise CosFSException(-1, 'unexpected status code %d' % r.status_code)
+                    chunks = iter_chunks(r, 64 * 1024, self.rate_limiter)
+                extract_members(chunks, begin, group, local)
+            if existed and not overwrite:
+                raise CosFSException(-1, '%d local files exist, e.g. %s' % (len(existed), os.path.join(local, min(existed)[0])))
+
+        #边遍历边下载，打包的文件每个包提交一个任务
+        walker = CosWalker(self)
+        def producer():
+            walker.walk(remote + u'/', on_file, on_dir)
+            if pack:
+                for name, members in index.group_by_pack().items():
+                    scheduler.submit(restorePack, (name, members), TASK_DOWNLOAD, sum(m[2] for m in members))
+
+        scheduler.run(producer=producer)
         print >>sys.stderr, "[download finished]"
 
-    def uploadDir(self, local, remote, conflict):
+    def uploadDir(self, local, remote, conflict, pack=False):
         if not remote.endswith(u'/'):
             remote += u'/'
 
@@ -339,12 +1074,35 @@ class CosFS(object):
                     return
                 raise
 
-        file_queue = Queue.Queue()
+        scheduler = self.new_scheduler()
+
+        if pack:
+            index = self.loadPackIndex(remote) or PackIndex()
+            pack_dir = remote + PACK_DIR + u'/'
+            retry(self.mkdir, pack_dir)
+            packed_existed = []
+            #还没上传成功的tar文件，失败时scheduler会重试，全部结束后再删除剩下的
+            pending_packs = set()
+
+            def uploadPack(name, path, members):
+                print >>sys.stderr, '[uploadPack] %s (%d files) => %s' % (path, len(members), pack_dir + name)
+                #包名每次都不同，上一次尝试可能已经传上去了，覆盖即可
+                self.upload(path, pack_dir + name, overwrite=True, silent=True)
+                index.add_pack(name, os.path.getsize(path), members)
+                os.unlink(path)
+                pending_packs.discard(path)
+
+            def on_sealed(name, path, members):
+                pending_packs.add(path)
+                scheduler.submit(uploadPack, (name, path, members), TASK_UPLOAD, os.path.getsize(path))
+
+            #每次上传的包名都不同，不会覆盖索引里还在用的包
+            writer = PackWriter(u'pack-%s-%s-' % (time.strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8]), on_sealed)
 
         def process_dir(arg, dirname, filelist):
             dir_suffix = dirname[len(local):]
             remote_dir = remote + dir_suffix
-            file_queue.put([self.mkdir, (remote_dir,)])
+            scheduler.submit(self.mkdir, (remote_dir,), TASK_MKDIR)
             print >>sys.stderr, '[doUpload] queue for mkdir %s' % remote_dir
             for filename in filelist:
                 localfile = dirname.rstrip(u'/') + u'/' + filename
@@ -354,22 +1112,262 @@ class CosFS(object):
                     print >>sys.stderr, '[doUpload] skip symlink %s' % (localfile)
                     continue
                 remotefile = remote_dir.rstrip(u'/') + u'/' + filename
-                file_queue.put([uploadFile, (localfile, remotefile)])
+                filesize = os.path.getsize(localfile)
+                if pack and filesize < PACK_THRESHOLD:
+                    relpath = localfile[len(local):]
+                    if index.get(relpath) is not None and conflict != CONFLICT_OVERWRITE:
+                        if conflict == CONFLICT_ERROR:
+                            packed_existed.append(relpath)
+                        print >>sys.stderr, '[doUpload] skip packed file existed %s' % remotefile
+                        continue
+                    writer.add(localfile, relpath)
+                    print >>sys.stderr, '[doUpload] pack file %s ...' % remotefile
+                    continue
+                scheduler.submit(uploadFile, (localfile, remotefile), TASK_UPLOAD, filesize)
                 print >>sys.stderr, '[doUpload] queue for upload file %s ...' % remotefile
 
-        os.path.walk(local, process_dir, None)
+        if not pack:
+            os.path.walk(local, process_dir, None)
+            scheduler.run()
+        else:
+            #边打包边上传，临时的tar文件不会在本地堆积
+            def producer():
+                os.path.walk(local, process_dir, None)
+                writer.seal()
 
-        CosThread.execute(file_queue)
+            unused = []
+            try:
+                scheduler.run(producer=producer)
+                unused = index.remove_unused_packs()
+            finally:
+                #已经上传成功的包都记到索引里，重新执行时可以用-i跳过
+                self.savePackIndex(remote, index)
+                for path in list(pending_packs):
+                    os.unlink(path)
+            #其中的文件都被覆盖了的旧包
+            for name in unused:
+                retry(self.rm, pack_dir + name)
+            if packed_existed:
+                raise CosFSException(CODE_EXISTED, '%d packed files existed, e.g. %s' % (len(packed_existed), packed_existed[0]))
 
         print >>sys.stderr, "[upload finished]"
 
+    #将cos上src目录复制到dest目录下，src/dest的末尾是否有/的含义和uploadDir相同
+    def copyDir(self, src, dest, conflict):
+        if not dest.endswith(u'/'):
+            dest += u'/'
+        if not src.endswith(u'/'):
+            dest += os.path.basename(src) + u'/'
+            src += u'/'
+        if dest.startswith(src):
+            raise CosFSException(-1, "cannot copy %s into itself" % src)
+        #确认源目录存在，否则会静默地复制0个文件
+        self.list_dir(src)
+
+        def copyFile(srcfile, destfile):
+            try:
+                print >>sys.stderr, '[copyFile] %s => %s' % (srcfile.encode('utf-8'), destfile.encode('utf-8'))
+                self.copy(srcfile, destfile, silent=True)
+                print >>sys.stderr, 'done: new'
+            except Exception, e:
+                if e[0] == CODE_EXISTED: #ERROR_CMD_COS_FILE_EXIST
+                    if conflict == CONFLICT_SKIP:
+                        print >>sys.stderr, 'skipped: existed'
+                    elif conflict == CONFLICT_OVERWRITE:
+                        self.copy(srcfile, destfile, overwrite=True)
+                        print >>sys.stderr, 'done: overwrite'
+                    else:
+                        raise
+                    return
+                raise
+
+        scheduler = self.new_scheduler()
+        def on_dir(dirname, level):
+            scheduler.submit(self.mkdir, (dest + dirname[len(src):],), TASK_MKDIR)
+
+        def on_file(filename, entry, level):
+            scheduler.submit(copyFile, (filename, dest + filename[len(src):]), TASK_UPLOAD, int(entry['filesize']))
+
+        #边遍历边复制，目录的mkdir任务优先执行
+        walker = CosWalker(self)
+        scheduler.run(producer=lambda: walker.walk(src, on_file, on_dir))
+        print >>sys.stderr, "[copy finished]"
+
+    #cpdir --pack上传的索引，不存在时返回None
+    def loadPackIndex(self, remote):
+        try:
+            url = self.signedUrl(remote.rstrip(u'/') + u'/' + PACK_DIR + u'/' + INDEX_NAME)
+        except CosFSException, e:
+            if e[0] == CODE_NOT_EXIST:
+                return None
+            raise
+        r = rate_limited_get(self.http_session, url, self.rate_limiter, self.metrics)
+        if r.status_code != 200:
+            raise CosFSException(-1, 'failed to download pack index, status code %d' % r.status_code)
+        return PackIndex.loads(r.content)
+
+    def savePackIndex(self, remote, index):
+        fd, path = tempfile.mkstemp(prefix='cosfs_index_')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(index.dumps())
+            self.upload(path, remote.rstrip(u'/') + u'/' + PACK_DIR + u'/' + INDEX_NAME, overwrite=True, silent=True)
+        finally:
+            os.unlink(path)
+
+    def signedUrl(self, path):
+        fileattr = self.stat(path)
+        return fileattr['source_url'] + '?sign=' + fileattr['sign']
+
+    #用列目录得到的文件属性(带source_url)生成下载地址，不用再stat
+    def signedUrlOf(self, path, entry):
+        auth = qcloud_cos.cos_auth.Auth(self.cos_client.get_cred())
+        return entry['source_url'] + '?sign=' + auth.sign_download(self.bucket, to_unicode(path), int(time.time()) + SIGN_EXPIRE)
+
+    #增量同步：只传输新增或变化的文件，delete=True时删除目标端多出来的文件和目录
+    def sync(self, src, dest, delete=False, manifest_dir=MANIFEST_DIR):
+        src = to_unicode(src)
+        dest = to_unicode(dest)
+        if src.startswith(u'cos:') and not dest.startswith(u'cos:'):
+            remote, local, upload = src[4:], dest, False
+        elif dest.startswith(u'cos:') and not src.startswith(u'cos:'):
+            local, remote, upload = src, dest[4:], True
+        else:
+            raise CosFSException(-1, "exactly one of src/dest should start with `cos:`")
+
+        remote = remote.rstrip(u'/') + u'/'
+        local = os.path.abspath(local) + u'/'
+        if upload:
+            if not os.path.isdir(local):
+                raise CosFSException(-1, "please specify a local directory")
+            retry(self.mkdir, remote)
+        else:
+            localMkdir(local)
+
+        manifest = SyncManifest(manifest_dir, self.bucket, remote, local)
+        manifest.load()
+
+        #两边的目录树，key是相对路径，目录以/结尾
+        remote_files, remote_dirs = {}, set()
+        def on_dir(dirname, level):
+            remote_dirs.add(dirname[len(remote):])
+        def on_file(filename, entry, level):
+            remote_files[filename[len(remote):]] = entry
+        CosWalker(self).walk(remote, on_file, on_dir)
+
+        local_files, local_dirs = {}, set([u''])
+        for dirname, dirnames, filenames in os.walk(local):
+            prefix = dirname[len(local):]
+            if prefix:
+                prefix += u'/'
+            for name in dirnames:
+                local_dirs.add(prefix + name + u'/')
+            for name in filenames:
+                if os.path.islink(local + prefix + name):
+                    continue
+                local_files[prefix + name] = os.stat(local + prefix + name)
+
+        counter = {'new': 0, 'changed': 0, 'same': 0, 'deleted': 0}
+        counter_lock = threading.Lock()
+        def count(name):
+            with counter_lock:
+                counter[name] += 1
+
+        def syncFile(relpath):
+            #在worker线程里执行，必要时计算sha1确认文件是否变化
+            st = local_files.get(relpath)
+            entry = remote_files.get(relpath)
+            if st is not None and entry is not None:
+                if int(entry['filesize']) == st.st_size and entry.get('sha'):
+                    sha = manifest.local_sha1(relpath, local + relpath, st.st_size, int(st.st_mtime))
+                    if sha == entry['sha']:
+                        manifest.set(relpath, st.st_size, int(st.st_mtime), sha, int(entry['filesize']), entry['mtime'])
+                        count('same')
+                        return
+                action = 'changed'
+            else:
+                action = 'new'
+
+            sys.stderr.write(('[sync] %s %s\n' % ('upload' if upload else 'download', relpath)).encode('utf-8'))
+            if upload:
+                self.upload(local + relpath, remote + relpath, overwrite=True, silent=True)
+                entry = self.stat(remote + relpath)
+            else:
+                self.download(remote + relpath, local + relpath, overwrite=True)
+                st = os.stat(local + relpath)
+            manifest.set(relpath, st.st_size, int(st.st_mtime), entry.get('sha') or None, int(entry['filesize']), entry['mtime'])
+            count(action)
+
+        def removeFile(relpath):
+            sys.stderr.write(('[sync] delete %s\n' % relpath).encode('utf-8'))
+            if upload:
+                self.rm(remote + relpath)
+            elif os.path.exists(local + relpath):
+                os.unlink(local + relpath)
+            count('deleted')
+
+        src_files, dest_files = (local_files, remote_files) if upload else (remote_files, local_files)
+        src_dirs, dest_dirs = (local_dirs, remote_dirs) if upload else (remote_dirs, local_dirs)
+
+        #父目录先于子目录创建
+        for relpath in sorted(src_dirs - dest_dirs, key=lambda d: d.count(u'/')):
+            if upload:
+                retry(self.mkdir, remote + relpath)
+            else:
+                localMkdir(local + relpath)
+
+        scheduler = self.new_scheduler()
+        for relpath in src_files:
+            if relpath in dest_files:
+                st, entry = local_files[relpath], remote_files[relpath]
+                if manifest.is_unchanged(relpath, st.st_size, int(st.st_mtime), int(entry['filesize']), entry['mtime']):
+                    count('same')
+                    continue
+            if upload:
+                scheduler.submit(syncFile, (relpath,), TASK_UPLOAD, local_files[relpath].st_size)
+            else:
+                scheduler.submit(syncFile, (relpath,), TASK_DOWNLOAD, int(remote_files[relpath]['filesize']))
+
+        if delete:
+            for relpath in dest_files:
+                if relpath not in src_files:
+                    scheduler.submit(removeFile, (relpath,), TASK_DELETE)
+
+        try:
+            scheduler.run()
+        finally:
+            manifest.retain(set(src_files))
+            manifest.save()
+
+        if delete:
+            #子目录先于父目录删除
+            for relpath in sorted(dest_dirs - src_dirs, key=lambda d: d.count(u'/'), reverse=True):
+                sys.stderr.write(('[sync] delete %s\n' % relpath).encode('utf-8'))
+                if upload:
+                    retry(self.delFolder, remote + relpath)
+                else:
+                    os.rmdir(local + relpath)
+
+        print >>sys.stderr, "[sync finished] new: %d, changed: %d, same: %d, deleted: %d" % (
+            counter['new'], counter['changed'], counter['same'], counter['deleted'])
+        return counter
+
     def stat(self, path):
-        request = StatFileRequest(self.bucket, to_unicode(path))
-        result = self.cos_client.stat_file(request)
-        if result['code'] != 0:
-            raise CosFSException(result['code'], result['message'])
+        path = to_unicode(path)
+        ret = None
+        if self.meta_cache is not None:
+            ret = self.meta_cache.get(KIND_STAT, self.bucket, path)
+
+        if ret is None:
+            request = StatFileRequest(self.bucket, path)
+            result = self.cos_client.stat_file(request)
+            if result['code'] != 0:
+                raise CosFSException(result['code'], result['message'])
+            ret = result['data']
+            if self.meta_cache is not None:
+                self.meta_cache.put(KIND_STAT, self.bucket, path, ret)
 
-        ret = result['data']
+        ret = dict(ret)
         auth = qcloud_cos.cos_auth.Auth(self.cos_client.get_cred())
         ret['sign'] = auth.sign_download(self.bucket, path, int(time.time()) + SIGN_EXPIRE)
         return ret
@@ -377,6 +1375,7 @@ class CosFS(object):
     def rm(self, path):
         request = DelFileRequest(self.bucket, to_unicode(path))
         result = self.cos_client.del_file(request)
+        self.invalidate_cache(path)
         if result['code'] != 0:
             raise CosFSException(result['code'], result['message'])
 
@@ -386,6 +1385,7 @@ class CosFS(object):
             path += u'/'
         request = CreateFolderRequest(self.bucket, path)
         result = self.cos_client.create_folder(request)
+        self.invalidate_cache(path)
         if result['code'] not in [0, -178]: #ok or already exists
             raise CosFSException(result['code'], result['message'])
 
@@ -393,6 +1393,7 @@ class CosFS(object):
         print >>sys.stderr, '[delFolder] %s' % (path)
         request = DelFolderRequest(self.bucket, to_unicode(path))
         result = self.cos_client.del_folder(request)
+        self.invalidate_cache(path)
         if result['code'] not in [0, -197]:
             raise CosFSException(result['code'], result['message'])
 
@@ -402,35 +1403,98 @@ class CosFS(object):
             path += u'/'
 
         if recursive:
-            file_queue = Queue.Queue()
-            dir_list = []
-            def walk_dir(dirname):
-                print >>sys.stderr, '[walk_dir] dir %s' % (dirname)
-                dir_list.append(dirname)
-
-                content = self.list_dir(dirname)
-                for entry in content['infos']:
-                    name = dirname.rstrip('/') + u'/' + entry['name']
-                    if self.isFile(entry):
-                        print >>sys.stderr, '[walk_dir] file %s' % (name)
-                        file_queue.put([self.rm, (name,)])
-                    else:
-                        walk_dir(name + '/')
-
-            walk_dir(path)
-            CosThread.execute(file_queue)
-
-            while dir_list:
-                self.delFolder(dir_list.pop())
+            begin_at = time.time()
+            dirs_by_level = {} #层级 => [目录]
+            lock = threading.Lock()
+            def on_dir(dirname, level):
+                print >>sys.stderr, '[walk_dir] dir %s' % (dirname.encode('utf-8'))
+                with lock:
+                    dirs_by_level.setdefault(level, []).append(dirname)
+
+            scheduler = self.new_scheduler()
+            #文件删除是大量的小请求，放在一个事件循环上并发执行，不占用线程
+            client = self.new_async_client(self.async_delete) if self.async_delete > 0 else None
+            batch = CosAsyncBatch(client) if client is not None else None
+            def on_file(filename, entry, level):
+                print >>sys.stderr, '[walk_dir] file %s' % (filename.encode('utf-8'))
+                if batch is not None:
+                    self.invalidate_cache(filename)
+                    batch.submit(client.del_file, DelFileRequest(self.bucket, filename))
+                else:
+                    scheduler.submit(self.rm, (filename,), TASK_DELETE)
+
+            #每个文件/目录在worker里各自重试，失败的只计数，不中断整个删除
+            def run(scheduler, producer=None):
+                try:
+                    scheduler.run(producer=producer)
+                except Exception, e:
+                    print >>sys.stderr, '[rmdir] %s' % e
+                return scheduler.get_stats()
+
+            walk_errors = []
+            def producer():
+                try:
+                    CosWalker(self).walk(path, on_file, on_dir, whole_dir=True)
+                except Exception, e:
+                    walk_errors.append(e)
+
+            #边遍历边删除文件，一个目录完整列出来后其中的文件马上开始删除
+            try:
+                stats = run(scheduler, producer)
+                nr_file, failed = stats['finished'], stats['failed'] + len(walk_errors)
+                if batch is not None:
+                    nr_ok, batch_failed = batch.wait()
+                    for request, ret in batch_failed:
+                        print >>sys.stderr, '[rmdir] rm %s failed: %s' % (request.get_cos_path().encode('utf-8'), ret['message'])
+                    nr_file += nr_ok + len(batch_failed)
+                    failed += len(batch_failed)
+            finally:
+                if client is not None:
+                    client.close()
+
+            #目录只有在子目录删除后才能删除；同一层的目录互不依赖，从最深的一层开始逐层并发删除
+            nr_dir = 0
+            for level in sorted(dirs_by_level, reverse=True):
+                scheduler = self.new_scheduler()
+                for dirname in dirs_by_level[level]:
+                    scheduler.submit(self.delFolder, (dirname,), TASK_DELETE)
+                stats = run(scheduler)
+                nr_dir += stats['finished']
+                failed += stats['failed']
+
+            usage = time.time() - begin_at
+            print >>sys.stderr, '[rmdir] files: %d, dirs: %d, failed: %d, %.1fs, %.1f deletes/s' % (
+                nr_file, nr_dir, failed, usage, (nr_file + nr_dir) / max(usage, 0.001))
+            if failed:
+                raise CosFSException(-1, '%d deletes failed' % failed)
 
         else:
             self.delFolder(path)
 
         print >>sys.stderr, "[rmdir finished]"
 
+    #事件循环上的客户端，和cos_client共用config(地址、限速、统计、重试预算)，用完需要close()
+    #AsyncCosClient只支持http，启用https时返回None，调用者改用线程池
+    def new_async_client(self, max_concurrency):
+        config = self.cos_client.get_config()
+        if config.enable_https:
+            return None
+        client = AsyncCosClient(self.appid, self.secret_id, self.secret_key, max_concurrency=max_concurrency)
+        client.set_config(config)
+        return client
+
+    def new_scheduler(self, nr_thread=NR_THREAD):
+        return CosScheduler(nr_thread, progress_interval=self.progress_interval)
+
     def isFile(self, entry):
         return 'sha' in entry
 
+    def invalidate_cache(self, *paths):
+        if self.meta_cache is None:
+            return
+        for path in paths:
+            self.meta_cache.invalidate(self.bucket, to_unicode(path))
+
 
 if __name__ == '__main__':
     #pass
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#stat requests per second: CosClient on NR_THREAD threads vs AsyncCosClient on one event loop
+#then CosFS.rmdir -r of the same number of files, deleting on the thread pool vs on the event loop
+#usage: python benchmarks/bench_async.py [--requests 2000] [--latency 0.05] [--concurrency 10,100,1000]
+
+import os
+import sys
+import time
+import Queue
+import threading
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import CosFS
+from qcloud_cos import CosClient
+from qcloud_cos import AsyncCosClient
+from qcloud_cos import StatFileRequest
+from qcloud_cos.cos_async import wait_all
+from mock_cos import MockCos
+
+
+def bench_threads(mock, paths, nr_thread):
+    client = CosClient(mock.appid, u'secret_id', u'secret_key')
+    mock.attach(client)
+    queue = Queue.Queue()
+    for path in paths:
+        queue.put(path)
+    failed = []
+
+    def worker():
+        while True:
+            try:
+                path = queue.get_nowait()
+            except Queue.Empty:
+                return
+            if client.stat_file(StatFileRequest(u'bucket', path))['code'] != 0:
+                failed.append(path)
+
+    begin_at = time.time()
+    threads = [threading.Thread(target=worker) for i in range(nr_thread)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.time() - begin_at, len(failed), nr_thread
+
+
+def bench_async(mock, paths, concurrency):
+    client = AsyncCosClient(mock.appid, u'secret_id', u'secret_key', max_concurrency=concurrency)
+    mock.attach(client)
+    try:
+        begin_at = time.time()
+        results = wait_all([client.stat_file(StatFileRequest(u'bucket', path)) for path in paths])
+        usage = time.time() - begin_at
+    finally:
+        client.close()
+    return usage, sum(1 for ret in results if ret['code'] != 0), 1
+
+
+class _Null(object):
+    #rmdir往stderr输出每个文件的日志
+    def write(self, data):
+        pass
+
+
+def bench_rmdir(mock, paths, async_delete):
+    for path in paths:
+        mock.add_file(u'/rmdir' + path, 'x')
+    fs = CosFS.CosFS(mock.appid, u'secret_id', u'secret_key', u'bucket', journal_dir=None)
+    mock.attach(fs.cos_client)
+    fs.async_delete = async_delete
+    stderr, sys.stderr = sys.stderr, _Null()
+    try:
+        begin_at = time.time()
+        fs.rmdir(u'/rmdir/', True)
+        usage = time.time() - begin_at
+    finally:
+        sys.stderr = stderr
+    left = sum(1 for path in mock.files if path.startswith(u'/rmdir/'))
+    return usage, left
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--requests', type='int', default=2000)
+    parser.add_option('--latency', type='float', default=0.05, help='per request latency in seconds')
+    parser.add_option('--threads', type='int', default=10, help='threads for CosClient')
+    parser.add_option('--concurrency', default='10,100,1000', help='max_concurrency for AsyncCosClient, comma separated')
+    options, _ = parser.parse_args()
+
+    mock = MockCos(latency=options.latency).start()
+    paths = [u'/bench/f%06d' % i for i in range(options.requests)]
+    for path in paths:
+        mock.add_file(path, 'x')
+
+    print 'requests: %d, latency: %.3fs' % (options.requests, options.latency)
+    print '%-24s %10s %10s %10s %14s' % ('client', 'seconds', 'req/s', 'failed', 'client threads')
+    runs = [('CosClient x %d threads' % options.threads, bench_threads, options.threads)]
+    for concurrency in [int(x) for x in options.concurrency.split(',')]:
+        runs.append(('AsyncCosClient x %d' % concurrency, bench_async, concurrency))
+    try:
+        for name, func, arg in runs:
+            usage, failed, nr_thread = func(mock, paths, arg)
+            print '%-24s %10.2f %10.0f %10d %14d' % (name, usage, options.requests / usage, failed, nr_thread)
+
+        print
+        print '%-24s %10s %10s %10s' % ('rmdir -r', 'seconds', 'files/s', 'left')
+        for name, async_delete in [('%d threads' % CosFS.NR_THREAD, 0), ('event loop x %d' % CosFS.NR_ASYNC_DELETE, CosFS.NR_ASYNC_DELETE)]:
+            usage, left = bench_rmdir(mock, paths, async_delete)
+            print '%-24s %10.2f %10.0f %10d' % (name, usage, options.requests / usage, left)
+    finally:
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#end-to-end benchmark of the main cosfs commands against the local mock server
+#reports files/s, MB/s and peak RSS per command, plus p50/p99 latency per cos op
+#each command runs in a child process so that peak RSS is measured per command
+#
+#usage: python benchmarks/bench_cli.py [--files 500] [--dirs 10] [--file-size 16] [--big 64]
+#                                      [--latency 0.005] [--bandwidth 0] [--error-rate 0]
+#                                      [--commands ls,cpdir_up,...] [--save out.json] [--baseline out.json]
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import tempfile
+import optparse
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from mock_cos import MockCos
+from mock_cos import attach_client
+
+MB = 1024 * 1024
+
+#name => (说明, 是否大文件)
+COMMANDS = [
+    ('ls',         'ls /tree -r',                   False),
+    ('cpdir_down', 'cpdir cos:/tree <local>',       False),
+    ('cpdir_up',   'cpdir <local>/ cos:/up/',       False),
+    ('cp_down',    'cp cos:/big.bin <local>',       True),
+    ('cp_up',      'cp <local> cos:/big_up.bin',    True),
+    ('rmdir',      'rmdir /tree -r',                False),
+]
+
+
+def run_command(name, hostname, workdir, appid):
+    #在子进程中执行，返回耗时
+    import CosFS
+
+    fs = CosFS.CosFS(appid, u'secret_id', u'secret_key', u'bucket', journal_dir=None)
+    attach_client(fs.cos_client, hostname)
+    workdir = workdir.decode('utf-8')
+
+    begin_at = time.time()
+    if name == 'ls':
+        fs.ls(u'/tree', recursive=True)
+    elif name == 'cpdir_down':
+        fs.cpdir(u'cos:/tree', workdir + u'/down')
+    elif name == 'cpdir_up':
+        fs.cpdir(workdir + u'/up_src/', u'cos:/up/')
+    elif name == 'cp_down':
+        fs.cp(u'cos:/big.bin', workdir + u'/big_down.bin')
+    elif name == 'cp_up':
+        fs.cp(workdir + u'/big.bin', u'cos:/big_up.bin')
+    elif name == 'rmdir':
+        fs.rmdir(u'/tree', recursive=True)
+    else:
+        raise Exception('unknown command: ' + name)
+    return time.time() - begin_at
+
+
+def peak_rss():
+    #ru_maxrss会继承fork时父进程(持有mock数据)的值，优先用exec后重新计数的VmHWM
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    #linux下ru_maxrss单位是KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def child_main(name, hostname, workdir, appid, result_file):
+    seconds = run_command(name, hostname, workdir, appid)
+    with open(result_file, 'w') as f:
+        json.dump({'seconds': seconds, 'maxrss': peak_rss()}, f)
+
+
+def prepare(mock, workdir, options):
+    #cos上的目录树和大文件
+    content = os.urandom(options.file_size * 1024)
+    for i in range(options.files):
+        mock.add_file(u'/tree/d%03d/f%05d' % (i % options.dirs, i), content)
+    big = os.urandom(options.big * MB)
+    mock.add_file(u'/big.bin', big)
+
+    #本地待上传的目录树和大文件
+    for i in range(options.files):
+        dirname = os.path.join(workdir, 'up_src', 'd%03d' % (i % options.dirs))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(os.path.join(dirname, 'f%05d' % i), 'wb') as f:
+            f.write(content)
+    with open(os.path.join(workdir, 'big.bin'), 'wb') as f:
+        f.write(big)
+
+
+def run(mock, name, workdir):
+    result_file = os.path.join(workdir, 'result.json')
+    mock.reset_counters()
+    with open(os.devnull, 'w') as devnull:
+        code = subprocess.call([sys.executable, os.path.abspath(__file__), '--child', name,
+                                '--hostname', mock.hostname, '--workdir', workdir,
+                                '--appid', str(mock.appid), '--result', result_file],
+                               stdout=devnull, stderr=devnull)
+    if code != 0 or not os.path.exists(result_file):
+        return None
+
+    with open(result_file) as f:
+        result = json.load(f)
+    os.unlink(result_file)
+    result['ops'] = mock.get_latencies()
+    return result
+
+
+def load_baseline(path):
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--files', type='int', default=500, help='number of small files')
+    parser.add_option('--dirs', type='int', default=10, help='number of sub directories')
+    parser.add_option('--file-size', type='int', default=16, help='small file size in KB')
+    parser.add_option('--big', type='int', default=64, help='big file size in MB')
+    parser.add_option('--latency', type='float', default=0.005, help='per request latency in seconds')
+    parser.add_option('--bandwidth', type='float', default=0, help='per connection bandwidth in MB/s, 0 means unlimited')
+    parser.add_option('--error-rate', type='float', default=0, help='probability that a request fails with 503')
+    parser.add_option('--commands', default=','.join(name for name, _, _ in COMMANDS), help='commands to run, comma separated')
+    parser.add_option('--save', help='save results as json')
+    parser.add_option('--baseline', help='compare with results saved by --save')
+    #以下参数仅供子进程使用
+    parser.add_option('--child', help=optparse.SUPPRESS_HELP)
+    parser.add_option('--hostname', help=optparse.SUPPRESS_HELP)
+    parser.add_option('--workdir', help=optparse.SUPPRESS_HELP)
+    parser.add_option('--appid', type='int', help=optparse.SUPPRESS_HELP)
+    parser.add_option('--result', help=optparse.SUPPRESS_HELP)
+    options, _ = parser.parse_args()
+
+    if options.child:
+        return child_main(options.child, options.hostname, options.workdir, options.appid, options.result)
+
+    names = options.commands.split(',')
+    baseline = load_baseline(options.baseline)
+    mock = MockCos(latency=options.latency, bandwidth=int(options.bandwidth * MB), error_rate=options.error_rate).start()
+    workdir = tempfile.mkdtemp(prefix='cosfs_bench_cli_')
+    results = {}
+    try:
+        prepare(mock, workdir, options)
+        print 'files: %d x %dKB in %d dirs, big file: %dMB, latency: %.3fs, bandwidth: %s, error rate: %.3f' % (
+            options.files, options.file_size, options.dirs, options.big, options.latency,
+            '%.1fMB/s' % options.bandwidth if options.bandwidth else 'unlimited', options.error_rate)
+        print '%-12s %-30s %8s %10s %10s %10s %10s %10s' % ('command', '', 'files', 'seconds', 'files/s', 'MB/s', 'rss(MB)', 'vs base')
+        for name, desc, big in COMMANDS:
+            if name not in names:
+                continue
+            result = run(mock, name, workdir)
+            if result is None:
+                print '%-12s %-30s FAILED' % (name, desc)
+                continue
+
+            nr_file = 1 if big else options.files
+            nbytes = options.big * MB if big else options.files * options.file_size * 1024
+            if name in ['ls', 'rmdir']:
+                nbytes = 0
+            result['files'] = nr_file
+            result['bytes'] = nbytes
+            results[name] = result
+
+            seconds = result['seconds']
+            change = ''
+            if name in baseline:
+                change = '%+.1f%%' % ((seconds / baseline[name]['seconds'] - 1) * 100)
+            print '%-12s %-30s %8d %10.2f %10.1f %10.2f %10.1f %10s' % (name, desc, nr_file, seconds,
+                nr_file / seconds, float(nbytes) / MB / seconds, float(result['maxrss']) / MB, change)
+
+        print ''
+        print '%-12s %-22s %8s %10s %10s' % ('command', 'op', 'count', 'p50(ms)', 'p99(ms)')
+        for name, desc, big in COMMANDS:
+            if name not in results:
+                continue
+            for op, stat in sorted(results[name]['ops'].items()):
+                print '%-12s %-22s %8d %10.2f %10.2f' % (name, op, stat['count'], stat['p50'] * 1000, stat['p99'] * 1000)
+
+        if options.save:
+            with open(options.save, 'w') as f:
+                json.dump({'options': vars(options), 'results': results}, f, indent=2)
+    finally:
+        shutil.rmtree(workdir)
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
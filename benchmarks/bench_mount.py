@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#CosOperations called the way the kernel calls a FUSE mount: ls -l, sequential read (cold / warm disk cache), sequential write
+#doesn't need fusepy or /dev/fuse
+#usage: python benchmarks/bench_mount.py [--files 500] [--file-size 32] [--latency 0.02]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import CosFS
+import cosfs_mount
+from mock_cos import start_process
+from mock_cos import attach_client
+
+#FUSE默认每次read/write最多128KB
+CHUNK = 128 * 1024
+
+
+def requests(fs):
+    return sum(stats['count'] for stats in fs.metrics.get_stats().values())
+
+
+def run(fs, func, *args):
+    fs.metrics.reset()
+    begin_at = time.time()
+    func(*args)
+    return time.time() - begin_at, requests(fs)
+
+
+def ls_l(ops, path):
+    for name in ops.readdir(path, None)[2:]:
+        ops.getattr(path + u'/' + name)
+
+
+def read_all(ops, path):
+    fh = ops.open(path, os.O_RDONLY)
+    offset = 0
+    while True:
+        data = ops.read(path, CHUNK, offset, fh)
+        if not data:
+            break
+        offset += len(data)
+    ops.release(path, fh)
+
+
+def write_all(ops, path, data):
+    fh = ops.create(path, 0644)
+    for offset in range(0, len(data), CHUNK):
+        ops.write(path, data[offset:offset + CHUNK], offset, fh)
+    ops.flush(path, fh)
+    ops.release(path, fh)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--files', type='int', default=500, help='number of files in the listed directory')
+    parser.add_option('--file-size', type='int', default=32, help='size of the read/written file in MB')
+    parser.add_option('--latency', type='float', default=0.02, help='per request latency in seconds')
+    options, _ = parser.parse_args()
+
+    size = options.file_size * 1024 * 1024
+    files = dict((u'/dir/f%06d' % i, 'x') for i in range(options.files))
+    files[u'/big'] = os.urandom(size)
+    #mock在独立进程里运行，测到的是客户端的效果
+    process, hostname = start_process(files=files, latency=options.latency)
+    cache_dir = tempfile.mkdtemp(prefix='cosfs_bench_mount_')
+    try:
+        fs = CosFS.CosFS(1000000, u'secret_id', u'secret_key', u'bucket', journal_dir=None)
+        attach_client(fs.cos_client, hostname)
+
+        print 'files: %d, file size: %dMB, latency: %.3fs' % (options.files, options.file_size, options.latency)
+        print '%-36s %10s %10s %10s' % ('case', 'time(s)', 'requests', 'MB/s')
+
+        for name, ttl in [('ls -l, no dir cache', 0), ('ls -l, dir cache', cosfs_mount.DIR_TTL)]:
+            ops = cosfs_mount.CosOperations(fs, dir_ttl=ttl, cache_dir=cache_dir, cache_size=0)
+            seconds, nr_request = run(fs, ls_l, ops, u'/dir')
+            print '%-36s %10.2f %10d %10s' % (name, seconds, nr_request, '-')
+
+        cases = [
+            ('read, no disk cache', 0),
+            ('read, cold disk cache', cosfs_mount.CACHE_SIZE),
+            #重新挂载后块还在磁盘上
+            ('read, warm disk cache (remount)', cosfs_mount.CACHE_SIZE),
+        ]
+        for name, cache_size in cases:
+            ops = cosfs_mount.CosOperations(fs, cache_dir=cache_dir, cache_size=cache_size)
+            seconds, nr_request = run(fs, read_all, ops, u'/big')
+            print '%-36s %10.2f %10d %10.1f' % (name, seconds, nr_request, options.file_size / seconds)
+
+        data = os.urandom(size)
+        #分片大小按测到的速度调整，先写一次让它稳定下来，两种并发用同样的分片大小比较
+        write_all(cosfs_mount.CosOperations(fs, cache_dir=cache_dir, cache_size=0), u'/written', data)
+        for slice_threads in [1, cosfs_mount.SLICE_THREADS]:
+            ops = cosfs_mount.CosOperations(fs, cache_dir=cache_dir, cache_size=0, slice_threads=slice_threads)
+            seconds, nr_request = run(fs, write_all, ops, u'/written', data)
+            print '%-36s %10.2f %10d %10.1f' % ('write, %d slice threads' % slice_threads, seconds, nr_request, options.file_size / seconds)
+    finally:
+        shutil.rmtree(cache_dir)
+        process.terminate()
+
+
+if __name__ == '__main__':
+    main()
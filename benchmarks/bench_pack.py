@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#cpdir upload/download of a tree of tiny files: one request per file vs --pack
+#usage: python benchmarks/bench_pack.py [--files 2000] [--file-size 2] [--dirs 20] [--latency 0.02]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import CosFS
+from mock_cos import start_process
+from mock_cos import attach_client
+
+
+class _Null(object):
+    #cpdir往stdout/stderr输出每个文件的日志
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+def make_tree(options):
+    root = tempfile.mkdtemp(prefix='cosfs_bench_pack_')
+    for i in range(options.files):
+        dirname = os.path.join(root, 'src', 'd%03d' % (i % options.dirs))
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(os.path.join(dirname, 'f%06d' % i), 'wb') as f:
+            f.write(os.urandom(options.file_size * 1024))
+    return root
+
+
+def timed(func, *args):
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = _Null()
+    try:
+        begin_at = time.time()
+        func(*args)
+        return time.time() - begin_at
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--files', type='int', default=2000, help='number of small files')
+    parser.add_option('--file-size', type='int', default=2, help='file size in KB')
+    parser.add_option('--dirs', type='int', default=20, help='number of sub directories')
+    parser.add_option('--latency', type='float', default=0.02, help='per request latency in seconds')
+    options, _ = parser.parse_args()
+
+    #mock在独立进程里运行，测到的是客户端的效果
+    process, hostname = start_process(latency=options.latency)
+    root = make_tree(options)
+    src = root.decode('utf-8') + u'/src/'
+    try:
+        fs = CosFS.CosFS(1000000, u'secret_id', u'secret_key', u'bucket', journal_dir=None)
+        attach_client(fs.cos_client, hostname)
+
+        print 'files: %d x %dKB in %d dirs, latency: %.3fs' % (options.files, options.file_size, options.dirs, options.latency)
+        print '%-10s %12s %12s %12s %12s' % ('mode', 'up(s)', 'up files/s', 'down(s)', 'down files/s')
+        for name, pack in [('per-file', False), ('pack', True)]:
+            up = timed(fs.cpdir, src, u'cos:/%s/' % name, CosFS.CONFLICT_ERROR, pack)
+            down = timed(fs.cpdir, u'cos:/%s' % name, os.path.join(root, name).decode('utf-8'), CosFS.CONFLICT_ERROR, pack)
+            print '%-10s %12.2f %12.0f %12.2f %12.0f' % (name, up, options.files / up, down, options.files / down)
+    finally:
+        shutil.rmtree(root)
+        process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#cpdir upload of a mixed-size tree (many small files, a few big ones walked last): fifo vs largest-first scheduling
+#usage: python benchmarks/bench_schedule.py [--small 600] [--big 2] [--big-size 24] [--latency 0.02] [--bandwidth 10]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import CosFS
+from mock_cos import start_process
+from mock_cos import attach_client
+
+MB = 1024 * 1024
+
+
+def make_tree(options):
+    root = tempfile.mkdtemp(prefix='cosfs_bench_schedule_')
+    content = os.urandom(64 * 1024)
+    os.makedirs(os.path.join(root, 'a_small'))
+    for i in range(options.small):
+        with open(os.path.join(root, 'a_small', 'f%05d' % i), 'wb') as f:
+            f.write(content)
+    #大文件所在的目录最后遍历到
+    os.makedirs(os.path.join(root, 'z_big'))
+    for i in range(options.big):
+        with open(os.path.join(root, 'z_big', 'big%d.bin' % i), 'wb') as f:
+            f.write(os.urandom(options.big_size * MB))
+    return root
+
+
+def run(hostname, root, order_by_size, name):
+    fs = CosFS.CosFS(1000000, u'secret_id', u'secret_key', u'bucket', journal_dir=None)
+    attach_client(fs.cos_client, hostname)
+    fs.new_scheduler = lambda nr_thread=CosFS.NR_THREAD: CosFS.CosScheduler(nr_thread, order_by_size=order_by_size)
+
+    begin_at = time.time()
+    fs.cpdir(root.decode('utf-8') + u'/', u'cos:/%s/' % name)
+    return time.time() - begin_at
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--small', type='int', default=600, help='number of 64KB files')
+    parser.add_option('--big', type='int', default=2, help='number of big files')
+    parser.add_option('--big-size', type='int', default=24, help='big file size in MB')
+    parser.add_option('--latency', type='float', default=0.02, help='per request latency in seconds')
+    parser.add_option('--bandwidth', type='float', default=10, help='per connection bandwidth in MB/s, 0 means unlimited')
+    options, _ = parser.parse_args()
+
+    #mock在独立进程里运行，测到的是客户端的调度效果
+    process, hostname = start_process(latency=options.latency, bandwidth=int(options.bandwidth * MB))
+    root = make_tree(options)
+    total = options.small * 64 * 1024 + options.big * options.big_size * MB
+    devnull = open(os.devnull, 'w')
+    try:
+        print 'files: %d x 64KB + %d x %dMB, latency: %.3fs, bandwidth: %.1fMB/s' % (
+            options.small, options.big, options.big_size, options.latency, options.bandwidth)
+        print '%-16s %10s %10s' % ('order', 'seconds', 'MB/s')
+        for name, order_by_size in [('fifo', False), ('largest_first', True)]:
+            #cpdir往stderr输出每个文件的日志
+            stderr, sys.stderr = sys.stderr, devnull
+            try:
+                usage = run(hostname, root, order_by_size, name)
+            finally:
+                sys.stderr = stderr
+            print '%-16s %10.2f %10.2f' % (name, usage, float(total) / MB / usage)
+    finally:
+        shutil.rmtree(root)
+        process.terminate()
+
+
+if __name__ == '__main__':
+    main()
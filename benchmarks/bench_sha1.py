@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#compare per-slice sha1 speed: pure python Sha1Hash vs libcrypto NativeSha1Hash
+#usage: python benchmarks/bench_sha1.py [--sizes 1,100,1024] [--python-limit 100]
+
+import os
+import sys
+import time
+import tempfile
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from qcloud_cos import cos_common
+
+MB = 1024 * 1024
+SLICE_SIZE = 1 * MB
+
+
+def make_file(size):
+    fd, path = tempfile.mkstemp(prefix='cosfs_bench_sha1_')
+    with os.fdopen(fd, 'wb') as f:
+        left = size
+        block = os.urandom(MB)
+        while left > 0:
+            n = min(left, MB)
+            f.write(block[:n])
+            left -= n
+    return path
+
+
+def hash_file(path, factory):
+    file_size = os.path.getsize(path)
+    sha1_obj = factory()
+    result = []
+    with open(path, 'rb') as f:
+        for offset in range(0, file_size, SLICE_SIZE):
+            sha1_obj.update(f.read(SLICE_SIZE))
+            result.append(sha1_obj.inner_digest())
+    result[-1] = sha1_obj.hexdigest()
+    return result
+
+
+def measure(path, factory):
+    begin_at = time.time()
+    result = hash_file(path, factory)
+    usage = time.time() - begin_at
+    return result, usage
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--sizes', default='1,100,1024', help='input sizes in MB, comma separated')
+    parser.add_option('--python-limit', type='int', default=100,
+                      help='skip pure python engine above this size in MB (it runs at ~1MB/s)')
+    options, _ = parser.parse_args()
+
+    if cos_common._libcrypto is None:
+        print >>sys.stderr, 'libcrypto not found, only the pure python engine is available'
+
+    print '%-10s %16s %16s %10s' % ('size', 'python MB/s', 'native MB/s', 'speedup')
+    for size_mb in [int(x) for x in options.sizes.split(',')]:
+        path = make_file(size_mb * MB)
+        try:
+            py_result = native_result = None
+            py_speed = native_speed = None
+
+            if size_mb <= options.python_limit:
+                py_result, usage = measure(path, cos_common.Sha1Hash)
+                py_speed = size_mb / usage
+
+            if cos_common._libcrypto is not None:
+                native_result, usage = measure(path, cos_common.NativeSha1Hash)
+                native_speed = size_mb / usage
+
+            if py_result is not None and native_result is not None and py_result != native_result:
+                raise Exception('digest mismatch on %dMB input' % size_mb)
+
+            speedup = '-'
+            if py_speed and native_speed:
+                speedup = '%.1fx' % (native_speed / py_speed)
+            print '%-10s %16s %16s %10s' % (
+                '%dMB' % size_mb,
+                '%.2f' % py_speed if py_speed else 'skipped',
+                '%.2f' % native_speed if native_speed else 'n/a',
+                speedup)
+        finally:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#signatures per second: app_sign (no cache) vs sign_more (cached), with per-op hit counters
+#usage: python benchmarks/bench_sign.py [--seconds 2] [--threads 1,10] [--paths 100]
+
+import os
+import sys
+import time
+import threading
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from qcloud_cos import cos_auth
+from qcloud_cos import CredInfo
+
+EXPIRE = 300
+
+
+def run(nr_thread, seconds, sign):
+    counts = [0] * nr_thread
+    deadline = time.time() + seconds
+
+    def worker(idx):
+        n = 0
+        while time.time() < deadline:
+            for i in xrange(100):
+                sign(idx, n + i)
+            n += 100
+        counts[idx] = n
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(nr_thread)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts) / float(seconds)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--seconds', type='float', default=2.0)
+    parser.add_option('--threads', default='1,10', help='thread counts, comma separated')
+    parser.add_option('--paths', type='int', default=100, help='number of distinct cos paths')
+    options, _ = parser.parse_args()
+
+    cred = CredInfo(1000000, u'AKIDxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx', u'xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx')
+    paths = [u'/bench/dir%d/file%d.bin' % (i % 10, i) for i in range(options.paths)]
+
+    cache = cos_auth.SignCache()
+    auth = cos_auth.Auth(cred, sign_cache=cache)
+    ops = ['upload_slice_data', 'list', 'stat']
+
+    def uncached(idx, n):
+        auth.app_sign(u'bucket', paths[n % len(paths)], int(time.time()) + EXPIRE)
+
+    def cached(idx, n):
+        auth.sign_more(u'bucket', paths[n % len(paths)], int(time.time()) + EXPIRE, op=ops[n % len(ops)])
+
+    print '%-8s %16s %16s %10s' % ('threads', 'app_sign/s', 'sign_more/s', 'speedup')
+    for nr_thread in [int(x) for x in options.threads.split(',')]:
+        cache.clear()
+        base = run(nr_thread, options.seconds, uncached)
+        fast = run(nr_thread, options.seconds, cached)
+        print '%-8d %16.0f %16.0f %9.1fx' % (nr_thread, base, fast, fast / base)
+
+    print ''
+    print 'cache hits by op (last run):'
+    for op, counter in sorted(cache.get_stats().items()):
+        print '  %-20s hit: %-10d miss: %d' % (op, counter['hit'], counter['miss'])
+
+
+if __name__ == '__main__':
+    main()
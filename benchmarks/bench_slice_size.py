@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#fixed 1MB slices vs adaptive slice size, uploading through FileOp.upload_file to the local mock server
+#usage: python benchmarks/bench_slice_size.py [--size 64] [--latency 0.02] [--bandwidth 50]
+
+import os
+import sys
+import time
+import tempfile
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from qcloud_cos import CosClient
+from qcloud_cos import UploadFileRequest
+from mock_cos import MockCos
+
+MB = 1024 * 1024
+
+
+def make_file(size):
+    fd, path = tempfile.mkstemp(prefix='cosfs_bench_slice_')
+    with os.fdopen(fd, 'wb') as f:
+        for i in range(size // MB):
+            f.write(os.urandom(MB))
+        f.write(os.urandom(size % MB))
+    return path
+
+
+def upload(client, local, remote):
+    result = client.upload_file(UploadFileRequest(u'bucket', remote, local.decode('utf-8')))
+    if result['code'] != 0:
+        raise Exception('upload failed: %s' % result)
+
+
+def run(mock, adaptive, warmup_file, bench_file, name):
+    client = CosClient(mock.appid, u'secret_id', u'secret_key')
+    mock.attach(client)
+    client.get_config().set_adaptive_slice_size(adaptive)
+
+    #先上传一个文件，让adaptive模式测到RTT和吞吐量
+    upload(client, warmup_file, u'/warmup_%s.bin' % name)
+
+    mock.reset_counters()
+    begin_at = time.time()
+    upload(client, bench_file, u'/bench_%s.bin' % name)
+    usage = time.time() - begin_at
+    counters = mock.get_counters()
+    return sum(counters.values()), counters.get('upload_slice_data', 0), usage
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--size', type='int', default=64, help='file size in MB')
+    parser.add_option('--latency', type='float', default=0.02, help='per request latency in seconds')
+    parser.add_option('--bandwidth', type='float', default=50, help='per connection bandwidth in MB/s, 0 means unlimited')
+    options, _ = parser.parse_args()
+
+    mock = MockCos(latency=options.latency, bandwidth=int(options.bandwidth * MB)).start()
+    warmup_file = make_file(8 * MB)
+    bench_file = make_file(options.size * MB)
+    try:
+        print 'file: %dMB, latency: %.3fs, bandwidth: %.1fMB/s' % (options.size, options.latency, options.bandwidth)
+        print '%-10s %10s %12s %10s %10s' % ('mode', 'requests', 'slice_data', 'seconds', 'MB/s')
+        for name, adaptive in [('fixed', False), ('adaptive', True)]:
+            requests, slices, usage = run(mock, adaptive, warmup_file, bench_file, name)
+            print '%-10s %10d %12d %10.2f %10.2f' % (name, requests, slices, usage, options.size / usage)
+    finally:
+        os.unlink(warmup_file)
+        os.unlink(bench_file)
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#peak RSS growth of concurrent single-file uploads (upload_single_file, up to 20MB per file)
+#usage: python benchmarks/bench_upload_memory.py [--size 19] [--threads 4] [--files 8]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from qcloud_cos import CosClient
+from qcloud_cos import UploadFileRequest
+from mock_cos import start_process
+from mock_cos import attach_client
+
+MB = 1024 * 1024
+
+
+def peak_rss():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def make_file(path, size):
+    #分块写，不抬高本进程的峰值内存
+    block = os.urandom(MB)
+    with open(path, 'wb') as f:
+        for i in range(size):
+            f.write(block)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--size', type='int', default=19, help='file size in MB, at most 20')
+    parser.add_option('--threads', type='int', default=4, help='concurrent uploads')
+    parser.add_option('--files', type='int', default=8, help='number of uploads')
+    options, _ = parser.parse_args()
+
+    #mock在独立进程里运行，测到的只有客户端的内存
+    process, hostname = start_process()
+    workdir = tempfile.mkdtemp(prefix='cosfs_bench_upload_memory_')
+    try:
+        path = os.path.join(workdir, 'f.bin')
+        make_file(path, options.size)
+        client = CosClient(1000000, u'secret_id', u'secret_key')
+        attach_client(client, hostname)
+        file_op = client._file_op
+
+        paths = [u'/mem/f%04d' % i for i in range(options.files)]
+        failed = []
+
+        def worker():
+            while paths:
+                try:
+                    cos_path = paths.pop()
+                except IndexError:
+                    return
+                ret = file_op.upload_single_file(UploadFileRequest(u'bucket', cos_path, path.decode('utf-8')))
+                if ret['code'] != 0:
+                    failed.append(ret)
+
+        base = peak_rss()
+        begin_at = time.time()
+        threads = [threading.Thread(target=worker) for i in range(options.threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        usage = time.time() - begin_at
+        growth = peak_rss() - base
+
+        print 'files: %d x %dMB, threads: %d' % (options.files, options.size, options.threads)
+        print '%10s %10s %14s %18s %8s' % ('seconds', 'MB/s', 'peak +RSS(MB)', 'per upload(MB)', 'failed')
+        print '%10.2f %10.2f %14.1f %18.1f %8d' % (usage, float(options.files * options.size) / usage,
+            float(growth) / MB, float(growth) / MB / options.threads, len(failed))
+    finally:
+        shutil.rmtree(workdir)
+        process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#in-process mock of the cos v4 /files/v2/{appid}/{bucket}/... api and the download host, for benchmarks
+#
+#    mock = MockCos(latency=0.02, bandwidth=50 * 1024 * 1024, error_rate=0.01)
+#    mock.start()
+#    mock.attach(fs.cos_client)
+#    ...
+#    print mock.get_counters()
+#    print mock.get_latencies()
+#    mock.stop()
+#
+#supported: op=list(context paging)/stat/create/delete/move/upload/upload_slice_init/data/finish,
+#GET /download/{bucket}/{path} with Range
+
+import json
+import time
+import random
+import posixpath
+import uuid
+import urllib
+import hashlib
+import urlparse
+import socket
+import threading
+import collections
+import multiprocessing
+import BaseHTTPServer
+import SocketServer
+
+CODE_OK             = 0
+CODE_NOT_EXIST      = -197
+CODE_EXISTED        = -177
+CODE_DIR_EXISTED    = -178
+CODE_DIR_NOT_EMPTY  = -173
+CODE_PARAM_ERROR    = -1
+CODE_SAME_FILE      = -4018
+CODE_ERR_OFF_GOBACK = -4024
+
+SLICE_SIZES = (512 * 1024, 1024 * 1024, 2 * 1024 * 1024, 3 * 1024 * 1024)
+MAX_LIST_NUM = 199
+
+
+def percentile(values, p):
+    #values需已排序
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def start_process(files=None, **kwargs):
+    #在独立的进程里运行mock，避免和被测的客户端争抢GIL
+    #files: {cos path: content}，预先放入的文件
+    #返回(process, hostname)，用完后调用process.terminate()
+    parent, child = multiprocessing.Pipe()
+
+    def serve():
+        mock = MockCos(**kwargs).start()
+        for path, content in (files or {}).items():
+            mock.add_file(path, content)
+        child.send(mock.hostname)
+        while True:
+            time.sleep(3600)
+
+    process = multiprocessing.Process(target=serve)
+    process.daemon = True
+    process.start()
+    return process, parent.recv()
+
+
+def attach_client(cos_client, hostname):
+    #把CosClient的请求指向hostname上的mock(可以在其他进程里)
+    config = cos_client.get_config()
+    config.set_region(hostname=hostname, download_hostname=hostname)
+    cos_client.set_config(config)
+
+
+def parse_multipart(body, content_type):
+    #cgi.FieldStorage逐行解析，分片数据大时太慢，这里直接按boundary切分
+    boundary = content_type.split('boundary=', 1)[1].strip('"')
+    params = {}
+    for part in body.split('--' + boundary)[1:-1]:
+        headers, value = part[2:-2].split('\r\n\r\n', 1)
+        for line in headers.split('\r\n'):
+            if line.lower().startswith('content-disposition:'):
+                name = line.split('name="', 1)[1].split('"', 1)[0]
+                params[name] = value
+    return params
+
+
+class MockCos(object):
+    def __init__(self, appid=1000000, bucket=u'bucket', latency=0.0, bandwidth=0, error_rate=0.0):
+        #latency: 每个请求额外等待的秒数
+        #bandwidth: 每个连接的带宽(字节/秒)，0表示不限
+        #error_rate: 请求返回503的概率
+        self.appid = appid
+        self.bucket = bucket
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+
+        self.lock = threading.Lock()
+        self.files = {}     #cos path => {'content', 'sha', 'ctime', 'mtime', 'biz_attr'}
+        self.dirs = {}      #dir path(以/结尾) => {'ctime', 'mtime', 'biz_attr'}
+        self.children = {u'/': {}}  #dir path => {name => is_dir}
+        self.sessions = {}  #session => {'path', 'filesize', 'slice_size', 'parts', 'insert_only'}
+        #path => 还要返回几次-4024(ErrOffGoBack)。覆盖上传(insertOnly=0)这些路径时出错，SDK删除后重传的那次也算一次
+        self.off_go_back = {}
+        self.counters = collections.Counter()
+        self.latencies = collections.defaultdict(list)  #op => [seconds]
+        self.server = None
+
+    def start(self):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.mock = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.close_connections()
+
+    @property
+    def hostname(self):
+        return '127.0.0.1:%d' % self.server.server_address[1]
+
+    def attach(self, cos_client):
+        #把CosClient的请求指向mock
+        attach_client(cos_client, self.hostname)
+
+    def get_counters(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def get_latencies(self):
+        #返回{op: {'count', 'p50', 'p99'}}，包括注入的延迟
+        with self.lock:
+            latencies = dict((op, sorted(values)) for op, values in self.latencies.items())
+        result = {}
+        for op, values in latencies.items():
+            result[op] = {'count': len(values), 'p50': percentile(values, 50), 'p99': percentile(values, 99)}
+        return result
+
+    def reset_counters(self):
+        with self.lock:
+            self.counters.clear()
+            self.latencies.clear()
+
+    def record(self, op, seconds):
+        with self.lock:
+            self.counters[op] += 1
+            self.latencies[op].append(seconds)
+
+    def inject_error(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def add_file(self, path, content):
+        #直接写入文件(不计数、无延迟)，用于准备测试数据
+        with self.lock:
+            self.put_file(path, content, False)
+
+    def add_dir(self, path):
+        with self.lock:
+            self.make_dir(path.rstrip(u'/') + u'/')
+
+    def make_dir(self, path):
+        #path以/结尾，父目录不存在时一并创建
+        if path in self.children:
+            return False
+        parent = posixpath.dirname(path.rstrip(u'/')).rstrip(u'/') + u'/'
+        self.make_dir(parent)
+        now = time.time()
+        self.dirs[path] = {'ctime': now, 'mtime': now, 'biz_attr': u''}
+        self.children[path] = {}
+        self.children[parent][posixpath.basename(path.rstrip(u'/'))] = True
+        return True
+
+    def remove_entry(self, path):
+        parent, name = posixpath.split(path.rstrip(u'/'))
+        del self.children[parent.rstrip(u'/') + u'/'][name]
+
+    def dir_info(self, path):
+        info = self.dirs[path]
+        return {
+            'name': posixpath.basename(path.rstrip(u'/')) + u'/',
+            'ctime': str(int(info['ctime'])),
+            'mtime': str(int(info['mtime'])),
+            'biz_attr': info['biz_attr'],
+        }
+
+    def file_info(self, path):
+        info = self.files[path]
+        url = u'http://%s/download/%s%s' % (self.hostname, self.bucket, path)
+        return {
+            'name': path.rsplit(u'/', 1)[-1],
+            'filesize': len(info['content']),
+            'filelen': len(info['content']),
+            'sha': info['sha'],
+            'ctime': str(int(info['ctime'])),
+            'mtime': str(int(info['mtime'])),
+            'biz_attr': info['biz_attr'],
+            'authority': u'eInvalid',
+            'access_url': url,
+            'source_url': url,
+        }
+
+    def put_file(self, path, content, insert_only, biz_attr=u''):
+        #返回(code, message)
+        now = time.time()
+        old = self.files.get(path)
+        if old is not None and insert_only:
+            if old['content'] == content:
+                return CODE_SAME_FILE, u'same file'
+            return CODE_EXISTED, u'file already exists'
+        if not insert_only and self.off_go_back.get(path, 0) > 0:
+            self.off_go_back[path] -= 1
+            return CODE_ERR_OFF_GOBACK, u'ErrOffGoBack'
+        ctime = old['ctime'] if old is not None else now
+        self.files[path] = {'content': content, 'sha': hashlib.sha1(content).hexdigest(), 'ctime': ctime, 'mtime': now, 'biz_attr': biz_attr}
+        if old is None:
+            parent, name = posixpath.split(path)
+            parent = parent.rstrip(u'/') + u'/'
+            self.make_dir(parent)
+            self.children[parent][name] = False
+        return CODE_OK, u'SUCCESS'
+
+    #以下op_*在持有self.lock时调用，返回(code, message, data)
+    def op_stat(self, path, params):
+        if path.endswith(u'/'):
+            if path not in self.dirs:
+                return CODE_NOT_EXIST, u'ERROR_CMD_COS_INDEX_ERROR', None
+            return CODE_OK, u'SUCCESS', self.dir_info(path)
+        if path not in self.files:
+            return CODE_NOT_EXIST, u'ERROR_CMD_COS_INDEX_ERROR', None
+        return CODE_OK, u'SUCCESS', self.file_info(path)
+
+    def op_delete(self, path, params):
+        if path.endswith(u'/'):
+            if path not in self.dirs:
+                return CODE_NOT_EXIST, u'ERROR_CMD_COS_INDEX_ERROR', None
+            if self.children[path]:
+                return CODE_DIR_NOT_EMPTY, u'ERROR_CMD_COS_DIR_NOT_EMPTY', None
+            del self.dirs[path]
+            del self.children[path]
+        else:
+            if path not in self.files:
+                return CODE_NOT_EXIST, u'ERROR_CMD_COS_INDEX_ERROR', None
+            del self.files[path]
+        self.remove_entry(path)
+        return CODE_OK, u'SUCCESS', None
+
+    def op_create(self, path, params):
+        path = path.rstrip(u'/') + u'/'
+        if not self.make_dir(path):
+            return CODE_DIR_EXISTED, u'ERROR_CMD_COS_PATH_CONFLICT', None
+        self.dirs[path]['biz_attr'] = params.get('biz_attr', u'')
+        info = self.dirs[path]
+        return CODE_OK, u'SUCCESS', {'ctime': str(int(info['ctime']))}
+
+    def op_move(self, path, params):
+        if path not in self.files:
+            return CODE_NOT_EXIST, u'ERROR_CMD_COS_INDEX_ERROR', None
+        dest = params['dest_fileid']
+        if isinstance(dest, str):
+            dest = dest.decode('utf-8')
+        if not dest.startswith(u'/'):
+            dest = posixpath.join(posixpath.dirname(path), dest)
+        if dest in self.files and params.get('to_over_write', '0') == '0':
+            return CODE_EXISTED, u'ERROR_CMD_COS_FILE_EXIST', None
+
+        info = self.files.pop(path)
+        self.remove_entry(path)
+        if dest not in self.files:
+            parent, name = posixpath.split(dest)
+            parent = parent.rstrip(u'/') + u'/'
+            self.make_dir(parent)
+            self.children[parent][name] = False
+        self.files[dest] = info
+        return CODE_OK, u'SUCCESS', None
+
+    def op_list(self, path, params):
+        #path是目录加前缀，context是上一页最后一个名字
+        dirname, prefix = posixpath.split(path)
+        dirname = dirname.rstrip(u'/') + u'/'
+        if dirname not in self.children:
+            return CODE_NOT_EXIST, u'ERROR_CMD_COS_INDEX_ERROR', None
+        num = min(int(params.get('num') or MAX_LIST_NUM), MAX_LIST_NUM)
+        context = params.get('context') or u''
+        if isinstance(context, str):
+            context = context.decode('utf-8')
+
+        names = sorted(name for name in self.children[dirname] if name.startswith(prefix) and name > context)
+        page = names[:num]
+        infos = []
+        for name in page:
+            if self.children[dirname][name]:
+                infos.append(self.dir_info(dirname + name + u'/'))
+            else:
+                infos.append(self.file_info(dirname + name))
+        listover = len(names) <= num
+        return CODE_OK, u'SUCCESS', {
+            'context': u'' if listover else page[-1],
+            'listover': listover,
+            'dircount': sum(1 for info in infos if 'sha' not in info),
+            'filecount': sum(1 for info in infos if 'sha' in info),
+            'infos': infos,
+        }
+
+    def op_upload(self, path, params):
+        code, message = self.put_file(path, params['filecontent'], params.get('insertOnly', '1') != '0', params.get('biz_attr', u''))
+        if code != CODE_OK:
+            return code, message, None
+        return CODE_OK, message, self.upload_result(path)
+
+    def upload_result(self, path):
+        info = self.file_info(path)
+        return {'access_url': info['access_url'], 'source_url': info['source_url'], 'resource_path': path, 'url': info['access_url']}
+
+    def op_upload_slice_init(self, path, params):
+        insert_only = params.get('insertOnly', '1') != '0'
+        if path in self.files and insert_only:
+            return CODE_EXISTED, u'file already exists', None
+
+        slice_size = int(params['slice_size'])
+        if slice_size not in SLICE_SIZES:
+            slice_size = 1024 * 1024
+        session = uuid.uuid4().hex
+        self.sessions[session] = {
+            'path': path,
+            'filesize': int(params['filesize']),
+            'slice_size': slice_size,
+            'parts': {},
+            'insert_only': insert_only,
+        }
+        return CODE_OK, u'SUCCESS', {'session': session, 'slice_size': slice_size, 'offset': 0}
+
+    def op_upload_slice_data(self, path, params):
+        session = self.sessions.get(params.get('session'))
+        if session is None or session['path'] != path:
+            return CODE_PARAM_ERROR, u'invalid session', None
+        offset = int(params['offset'])
+        session['parts'][offset] = params['filecontent']
+        return CODE_OK, u'SUCCESS', {'session': params['session'], 'offset': offset}
+
+    def op_upload_slice_finish(self, path, params):
+        session_id = params.get('session')
+        session = self.sessions.get(session_id)
+        if session is None or session['path'] != path:
+            return CODE_PARAM_ERROR, u'invalid session', None
+
+        content = ''.join(session['parts'][offset] for offset in sorted(session['parts']))
+        if len(content) != int(params['filesize']) or len(content) != session['filesize']:
+            return CODE_PARAM_ERROR, u'incomplete file: %d/%s' % (len(content), params['filesize']), None
+
+        code, message = self.put_file(path, content, session['insert_only'])
+        if code != CODE_OK:
+            return code, message, None
+        del self.sessions[session_id]
+        return CODE_OK, u'SUCCESS', self.upload_result(path)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    #异步客户端会同时发起上千个连接
+    request_queue_size = 1024
+
+    def __init__(self, *args, **kwargs):
+        BaseHTTPServer.HTTPServer.__init__(self, *args, **kwargs)
+        self.handlers = {}  #socket => 处理该连接的线程
+        self.handlers_lock = threading.Lock()
+
+    def process_request_thread(self, request, client_address):
+        with self.handlers_lock:
+            self.handlers[request] = threading.current_thread()
+        try:
+            SocketServer.ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            with self.handlers_lock:
+                self.handlers.pop(request, None)
+
+    def close_connections(self):
+        #关闭keep-alive的连接，让处理线程在解释器退出前结束
+        with self.handlers_lock:
+            handlers = self.handlers.items()
+        for sock, thread in handlers:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        for sock, thread in handlers:
+            thread.join(1)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    #默认每个header单独write，和客户端的delayed ack叠加会让每个请求多等40ms
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def throttle(self, nbytes):
+        delay = self.mock.latency
+        if self.mock.bandwidth:
+            delay += float(nbytes) / self.mock.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    def send_body(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, code, message, data=None):
+        ret = {'code': code, 'message': message}
+        if data is not None:
+            ret['data'] = data
+        self.send_body(200, json.dumps(ret))
+
+    def parse(self):
+        #返回(cos path, 参数dict, 请求体长度)
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query, keep_blank_values=True))
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            params.update(parse_multipart(body, content_type))
+        elif content_type.startswith('application/json') and body:
+            params.update(json.loads(body))
+
+        return urllib.unquote(url.path).decode('utf-8'), params, len(body)
+
+    def dispatch(self):
+        begin_at = time.time()
+        path, params, nbytes = self.parse()
+
+        download = u'/download/%s/' % self.mock.bucket
+        if path.startswith(download):
+            op = 'download'
+            self.download(path[len(download) - 1:])
+        else:
+            op = str(params.get('op', ''))
+            self.throttle(nbytes)
+            self.call(op, path, params)
+        self.mock.record(op, time.time() - begin_at)
+
+    def call(self, op, path, params):
+        if self.mock.inject_error():
+            return self.send_body(503, 'Service Unavailable', 'text/plain')
+
+        prefix = u'/files/v2/%s/%s' % (self.mock.appid, self.mock.bucket)
+        if not path.startswith(prefix + u'/'):
+            return self.send_json(CODE_PARAM_ERROR, u'bad url %s' % path)
+        path = path[len(prefix):]
+
+        handler = getattr(self.mock, 'op_' + op, None)
+        if handler is None:
+            return self.send_json(CODE_PARAM_ERROR, u'unsupported op %s' % op)
+
+        with self.mock.lock:
+            code, message, data = handler(path, params)
+        self.send_json(code, message, data)
+
+    def download(self, path):
+        if self.mock.inject_error():
+            self.throttle(0)
+            return self.send_body(503, 'Service Unavailable', 'text/plain')
+
+        with self.mock.lock:
+            info = self.mock.files.get(path)
+        if info is None:
+            self.throttle(0)
+            return self.send_body(404, 'Not Found', 'text/plain')
+
+        content = info['content']
+        status, headers = 200, {}
+        ranges = self.headers.get('Range', '')
+        if ranges.startswith('bytes='):
+            begin, end = ranges[len('bytes='):].split('-', 1)
+            begin = int(begin)
+            end = min(int(end), len(content) - 1) if end else len(content) - 1
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (begin, end, len(content))
+            content = content[begin:end + 1]
+            status = 206
+
+        self.throttle(len(content))
+        self.send_body(status, content, 'application/octet-stream', headers)
+
+    do_GET = dispatch
+    do_POST = dispatch
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#author: felix021@gmail.com
+
+#list_dir/stat结果的本地缓存：内存LRU + 可选的sqlite持久化，按TTL过期
+
+import json
+import time
+import sqlite3
+import posixpath
+import threading
+from collections import OrderedDict
+
+KIND_LIST = 'list'
+KIND_STAT = 'stat'
+
+class MetaCache(object):
+    def __init__(self, ttl=60, db_path=None, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() #key => (expire_at, value)
+        self._stats = {}
+        for kind in [KIND_LIST, KIND_STAT]:
+            self._stats[kind] = {'hit': 0, 'miss': 0}
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, expire_at REAL, value TEXT)')
+            self._db.execute('DELETE FROM meta WHERE expire_at < ?', (time.time(),))
+            self._db.commit()
+
+    @staticmethod
+    def make_key(kind, bucket, path):
+        return u'%s:%s:%s' % (kind, bucket, path)
+
+    def get(self, kind, bucket, path):
+        key = self.make_key(kind, bucket, path)
+        now = time.time()
+        with self._lock:
+            value = self._get_locked(key, now)
+            self._stats[kind]['hit' if value is not None else 'miss'] += 1
+            return value
+
+    def _get_locked(self, key, now):
+        if key in self._entries:
+            expire_at, value = self._entries.pop(key)
+            if expire_at >= now:
+                self._entries[key] = (expire_at, value) #移到队尾
+                return value
+
+        if self._db is not None:
+            row = self._db.execute('SELECT expire_at, value FROM meta WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                expire_at, value = row
+                if expire_at >= now:
+                    value = json.loads(value)
+                    self._put_memory(key, expire_at, value)
+                    return value
+                self._db.execute('DELETE FROM meta WHERE key = ?', (key,))
+                self._db.commit()
+        return None
+
+    def _put_memory(self, key, expire_at, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (expire_at, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, kind, bucket, path, value):
+        self.put_many(kind, bucket, [(path, value)])
+
+    def put_many(self, kind, bucket, items):
+        expire_at = time.time() + self.ttl
+        with self._lock:
+            rows = []
+            for path, value in items:
+                key = self.make_key(kind, bucket, path)
+                self._put_memory(key, expire_at, value)
+                rows.append((key, expire_at, json.dumps(value)))
+            if self._db is not None and rows:
+                self._db.executemany('INSERT OR REPLACE INTO meta (key, expire_at, value) VALUES (?, ?, ?)', rows)
+                self._db.commit()
+
+    def invalidate(self, bucket, path):
+        #path对应的文件(或目录)，以及其所在目录的列表都失效
+        path = path.rstrip(u'/')
+        parent = posixpath.dirname(path).rstrip(u'/') + u'/'
+        keys = [
+            self.make_key(KIND_STAT, bucket, path),
+            self.make_key(KIND_LIST, bucket, path + u'/'),
+            self.make_key(KIND_LIST, bucket, parent),
+        ]
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+            if self._db is not None:
+                self._db.executemany('DELETE FROM meta WHERE key = ?', [(key,) for key in keys])
+                self._db.commit()
+
+    def get_stats(self):
+        with self._lock:
+            return dict((kind, dict(counter)) for kind, counter in self._stats.items())
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return ', '.join('%s hit/miss: %d/%d' % (kind, stats[kind]['hit'], stats[kind]['miss']) for kind in sorted(stats))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -6,6 +6,35 @@ bucket_secret  = u'world'
 bucket_name    = u'bucket'
 region         = u'sh'
 
+#ls/stat等元数据的本地缓存时间(秒)，0表示不缓存
+meta_cache_ttl  = 0
+#缓存持久化的sqlite文件，None表示只缓存在内存里
+meta_cache_file = None
+
+#cpdir/sync/rmdir -r等批量操作每隔多少秒输出一次进度，0表示不输出
+progress_interval = 0
+
+#限速，0表示不限制；带宽可以写成'512K'、'10M'(字节/秒)
+max_requests_per_second = 0
+max_upload_rate         = 0
+max_download_rate       = 0
+#运行时调整限速的控制文件(格式见README)，修改后1秒内生效，None表示不使用
+rate_limit_file         = None
+
+#每隔metrics_interval秒把各类请求的耗时直方图、流量和错误码写到metrics_file，None表示不写
+#metrics_format: json或prometheus(文本格式，可以交给node_exporter的textfile collector)
+metrics_file            = None
+metrics_interval        = 10
+metrics_format          = 'json'
+
+#mount: 目录项缓存时间(秒)；本地缓存目录，None表示~/.cosfs/mount；磁盘块缓存的大小上限(字节)，0表示不用磁盘缓存
+#同时上传的文件数；每个文件分片上传的并发数
+mount_dir_ttl           = 10
+mount_cache_dir         = None
+mount_cache_size        = 1024 * 1024 * 1024
+mount_max_uploads       = 4
+mount_slice_threads     = 4
+
 try:
     from cosfs_conf_local import *
 except:
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#author: felix021@gmail.com
+
+#cos文件的随机读：CosFS.open()返回只读的CosFile，支持seek/tell/read/readinto/readline，
+#tarfile、zipfile等可以直接在上面读，只下载用到的部分。
+#数据按块用Range请求读取，读到的块放在LRU缓存里；连续顺序读时每次请求的块数翻倍(预读)，随机读时恢复成一块。
+
+import io
+import errno
+import threading
+from collections import OrderedDict
+
+BLOCK_SIZE      = 1024 * 1024
+#缓存的块数
+CACHE_BLOCKS    = 32
+#顺序读时一次Range请求最多取的块数
+MAX_READAHEAD   = 16
+
+class CosFile(io.RawIOBase):
+    def __init__(self, fetch_range, size, name=None, block_size=BLOCK_SIZE, cache_blocks=CACHE_BLOCKS, max_readahead=MAX_READAHEAD):
+        #fetch_range(begin, end): 返回文件[begin, end]闭区间的数据，出错或长度不对时抛出异常
+        io.RawIOBase.__init__(self)
+        self.fetch_range = fetch_range
+        self.size = size
+        self.name = name
+        self.mode = 'rb'
+        self.block_size = block_size
+        self.cache_blocks = max(cache_blocks, 1)
+        #预读的块比缓存还多时，还没读到就被淘汰了
+        self.max_readahead = max(min(max_readahead, self.cache_blocks), 1)
+
+        self._pos = 0
+        self._lock = threading.Lock()
+        self._blocks = OrderedDict() #块序号 => 数据，按最近使用的顺序
+        self._window = 1        #下一次缺块时请求的块数
+        self._next_offset = 0   #上一次读取结束的位置，用来判断是否顺序读
+        self._stats = {'reads': 0, 'hits': 0, 'misses': 0, 'requests': 0, 'fetched_bytes': 0}
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        self._checkClosed()
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._checkClosed()
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError('invalid whence (%r)' % whence)
+        if pos < 0:
+            raise IOError(errno.EINVAL, 'negative seek position %d' % pos)
+        self._pos = pos
+        return pos
+
+    def read(self, size=-1):
+        self._checkClosed()
+        if size is None or size < 0:
+            size = self.size - self._pos
+        data = self.pread(self._pos, size)
+        self._pos += len(data)
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+    def peek(self, size=0):
+        #IOBase.readline用peek一次取一段，否则每次只read(1)；不移动位置，也不影响顺序读的判断
+        #最多返回到当前块的末尾，并且不超过io.DEFAULT_BUFFER_SIZE，避免每读一行都复制整块
+        self._checkClosed()
+        if self._pos >= self.size:
+            return ''
+        end = min((self._pos // self.block_size + 1) * self.block_size, self._pos + max(size, io.DEFAULT_BUFFER_SIZE))
+        return self._read_range(self._pos, end - self._pos, False)
+
+    def pread(self, offset, size):
+        #从offset读size字节，不改变当前位置，可以在多个线程里调用
+        if offset >= self.size or size <= 0:
+            return ''
+        return self._read_range(offset, size, True)
+
+    def close(self):
+        with self._lock:
+            self._blocks.clear()
+        io.RawIOBase.close(self)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return 'reads: %d, block hits: %d, misses: %d, requests: %d, fetched: %d bytes' % (
+            stats['reads'], stats['hits'], stats['misses'], stats['requests'], stats['fetched_bytes'])
+
+    def _read_range(self, offset, size, detect):
+        end = min(offset + size, self.size)
+        first = offset // self.block_size
+        last = (end - 1) // self.block_size
+
+        with self._lock:
+            self._stats['reads'] += 1
+            if detect:
+                #从上次结束的位置附近(一块以内)接着读算顺序读，预读窗口翻倍；跳到别处则恢复成一块
+                if abs(offset - self._next_offset) < self.block_size:
+                    self._window = min(self._window * 2, self.max_readahead)
+                else:
+                    self._window = 1
+                self._next_offset = end
+            window = self._window
+
+        #一次读很多块时，取回来的块可能已经被挤出缓存，先放在fetched里
+        fetched = {}
+        parts = []
+        for i in range(first, last + 1):
+            block = fetched.get(i)
+            if block is None:
+                block = self._cached(i)
+            if block is None:
+                fetched = self._fetch(i, max(window, last - i + 1))
+                block = fetched[i]
+            parts.append(block)
+
+        data = ''.join(parts)
+        skip = offset - first * self.block_size
+        return data[skip:skip + end - offset]
+
+    def _cached(self, i):
+        with self._lock:
+            block = self._blocks.pop(i, None)
+            if block is None:
+                self._stats['misses'] += 1
+                return None
+            self._blocks[i] = block
+            self._stats['hits'] += 1
+            return block
+
+    def _fetch(self, i, count):
+        #从第i块开始取count块，遇到已经缓存的块或文件末尾为止，合成一个Range请求
+        nr_block = (self.size + self.block_size - 1) // self.block_size
+        with self._lock:
+            n = 1
+            while n < count and i + n < nr_block and (i + n) not in self._blocks:
+                n += 1
+
+        begin = i * self.block_size
+        end = min((i + n) * self.block_size, self.size)
+        data = self.fetch_range(begin, end - 1)
+
+        fetched = {}
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['fetched_bytes'] += len(data)
+            for k in range(n):
+                block = data[k * self.block_size:(k + 1) * self.block_size]
+                fetched[i + k] = block
+                self._blocks.pop(i + k, None)
+                self._blocks[i + k] = block
+            while len(self._blocks) > self.cache_blocks:
+                self._blocks.popitem(last=False)
+        return fetched
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#author: felix021@gmail.com
+
+#sync用的文件清单：记录上次同步后每个文件本地的大小、mtime、sha1，以及当时cos上的大小和mtime
+#两边都没变的文件直接跳过，不用读文件也不用发请求
+
+import os
+import json
+import errno
+import hashlib
+import threading
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(HASH_BLOCK_SIZE)
+            if not data:
+                break
+            sha1.update(data)
+    return sha1.hexdigest()
+
+class SyncManifest(object):
+    def __init__(self, manifest_dir, bucket, remote, local):
+        #manifest_dir为None时不保存，每次都按sha1比较
+        self.manifest_dir = manifest_dir
+        self.path = None
+        if manifest_dir:
+            key = json.dumps({'bucket': bucket, 'remote': remote, 'local': local}, sort_keys=True)
+            self.path = os.path.join(manifest_dir, hashlib.sha1(key).hexdigest() + '.manifest')
+        self._lock = threading.Lock()
+        self._entries = {} #相对路径 => {'size', 'mtime', 'sha', 'remote_size', 'remote_mtime'}
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as f:
+                self._entries = json.load(f)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError:
+            #清单损坏时当作第一次同步
+            self._entries = {}
+
+    def save(self):
+        if self.path is None:
+            return
+        if not os.path.exists(self.manifest_dir):
+            os.makedirs(self.manifest_dir)
+        with self._lock:
+            data = json.dumps(self._entries)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.rename(tmp_path, self.path)
+
+    def get(self, relpath):
+        with self._lock:
+            return self._entries.get(relpath)
+
+    def set(self, relpath, size, mtime, sha, remote_size, remote_mtime):
+        with self._lock:
+            self._entries[relpath] = {
+                'size': size,
+                'mtime': mtime,
+                'sha': sha,
+                'remote_size': remote_size,
+                'remote_mtime': remote_mtime,
+            }
+
+    def retain(self, relpaths):
+        #只保留relpaths中的记录，清掉已经不存在的文件
+        with self._lock:
+            for relpath in self._entries.keys():
+                if relpath not in relpaths:
+                    del self._entries[relpath]
+
+    def is_unchanged(self, relpath, size, mtime, remote_size, remote_mtime):
+        #两边都和上次同步后一致
+        entry = self.get(relpath)
+        return (entry is not None
+                and entry['size'] == size and entry['mtime'] == mtime
+                and entry['remote_size'] == remote_size and entry['remote_mtime'] == remote_mtime)
+
+    def local_sha1(self, relpath, path, size, mtime):
+        #本地文件没变时复用清单里的sha1，否则重新计算
+        entry = self.get(relpath)
+        if entry is not None and entry['sha'] and entry['size'] == size and entry['mtime'] == mtime:
+            return entry['sha']
+        return file_sha1(path)
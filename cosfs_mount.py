@@ -0,0 +1,584 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#author: felix021@gmail.com
+
+#把bucket挂载成本地目录(FUSE，需要安装fusepy)：
+#  目录项缓存：列出的目录在dir_ttl秒内直接回答getattr/readdir，不存在的文件也不用再发请求
+#  读：同一个文件的多个句柄共用一个CosFile(按块Range读取、内存LRU、顺序读预读)，块另外缓存在本地磁盘，重新打开或重新挂载后还能用
+#  写：写入先放在本地的临时文件里，flush/close时流式上传，8MB以上按分片并发上传
+#      v4的分片上传开始时就要告诉cos文件大小，所以不能在write的时候边写边传
+#CosOperations不依赖fuse，可以直接调用各个方法，在mock_cos上测试(见benchmarks/bench_mount.py)
+
+import os
+import sys
+import stat
+import time
+import errno
+import hashlib
+import tempfile
+import itertools
+import posixpath
+import threading
+import traceback
+from collections import OrderedDict
+
+try:
+    from fuse import FUSE, FuseOSError, Operations
+except ImportError:
+    FUSE = None
+    Operations = object
+
+    class FuseOSError(OSError):
+        def __init__(self, errno):
+            OSError.__init__(self, errno, os.strerror(errno))
+
+from CosFS import CosFSException, CODE_NOT_EXIST, CODE_EXISTED, retry, to_unicode
+from cosfs_file import CosFile, BLOCK_SIZE
+
+CODE_DIR_EXISTED    = -178
+CODE_DIR_NOT_EMPTY  = -173
+
+#目录项缓存的时间(秒)
+DIR_TTL             = 10
+#本地缓存目录，blocks/下是读取的块，spool/下是还没上传的写入
+CACHE_DIR           = os.path.expanduser('~/.cosfs/mount')
+#磁盘块缓存的大小上限
+CACHE_SIZE          = 1024 * 1024 * 1024
+#每个打开的文件在内存里缓存的块数
+MEMORY_BLOCKS       = 8
+#顺序读时一次Range请求最多取的块数
+READAHEAD_BLOCKS    = 8
+#同时上传的文件数，和每个文件分片上传的并发数
+MAX_UPLOADS         = 4
+SLICE_THREADS       = 4
+
+#cos错误码 => errno
+ERRNO_OF_CODE = {
+    CODE_NOT_EXIST:     errno.ENOENT,
+    CODE_EXISTED:       errno.EEXIST,
+    CODE_DIR_EXISTED:   errno.EEXIST,
+    CODE_DIR_NOT_EMPTY: errno.ENOTEMPTY,
+}
+
+def cos_errors(func):
+    #把CosFSException等异常转成FuseOSError，fuse只认errno
+    def wrapper(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        except FuseOSError:
+            raise
+        except CosFSException, e:
+            raise FuseOSError(ERRNO_OF_CODE.get(e[0], errno.EIO))
+        except (IOError, OSError), e:
+            raise FuseOSError(e.errno or errno.EIO)
+        except Exception:
+            print >>sys.stderr, '[mount] %s%r failed' % (func.__name__, args)
+            print >>sys.stderr, traceback.format_exc()
+            raise FuseOSError(errno.EIO)
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+class DirCache(object):
+    #目录 => (过期时间, {名字: 列目录得到的entry})
+    def __init__(self, ttl=DIR_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._dirs = {}
+        self._stats = {'hit': 0, 'miss': 0}
+
+    def get(self, dirpath):
+        with self._lock:
+            item = self._dirs.get(dirpath)
+            if item is not None and item[0] > time.time():
+                self._stats['hit'] += 1
+                return item[1]
+            self._stats['miss'] += 1
+            return None
+
+    def put(self, dirpath, entries):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._dirs[dirpath] = (time.time() + self.ttl, entries)
+
+    def invalidate(self, *dirpaths):
+        with self._lock:
+            for dirpath in dirpaths:
+                self._dirs.pop(dirpath, None)
+
+    def invalidate_tree(self, dirpath):
+        #dirpath和它下面所有的目录
+        with self._lock:
+            for key in self._dirs.keys():
+                if key == dirpath or key.startswith(dirpath.rstrip(u'/') + u'/'):
+                    del self._dirs[key]
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+class DiskBlockCache(object):
+    #块文件是blocks/<key>.<序号>，key由路径、大小、mtime、sha和块大小决定，文件变了自然换成新的key
+    #按最近使用的顺序淘汰，总大小不超过max_bytes；启动时按mtime接管已有的块
+    def __init__(self, cache_dir, max_bytes=CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._lock = threading.Lock()
+        self._lru = OrderedDict() #文件名 => 大小
+        self._bytes = 0
+        self._stats = {'hit': 0, 'miss': 0}
+
+        existed = []
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name.endswith('.tmp'):
+                os.unlink(path)
+                continue
+            st = os.stat(path)
+            existed.append((st.st_mtime, name, st.st_size))
+        for mtime, name, size in sorted(existed):
+            self._lru[name] = size
+            self._bytes += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def make_key(bucket, path, entry, block_size):
+        raw = u'%s:%s:%s:%s:%s:%d' % (bucket, path, entry.get('filesize'), entry.get('mtime'), entry.get('sha', u''), block_size)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key, index):
+        name = '%s.%d' % (key, index)
+        with self._lock:
+            if name not in self._lru:
+                self._stats['miss'] += 1
+                return None
+            self._lru[name] = self._lru.pop(name)
+            self._stats['hit'] += 1
+        try:
+            with open(os.path.join(self.cache_dir, name), 'rb') as f:
+                return f.read()
+        except IOError:
+            #被其它挂载淘汰了
+            with self._lock:
+                self._bytes -= self._lru.pop(name, 0)
+            return None
+
+    def put(self, key, index, data):
+        name = '%s.%d' % (key, index)
+        path = os.path.join(self.cache_dir, name)
+        tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), thread_id())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+        with self._lock:
+            self._bytes += len(data) - self._lru.pop(name, 0)
+            self._lru[name] = len(data)
+            self._evict()
+
+    def _evict(self):
+        #调用时需持有self._lock
+        while self._bytes > self.max_bytes and self._lru:
+            name, size = self._lru.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.unlink(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['bytes'] = self._bytes
+            stats['blocks'] = len(self._lru)
+            return stats
+
+def thread_id():
+    return threading.current_thread().ident or 0
+
+class _Reader(object):
+    #同一个文件(同一个版本)的所有只读句柄共用
+    def __init__(self, key, cos_file):
+        self.key = key
+        self.file = cos_file
+        self.refs = 0
+
+class _Handle(object):
+    def __init__(self, path, reader=None, spool=None, dirty=False):
+        self.path = path
+        self.reader = reader
+        self.spool = spool  #写入的临时文件，只读句柄为None
+        self.dirty = dirty
+        self.lock = threading.Lock()
+
+def _spool_size(spool):
+    #写入的数据可能还在file对象的缓冲区里，fstat看不到，用seek到末尾取大小
+    spool.seek(0, os.SEEK_END)
+    return spool.tell()
+
+class CosOperations(Operations):
+    def __init__(self, fs, dir_ttl=DIR_TTL, cache_dir=CACHE_DIR, cache_size=CACHE_SIZE, block_size=BLOCK_SIZE,
+                 memory_blocks=MEMORY_BLOCKS, readahead=READAHEAD_BLOCKS, max_uploads=MAX_UPLOADS, slice_threads=SLICE_THREADS):
+        self.fs = fs
+        self.block_size = block_size
+        self.memory_blocks = memory_blocks
+        self.readahead = readahead
+        self.slice_threads = slice_threads
+        self.dir_cache = DirCache(dir_ttl)
+        self.disk_cache = DiskBlockCache(os.path.join(cache_dir, 'blocks'), cache_size) if cache_size > 0 else None
+        self.spool_dir = os.path.join(cache_dir, 'spool')
+        if not os.path.exists(self.spool_dir):
+            os.makedirs(self.spool_dir)
+        self._upload_sem = threading.Semaphore(max(max_uploads, 1))
+
+        self._lock = threading.Lock()
+        self._fh = itertools.count(1)
+        self._handles = {} #fh => _Handle
+        self._readers = {} #key => _Reader
+        self._writing = {} #path => 还没关闭的写句柄数，getattr/readdir要能看到还没上传的文件
+        self._uid = os.getuid()
+        self._gid = os.getgid()
+        self._mounted_at = time.time()
+
+    #---- 目录和属性 ----
+
+    def _list(self, dirpath):
+        #目录不存在时返回None
+        entries = self.dir_cache.get(dirpath)
+        if entries is not None:
+            return entries
+        entries = {}
+        try:
+            for entry in self.fs.iter_dir(dirpath.rstrip(u'/') + u'/', retry_page=True):
+                entries[entry['name']] = entry
+        except CosFSException, e:
+            if e[0] != CODE_NOT_EXIST:
+                raise
+            return None
+        self.dir_cache.put(dirpath, entries)
+        return entries
+
+    def _lookup(self, path):
+        dirpath, name = posixpath.split(path)
+        entries = self._list(dirpath)
+        if entries is None:
+            return None
+        return entries.get(name)
+
+    def _spool_handle(self, path):
+        with self._lock:
+            for h in self._handles.values():
+                if h.spool is not None and h.path == path:
+                    return h
+        return None
+
+    def _file_attr(self, size, mtime, ctime):
+        return {'st_mode': stat.S_IFREG | 0644, 'st_nlink': 1, 'st_size': size,
+                'st_mtime': mtime, 'st_ctime': ctime, 'st_atime': mtime,
+                'st_uid': self._uid, 'st_gid': self._gid, 'st_blksize': self.block_size,
+                'st_blocks': (size + 511) // 512}
+
+    def _dir_attr(self, mtime, ctime):
+        return {'st_mode': stat.S_IFDIR | 0755, 'st_nlink': 2, 'st_size': 4096,
+                'st_mtime': mtime, 'st_ctime': ctime, 'st_atime': mtime,
+                'st_uid': self._uid, 'st_gid': self._gid}
+
+    @cos_errors
+    def getattr(self, path, fh=None):
+        path = to_unicode(path)
+        if path == u'/':
+            return self._dir_attr(self._mounted_at, self._mounted_at)
+
+        h = self._spool_handle(path)
+        if h is not None:
+            with h.lock:
+                size = _spool_size(h.spool)
+            now = time.time()
+            return self._file_attr(size, now, now)
+
+        entry = self._lookup(path)
+        if entry is None:
+            raise FuseOSError(errno.ENOENT)
+        mtime = float(entry.get('mtime') or 0)
+        ctime = float(entry.get('ctime') or 0)
+        if self.fs.isFile(entry):
+            return self._file_attr(int(entry['filesize']), mtime, ctime)
+        return self._dir_attr(mtime, ctime)
+
+    @cos_errors
+    def readdir(self, path, fh=None):
+        path = to_unicode(path)
+        entries = self._list(path)
+        if entries is None:
+            raise FuseOSError(errno.ENOENT)
+        names = set(entries)
+        with self._lock:
+            for p in self._writing:
+                if posixpath.dirname(p) == path:
+                    names.add(posixpath.basename(p))
+        return [u'.', u'..'] + sorted(names)
+
+    def statfs(self, path):
+        #cos没有容量限制，报一个足够大的数(1PB)
+        nr_block = (1 << 50) // self.block_size
+        return {'f_bsize': self.block_size, 'f_frsize': self.block_size, 'f_blocks': nr_block,
+                'f_bfree': nr_block, 'f_bavail': nr_block, 'f_files': 1 << 30, 'f_ffree': 1 << 30, 'f_namemax': 255}
+
+    #cos没有权限和时间属性可以修改，touch等命令需要这些调用成功
+    def chmod(self, path, mode):
+        return 0
+
+    def chown(self, path, uid, gid):
+        return 0
+
+    def utimens(self, path, times=None):
+        return 0
+
+    #---- 读 ----
+
+    def _open_reader(self, path, entry):
+        key = DiskBlockCache.make_key(self.fs.bucket, path, entry, self.block_size)
+        with self._lock:
+            reader = self._readers.get(key)
+            if reader is None:
+                url = self.fs.signedUrlOf(path, entry)
+                fetch = lambda begin, end: retry(self.fs.fetchRange, url, begin, end)
+                if self.disk_cache is not None:
+                    fetch = self._disk_cached(fetch, key, int(entry['filesize']))
+                cos_file = CosFile(fetch, int(entry['filesize']), path, self.block_size, self.memory_blocks, self.readahead)
+                reader = self._readers[key] = _Reader(key, cos_file)
+            reader.refs += 1
+            return reader
+
+    def _close_reader(self, reader):
+        with self._lock:
+            reader.refs -= 1
+            if reader.refs == 0:
+                del self._readers[reader.key]
+                reader.file.close()
+
+    def _disk_cached(self, fetch, key, size):
+        #CosFile按块对齐请求[begin, end]；缓存里有的块从磁盘读，只向cos请求中间缺的那一段
+        bs = self.block_size
+        cache = self.disk_cache
+        def fetch_range(begin, end):
+            first, last = begin // bs, end // bs
+            blocks = [cache.get(key, i) for i in range(first, last + 1)]
+            missing = [first + k for k, block in enumerate(blocks) if block is None]
+            if missing:
+                lo, hi = missing[0], missing[-1]
+                data = fetch(lo * bs, min((hi + 1) * bs, size) - 1)
+                for i in range(lo, hi + 1):
+                    block = data[(i - lo) * bs:(i - lo + 1) * bs]
+                    blocks[i - first] = block
+                    cache.put(key, i, block)
+            return ''.join(blocks)
+        return fetch_range
+
+    #---- 打开和关闭 ----
+
+    def _new_handle(self, h):
+        with self._lock:
+            fh = next(self._fh)
+            self._handles[fh] = h
+            if h.spool is not None:
+                self._writing[h.path] = self._writing.get(h.path, 0) + 1
+        return fh
+
+    def _new_spool(self):
+        fd, spool_path = tempfile.mkstemp(dir=self.spool_dir)
+        os.unlink(spool_path) #只通过句柄访问，进程退出后自动释放
+        return os.fdopen(fd, 'w+b')
+
+    @cos_errors
+    def open(self, path, flags):
+        path = to_unicode(path)
+        accmode = flags & (os.O_RDONLY | os.O_WRONLY | os.O_RDWR)
+        if accmode == os.O_RDONLY:
+            entry = self._lookup(path)
+            if entry is None:
+                raise FuseOSError(errno.ENOENT)
+            if not self.fs.isFile(entry):
+                raise FuseOSError(errno.EISDIR)
+            return self._new_handle(_Handle(path, reader=self._open_reader(path, entry)))
+
+        #写：O_TRUNC时从空文件开始，否则先把原来的内容下载到临时文件里
+        spool = self._new_spool()
+        try:
+            if not flags & os.O_TRUNC:
+                entry = self._lookup(path)
+                if entry is None:
+                    raise FuseOSError(errno.ENOENT)
+                reader = self._open_reader(path, entry)
+                try:
+                    offset = 0
+                    while offset < reader.file.size:
+                        data = reader.file.pread(offset, self.block_size)
+                        spool.write(data)
+                        offset += len(data)
+                finally:
+                    self._close_reader(reader)
+        except:
+            spool.close()
+            raise
+        return self._new_handle(_Handle(path, spool=spool, dirty=bool(flags & os.O_TRUNC)))
+
+    @cos_errors
+    def create(self, path, mode, fi=None):
+        path = to_unicode(path)
+        return self._new_handle(_Handle(path, spool=self._new_spool(), dirty=True))
+
+    @cos_errors
+    def read(self, path, size, offset, fh):
+        h = self._handles[fh]
+        if h.spool is not None:
+            with h.lock:
+                h.spool.seek(offset)
+                return h.spool.read(size)
+        return h.reader.file.pread(offset, size)
+
+    @cos_errors
+    def write(self, path, data, offset, fh):
+        h = self._handles[fh]
+        if h.spool is None:
+            raise FuseOSError(errno.EBADF)
+        with h.lock:
+            h.spool.seek(offset)
+            h.spool.write(data)
+            h.dirty = True
+        return len(data)
+
+    @cos_errors
+    def truncate(self, path, length, fh=None):
+        path = to_unicode(path)
+        h = self._handles.get(fh) if fh is not None else self._spool_handle(path)
+        if h is not None and h.spool is not None:
+            with h.lock:
+                h.spool.truncate(length)
+                h.dirty = True
+            return 0
+
+        #没有打开的写句柄：改完直接上传
+        fh = self.open(path, os.O_WRONLY | (os.O_TRUNC if length == 0 else 0))
+        try:
+            self.truncate(path, length, fh)
+            self.flush(path, fh)
+        finally:
+            self.release(path, fh)
+        return 0
+
+    @cos_errors
+    def flush(self, path, fh):
+        #close(2)会调用flush，上传失败时close能返回错误
+        h = self._handles[fh]
+        if h.spool is not None:
+            self._upload(h)
+        return 0
+
+    def fsync(self, path, datasync, fh):
+        return self.flush(path, fh)
+
+    def release(self, path, fh):
+        with self._lock:
+            h = self._handles.pop(fh, None)
+        if h is None:
+            return 0
+        try:
+            if h.reader is not None:
+                self._close_reader(h.reader)
+            if h.spool is not None:
+                try:
+                    self._upload(h)
+                except Exception:
+                    print >>sys.stderr, '[mount] upload %s failed, changes are lost' % h.path.encode('utf-8')
+                    print >>sys.stderr, traceback.format_exc()
+        finally:
+            if h.spool is not None:
+                h.spool.close()
+                with self._lock:
+                    self._writing[h.path] -= 1
+                    if self._writing[h.path] == 0:
+                        del self._writing[h.path]
+        return 0
+
+    def _upload(self, h):
+        with h.lock:
+            if not h.dirty:
+                return
+            size = _spool_size(h.spool)
+            h.spool.seek(0)
+            with self._upload_sem:
+                self.fs.put(h.spool, h.path, size, overwrite=True, max_con=self.slice_threads)
+            h.dirty = False
+        self.dir_cache.invalidate(posixpath.dirname(h.path))
+
+    #---- 目录和文件的增删改名 ----
+
+    @cos_errors
+    def mkdir(self, path, mode):
+        path = to_unicode(path)
+        if self._lookup(path) is not None:
+            raise FuseOSError(errno.EEXIST)
+        self.fs.mkdir(path)
+        self.dir_cache.invalidate(posixpath.dirname(path))
+        return 0
+
+    @cos_errors
+    def rmdir(self, path):
+        path = to_unicode(path)
+        entries = self._list(path)
+        if entries is None:
+            raise FuseOSError(errno.ENOENT)
+        if entries:
+            raise FuseOSError(errno.ENOTEMPTY)
+        self.fs.delFolder(path + u'/')
+        self.dir_cache.invalidate_tree(path)
+        self.dir_cache.invalidate(posixpath.dirname(path))
+        return 0
+
+    @cos_errors
+    def unlink(self, path):
+        path = to_unicode(path)
+        self.fs.rm(path)
+        self.dir_cache.invalidate(posixpath.dirname(path))
+        return 0
+
+    @cos_errors
+    def rename(self, old, new):
+        old = to_unicode(old)
+        new = to_unicode(new)
+        entry = self._lookup(old)
+        if entry is None:
+            raise FuseOSError(errno.ENOENT)
+        if self.fs.isFile(entry):
+            self.fs.mv(old, new, overwrite=True)
+        else:
+            #移动目录里的内容再删掉空的源目录
+            self.fs.mvdir(old + u'/', new + u'/', plan_dir=None)
+            self.fs.delFolder(old + u'/')
+            self.dir_cache.invalidate_tree(old)
+            self.dir_cache.invalidate_tree(new)
+        self.dir_cache.invalidate(posixpath.dirname(old), posixpath.dirname(new))
+        return 0
+
+    def format_stats(self):
+        stats = self.dir_cache.get_stats()
+        line = '[mount] dir cache hit: %d, miss: %d' % (stats['hit'], stats['miss'])
+        if self.disk_cache is not None:
+            stats = self.disk_cache.get_stats()
+            line += ', disk cache hit: %d, miss: %d, %d blocks (%d bytes)' % (
+                stats['hit'], stats['miss'], stats['blocks'], stats['bytes'])
+        return line
+
+def mount(fs, mountpoint, foreground=True, threads=True, **options):
+    #options见CosOperations的参数
+    if FUSE is None:
+        raise CosFSException(-1, 'fusepy is required to mount a bucket, try `pip install fusepy`')
+    ops = CosOperations(fs, **options)
+    try:
+        FUSE(ops, mountpoint, foreground=foreground, nothreads=not threads, fsname='cosfs:' + fs.bucket.encode('utf-8'))
+    finally:
+        print >>sys.stderr, ops.format_stats()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#author: felix021@gmail.com
+
+#mv -r的改名计划：先列出整个源目录，记下其中的目录和文件(相对源目录的路径)，保存为checkpoint文件
+#第一行是计划本身，之后每移动完一个文件追加一行它的序号；中途失败后重新执行同样的命令，只移动剩下的文件
+
+import os
+import json
+import errno
+import hashlib
+import threading
+
+class MovePlan(object):
+    def __init__(self, checkpoint_dir, bucket, src, dest):
+        #checkpoint_dir为None时只在内存里记录，不能续传
+        self.checkpoint_dir = checkpoint_dir
+        self.path = None
+        if checkpoint_dir:
+            key = json.dumps({'bucket': bucket, 'src': src, 'dest': dest}, sort_keys=True)
+            self.path = os.path.join(checkpoint_dir, hashlib.sha1(key).hexdigest() + '.mvplan')
+        self._lock = threading.Lock()
+        self._file = None
+        self.dirs = []  #[(相对路径, 层级)]，相对路径以/结尾，源目录本身是u''
+        self.files = [] #[相对路径]
+        self.done = set()
+
+    def load(self):
+        #读取上次没完成的计划，没有时返回False
+        if self.path is None:
+            return False
+        try:
+            with open(self.path) as f:
+                lines = f.read().split('\n')
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+
+        try:
+            plan = json.loads(lines[0])
+        except ValueError:
+            #计划没写完整时当作没有计划，重新列目录
+            return False
+        self.dirs = [tuple(d) for d in plan['dirs']]
+        self.files = plan['files']
+        #最后一行可能只写了一半，只认以换行结尾的行
+        for line in lines[1:-1]:
+            if line.isdigit():
+                self.done.add(int(line))
+        return True
+
+    def create(self, dirs, files):
+        self.dirs = sorted(dirs, key=lambda d: (d[1], d[0]))
+        self.files = sorted(files)
+        self.done = set()
+        if self.path is None:
+            return
+        if not os.path.exists(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({'dirs': self.dirs, 'files': self.files}) + '\n')
+        os.rename(tmp_path, self.path)
+
+    def pending(self):
+        #[(序号, 相对路径)]
+        return [(i, relpath) for i, relpath in enumerate(self.files) if i not in self.done]
+
+    def mark_done(self, i):
+        #每个文件追加一行并flush，进程被杀掉时最多丢失正在执行的几个
+        with self._lock:
+            self.done.add(i)
+            if self.path is None:
+                return
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write('%d\n' % i)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        self.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+#author: felix021@gmail.com
+
+#小文件打包：cpdir --pack把小文件依次写进tar包(.cosfs_pack/pack-*.tar)再上传，
+#另外上传一个索引(.cosfs_pack/index.json)记录每个文件所在的包、数据偏移和大小。
+#恢复时按索引用Range请求取出文件，请求数由包的个数决定，和文件数无关。
+#包是标准的tar文件，下载下来也可以直接用tar解开。
+
+import os
+import json
+import errno
+import tarfile
+import tempfile
+import threading
+
+PACK_DIR        = u'.cosfs_pack'
+INDEX_NAME      = u'index.json'
+#包的目标大小，不到8MB的包走单文件上传
+PACK_SIZE       = 4 * 1024 * 1024
+#小于这个大小的文件才打包
+PACK_THRESHOLD  = 64 * 1024
+#同一个包里要取的两段数据间隔不超过这么多字节时合并成一个Range请求
+MAX_RANGE_GAP   = 1024 * 1024
+
+READ_BLOCK_SIZE = 64 * 1024
+
+class PackIndex(object):
+    def __init__(self, data=None):
+        data = data or {}
+        self._lock = threading.Lock()
+        self.packs = data.get('packs', {}) #包名 => 大小
+        self.files = data.get('files', {}) #相对路径 => [包名, 数据偏移, 大小, mtime]
+
+    @classmethod
+    def loads(cls, content):
+        return cls(json.loads(content))
+
+    def dumps(self):
+        with self._lock:
+            return json.dumps({'version': 1, 'packs': self.packs, 'files': self.files})
+
+    def get(self, relpath):
+        with self._lock:
+            return self.files.get(relpath)
+
+    def add_pack(self, name, size, members):
+        #包上传成功后才登记其中的文件，失败的包不会出现在索引里
+        with self._lock:
+            self.packs[name] = size
+            for relpath, offset, size, mtime in members:
+                self.files[relpath] = [name, offset, size, mtime]
+
+    def remove_unused_packs(self):
+        #覆盖后不再被任何文件引用的包，返回包名列表
+        with self._lock:
+            used = set(entry[0] for entry in self.files.values())
+            unused = [name for name in self.packs if name not in used]
+            for name in unused:
+                del self.packs[name]
+            return unused
+
+    def group_by_pack(self):
+        #包名 => [(相对路径, 偏移, 大小), ...]，按偏移排序
+        groups = {}
+        with self._lock:
+            for relpath, (name, offset, size, mtime) in self.files.items():
+                groups.setdefault(name, []).append((relpath, offset, size))
+        for members in groups.values():
+            members.sort(key=lambda m: m[1])
+        return groups
+
+class PackWriter(object):
+    #把小文件依次写进临时tar文件，达到pack_size时封包，调用on_sealed(包名, 临时文件路径, members)
+    #members: [(相对路径, 数据偏移, 大小, mtime), ...]，临时文件由on_sealed负责删除
+    def __init__(self, prefix, on_sealed, pack_size=PACK_SIZE):
+        self.prefix = prefix
+        self.on_sealed = on_sealed
+        self.pack_size = pack_size
+        self._seq = 0
+        self._tar = None
+        self._path = None
+        self._members = []
+
+    def add(self, path, relpath):
+        if self._tar is None:
+            fd, self._path = tempfile.mkstemp(prefix='cosfs_pack_', suffix='.tar')
+            os.close(fd)
+            self._tar = tarfile.open(self._path, 'w', format=tarfile.GNU_FORMAT)
+
+        tarinfo = self._tar.gettarinfo(path, relpath.encode('utf-8'))
+        with open(path, 'rb') as f:
+            self._tar.addfile(tarinfo, f)
+        #addfile之后offset指向(按512字节对齐的)数据块末尾，往回推出数据的起始偏移
+        nr_block = (tarinfo.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+        offset = self._tar.offset - nr_block * tarfile.BLOCKSIZE
+        self._members.append((relpath, offset, tarinfo.size, int(tarinfo.mtime)))
+
+        if self._tar.offset >= self.pack_size:
+            self.seal()
+
+    def seal(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        name = u'%s%05d.tar' % (self.prefix, self._seq)
+        path, members = self._path, self._members
+        self._seq += 1
+        self._tar, self._path, self._members = None, None, []
+        self.on_sealed(name, path, members)
+
+def plan_ranges(members, max_gap=MAX_RANGE_GAP):
+    #把按偏移排好序的members合并成若干个Range请求: [(begin, end, members)]，end不含
+    ranges = []
+    for member in members:
+        relpath, offset, size = member
+        if ranges and offset - ranges[-1][1] <= max_gap:
+            ranges[-1][1] = max(ranges[-1][1], offset + size)
+            ranges[-1][2].append(member)
+        else:
+            ranges.append([offset, offset + size, [member]])
+    return [tuple(r) for r in ranges]
+
+class _ChunkReader(object):
+    #把iter_content返回的数据块当作一个可以顺序读的流
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = ''
+        self._pos = 0
+
+    def read(self, size):
+        if self._pos >= len(self._buf):
+            self._buf, self._pos = '', 0
+            for chunk in self._chunks:
+                if chunk:
+                    self._buf = chunk
+                    break
+        data = self._buf[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def skip(self, size):
+        while size > 0:
+            data = self.read(size)
+            if not data:
+                raise IOError('unexpected end of stream')
+            size -= len(data)
+
+def extract_members(chunks, begin, members, local):
+    #chunks是包里从begin开始的连续数据，按members依次写出local/相对路径
+    reader = _ChunkReader(chunks)
+    pos = begin
+    for relpath, offset, size in members:
+        reader.skip(offset - pos)
+        path = os.path.join(local, relpath)
+        dirname = os.path.dirname(path)
+        try:
+            os.makedirs(dirname)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        try:
+            with open(path, 'wb') as f:
+                left = size
+                while left > 0:
+                    data = reader.read(min(left, READ_BLOCK_SIZE))
+                    if not data:
+                        raise IOError('%s: unexpected end of stream' % relpath.encode('utf-8'))
+                    f.write(data)
+                    left -= len(data)
+        except:
+            #删除不完整的文件
+            if os.path.exists(path):
+                os.unlink(path)
+            raise
+        pos = offset + size
@@ -3,8 +3,11 @@
 from .cos_client import CosClient
 from .cos_client import CosConfig
 from .cos_client import CredInfo
+from .cos_async import AsyncCosClient
+from .cos_async import CosFuture
 from .cos_request import UploadFileRequest
 from .cos_request import UploadSliceFileRequest
+from .cos_request import UploadStreamRequest
 from .cos_request import UpdateFileRequest
 from .cos_request import UpdateFolderRequest
 from .cos_request import DelFolderRequest
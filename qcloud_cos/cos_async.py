@@ -0,0 +1,900 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""异步客户端: 一个线程用asyncore事件循环驱动所有http连接, 适合大量并发的小请求(stat/list/delete等)"""
+
+import asyncore
+import errno
+import fcntl
+import json
+import os
+import select
+import socket
+import sys
+import threading
+import time
+import urllib
+import urlparse
+from collections import deque
+from logging import getLogger
+
+import cos_auth
+from cos_err import CosErr
+from cos_cred import CredInfo
+from cos_config import CosConfig
+from cos_common import encode_multipart
+from cos_http import PoolStats
+from cos_http import new_http_session
+from cos_http import configure_http_session
+from cos_metrics import RequestTimer, CONNECT, TTFB, BODY, DECODE
+from cos_op import FileOp
+from cos_op import FolderOp
+from cos_request import UploadFileRequest
+from cos_request import DelFileRequest
+from cos_request import DelFolderRequest
+from cos_request import CreateFolderRequest
+from cos_request import StatFileRequest
+from cos_request import StatFolderRequest
+from cos_request import ListFolderRequest
+from cos_request import DownloadFileRequest
+from cos_request import MoveFileRequest
+
+logger = getLogger(__name__)
+
+RECV_SIZE = 256 * 1024
+SEND_SIZE = 256 * 1024
+
+
+class CosFuture(object):
+    """CosFuture 异步请求的结果, result()返回和CosClient同步接口相同的dict
+
+    回调在事件循环线程里执行, 不能在回调里等待其他future
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._callbacks = []
+
+    @classmethod
+    def resolved(cls, result):
+        future = cls()
+        future.set_result(result)
+        return future
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """等待并返回结果
+
+        :param timeout: 最多等待的秒数, None表示一直等待
+        :return:
+        """
+        if timeout is None:
+            # 不带超时的wait在python2里不响应Ctrl-C
+            while not self._event.wait(1.0):
+                pass
+        elif not self._event.wait(timeout):
+            raise RuntimeError("result is not ready after %.3fs" % timeout)
+        return self._result
+
+    def set_result(self, result):
+        with self._lock:
+            self._result = result
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            self._run_callback(callback)
+
+    def add_done_callback(self, callback):
+        """future完成后调用callback(future), 已经完成的立即调用"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        self._run_callback(callback)
+
+    def then(self, func):
+        """完成后用func(result)的返回值(dict或CosFuture)作为新future的结果
+
+        :param func:
+        :return: CosFuture
+        """
+        future = CosFuture()
+
+        def on_done(f):
+            try:
+                ret = func(f.result())
+            except Exception as e:
+                logger.exception("future callback failed")
+                ret = CosErr.get_err_msg(CosErr.UNKNOWN_ERROR, str(e))
+            if isinstance(ret, CosFuture):
+                ret.add_done_callback(lambda r: future.set_result(r.result()))
+            else:
+                future.set_result(ret)
+
+        self.add_done_callback(on_done)
+        return future
+
+    def _run_callback(self, callback):
+        try:
+            callback(self)
+        except Exception:
+            logger.exception("future callback failed")
+
+
+def wait_all(futures):
+    """等待所有future完成, 按顺序返回结果"""
+    return [future.result() for future in futures]
+
+
+def _encode_params(params):
+    items = []
+    for key, value in params.items():
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        items.append((key, value))
+    return urllib.urlencode(items)
+
+
+def _json_result(url, status, body):
+    """和BaseOp.send_request一样把响应转成dict"""
+    if status < 500:
+        try:
+            return json.loads(body)
+        except ValueError as e:
+            err_detail = 'url:%s, exception:%s' % (url, str(e))
+            return CosErr.get_err_msg(CosErr.SERVER_ERROR, err_detail)
+    logger.warning("request failed, response message: %s" % body)
+    err_detail = 'url:%s, status_code:%d' % (url, status)
+    ret = CosErr.get_err_msg(CosErr.NETWORK_ERROR, err_detail)
+    ret[u'http_status'] = status
+    return ret
+
+
+class _HttpRequest(object):
+
+    def __init__(self, method, url, headers, body, timeout, future, sink_path=None, op=None):
+        parts = urlparse.urlsplit(url)
+        self.method = method
+        self.url = url
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        self.headers = headers
+        self.body = body
+        self.timeout = timeout
+        self.future = future
+        # 下载时响应体直接写入该文件
+        self.sink_path = sink_path
+        self.queued_at = time.time()
+        # 提交时已经达到并发上限, 需要排队
+        self.limited = False
+        self.retried = False
+        # 在提交请求的线程里创建, 认领该线程里刚算完的签名耗时
+        self.timer = RequestTimer(op or ('download' if sink_path else method.lower()))
+        self.status = None
+
+    def key(self):
+        return self.host, self.port
+
+    def encode(self, keep_alive):
+        host = self.host if self.port == 80 else '%s:%d' % (self.host, self.port)
+        lines = ['%s %s HTTP/1.1' % (self.method, self.path), 'Host: %s' % host]
+        for key, value in self.headers.items():
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            lines.append('%s: %s' % (key, value))
+        if self.body or self.method == 'POST':
+            lines.append('Content-Length: %d' % len(self.body))
+        lines.append('Connection: %s' % ('keep-alive' if keep_alive else 'close'))
+        head = '\r\n'.join(lines) + '\r\n\r\n'
+        # 文件流(MultipartFileStream)由连接边读边发, 这里只返回请求头
+        return head + self.body if isinstance(self.body, str) else head
+
+    def make_result(self, status, body):
+        if self.sink_path is None:
+            begin_at = time.time()
+            ret = _json_result(self.url, status, body)
+            self.timer.add(DECODE, time.time() - begin_at)
+            return ret
+        if status in [200, 206]:
+            return {u'code': 0, u'message': "download successfully"}
+        return {u'code': 1, u'message': "download failed with status code:" + str(status)}
+
+    def make_error(self, err_info):
+        if self.sink_path is not None:
+            return {u'code': 1, u'message': "download failed, exception: " + err_info}
+        err_detail = 'url:%s, exception:%s' % (self.url, err_info)
+        return CosErr.get_err_msg(CosErr.SERVER_ERROR, err_detail)
+
+
+class _HttpConnection(asyncore.dispatcher):
+    """一个keep-alive的http连接, 同一时间只处理一个请求"""
+
+    def __init__(self, loop, key, address):
+        asyncore.dispatcher.__init__(self, map=loop.socket_map)
+        self.loop = loop
+        self.key = key
+        self.request = None
+        self.closed = False
+        self.create_socket(address[0], socket.SOCK_STREAM)
+        if loop.config.get_tcp_nodelay():
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if loop.config.get_tcp_keepalive():
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        try:
+            self.connect(address[4])
+        except socket.error:
+            self.close()
+            raise
+
+    def start(self, request, keep_alive, reused):
+        self.request = request
+        self._reused = reused
+        self.deadline = time.time() + (request.timeout or 300)
+        # 建连、等待响应、接收响应体各阶段的起点
+        self._started_at = time.time()
+        self._first_byte_at = None
+        request.timer.bytes_out = len(request.body)
+        self._out = request.encode(keep_alive)
+        self._sent = 0
+        self._stream = None
+        if not isinstance(request.body, str):
+            # 重试时从头发送
+            self._stream = request.body
+            self._stream.seek(0)
+        self._received = False
+        self._buf = ''
+        self._status = None
+        self._headers = None
+        self._remaining = None
+        self._chunked = False
+        self._chunk_left = None
+        self._body = []
+        self._nbytes = 0
+        self._sink = None
+
+    # asyncore回调
+    def readable(self):
+        return True
+
+    def writable(self):
+        return self.connecting or (self.request is not None and
+                                   (self._sent < len(self._out) or self._stream is not None))
+
+    def handle_connect(self):
+        if self.request is not None:
+            now = time.time()
+            self.request.timer.add(CONNECT, now - self._started_at)
+            self._started_at = now
+
+    def handle_write(self):
+        if self.request is None:
+            return
+        if self._sent >= len(self._out):
+            data = self._stream.read(SEND_SIZE) if self._stream is not None else ''
+            if not data:
+                self._stream = None
+                return
+            self._out, self._sent = data, 0
+        self._sent += self.send(buffer(self._out, self._sent, SEND_SIZE))
+
+    def handle_read(self):
+        data = self.recv(RECV_SIZE)
+        if not data or self.closed:
+            return
+        if self.request is None:
+            # 空闲连接不应该收到数据
+            self.abort()
+            return
+        if not self._received:
+            self._first_byte_at = time.time()
+            self.request.timer.add(TTFB, self._first_byte_at - self._started_at)
+        self._received = True
+        self._feed(data)
+
+    def handle_close(self):
+        if self.closed:
+            return
+        request = self.request
+        if request is not None and self._headers is not None and self._remaining is None and not self._chunked:
+            # 没有Content-Length的响应以连接关闭结束
+            self._finish(False)
+            return
+        self.abort()
+        if request is None:
+            return
+        if not self._received and not request.retried and self._reused:
+            # 服务端关闭了空闲的keep-alive连接, 换个连接重发
+            request.retried = True
+            self.loop.retry(request)
+        else:
+            self.loop.complete(request, request.make_error('connection closed'))
+
+    def handle_error(self):
+        request = self.request
+        logger.exception("connection error")
+        self.abort()
+        if request is not None:
+            self.loop.complete(request, request.make_error(str(sys.exc_info()[1])))
+
+    def abort(self):
+        # 关闭连接, 不回调请求
+        if self.closed:
+            return
+        self.closed = True
+        self._close_sink()
+        self.close()
+        self.loop.discard(self)
+        self.request = None
+
+    # 解析响应
+    def _feed(self, data):
+        if self._headers is None:
+            self._buf += data
+            pos = self._buf.find('\r\n\r\n')
+            if pos < 0:
+                return
+            head, data = self._buf[:pos], self._buf[pos + 4:]
+            self._buf = ''
+            self._parse_head(head)
+            if self._headers is None:
+                return
+
+        if self._chunked:
+            self._feed_chunked(data)
+        else:
+            if self._remaining is not None:
+                data = data[:self._remaining]
+                self._remaining -= len(data)
+            self._on_body(data)
+            if self._remaining == 0:
+                self._finish(True)
+
+    def _parse_head(self, head):
+        lines = head.split('\r\n')
+        status_line = lines[0].split(' ', 2)
+        self._version = status_line[0]
+        self._status = int(status_line[1])
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        self._headers = headers
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            self._chunked = True
+        elif 'content-length' in headers:
+            self._remaining = int(headers['content-length'])
+        elif self.request.method == 'HEAD' or self._status in [204, 304] or 100 <= self._status < 200:
+            self._remaining = 0
+
+        if self.request.sink_path is not None and self._status in [200, 206]:
+            self._sink = open(self.request.sink_path, 'wb')
+
+        if self._remaining == 0:
+            self._finish(True)
+
+    def _feed_chunked(self, data):
+        self._buf += data
+        while self.request is not None:
+            if self._chunk_left is None:
+                pos = self._buf.find('\r\n')
+                if pos < 0:
+                    return
+                size = int(self._buf[:pos].split(';', 1)[0], 16)
+                if size == 0:
+                    # 最后一个chunk, 之后是可选的trailer和空行
+                    rest = self._buf[pos + 2:]
+                    if rest.startswith('\r\n') or rest.find('\r\n\r\n') >= 0:
+                        self._buf = ''
+                        self._finish(True)
+                    return
+                self._buf = self._buf[pos + 2:]
+                self._chunk_left = size
+            if self._chunk_left > 0:
+                data = self._buf[:self._chunk_left]
+                self._buf = self._buf[len(data):]
+                self._chunk_left -= len(data)
+                self._on_body(data)
+                if self._chunk_left > 0:
+                    return
+            # chunk末尾的\r\n
+            if len(self._buf) < 2:
+                return
+            self._buf = self._buf[2:]
+            self._chunk_left = None
+
+    def _on_body(self, data):
+        if not data:
+            return
+        self._nbytes += len(data)
+        if self._sink is not None:
+            self._sink.write(data)
+        elif self.request.sink_path is None or self._status not in [200, 206]:
+            self._body.append(data)
+
+    def _close_sink(self):
+        if getattr(self, '_sink', None) is not None:
+            self._sink.close()
+            self._sink = None
+
+    def _finish(self, reusable):
+        request = self.request
+        self._close_sink()
+        if request.sink_path is not None and self._status in [200, 206] and 'content-length' in self._headers:
+            if self._nbytes != int(self._headers['content-length']):
+                self.abort()
+                self.loop.complete(request, request.make_error('incomplete file'))
+                return
+        request.status = self._status
+        request.timer.bytes_in = self._nbytes
+        if self._first_byte_at is not None:
+            request.timer.add(BODY, time.time() - self._first_byte_at)
+        result = request.make_result(self._status, ''.join(self._body))
+
+        keep_alive = (reusable and self.loop.config.get_keep_alive()
+                      and self._version != 'HTTP/1.0'
+                      and self._headers.get('connection', '').lower() != 'close')
+        self.request = None
+        if keep_alive:
+            self.loop.release(self)
+        else:
+            self.abort()
+        self.loop.complete(request, result)
+
+
+class _Waker(asyncore.file_dispatcher):
+    """其他线程提交请求时写入管道, 唤醒事件循环"""
+
+    def __init__(self, loop):
+        read_fd, self._write_fd = os.pipe()
+        asyncore.file_dispatcher.__init__(self, read_fd, map=loop.socket_map)
+        os.close(read_fd)
+        flags = fcntl.fcntl(self._write_fd, fcntl.F_GETFL)
+        fcntl.fcntl(self._write_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.loop = loop
+
+    def wake(self):
+        try:
+            os.write(self._write_fd, 'x')
+        except OSError as e:
+            # 管道满了说明事件循环已经会被唤醒
+            if e.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                raise
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        try:
+            self.recv(4096)
+        except (OSError, IOError) as e:
+            if e.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                raise
+
+    def handle_close(self):
+        pass
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        os.close(self._write_fd)
+
+
+class CosEventLoop(object):
+    """CosEventLoop 在一个线程里执行所有http请求, 同时进行的请求数不超过max_concurrency, 超出的排队等待"""
+
+    def __init__(self, config, pool_stats, max_concurrency=1000):
+        """
+
+        :param config: CosConfig, 使用其中的keep-alive和tcp选项
+        :param pool_stats: PoolStats, 统计连接的新建、复用以及排队的请求
+        :param max_concurrency: 同时进行的最大请求数
+        """
+        self.config = config
+        self.socket_map = {}
+        self._pool_stats = pool_stats
+        self._max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._active = set()
+        self._idle = {}         # (host, port) => [_HttpConnection]
+        self._addresses = {}    # (host, port) => getaddrinfo的结果
+        self._closed = False
+        self._waker = _Waker(self)
+        self._thread = threading.Thread(target=self._run, name='cos-event-loop')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, method, url, headers=None, body='', timeout=None, sink_path=None, op=None):
+        """提交请求, 可在任意线程调用
+
+        :param op: 操作类型, 用于按操作统计耗时, 默认为download(有sink_path时)或method
+        :return: CosFuture
+        """
+        future = CosFuture()
+        request = _HttpRequest(method, url, headers or {}, body, timeout, future, sink_path, op)
+        if request.scheme != 'http':
+            future.set_result(request.make_error('only http is supported'))
+            return future
+        with self._lock:
+            if self._closed:
+                future.set_result(request.make_error('event loop is closed'))
+                return future
+            request.limited = len(self._active) + len(self._pending) >= self._max_concurrency
+            self._pending.append(request)
+        self._waker.wake()
+        return future
+
+    def close(self):
+        """停止事件循环, 未完成的请求返回错误"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._waker.wake()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    # 以下方法只在事件循环线程里调用
+    def _run(self):
+        use_poll = hasattr(select, 'poll')
+        while not self._closed:
+            self._dispatch()
+            asyncore.loop(timeout=0.5, use_poll=use_poll, map=self.socket_map, count=1)
+            self._check_timeout()
+        self._shutdown()
+
+    def _dispatch(self):
+        while len(self._active) < self._max_concurrency:
+            with self._lock:
+                if not self._pending:
+                    return
+                request = self._pending.popleft()
+            if request.limited:
+                self._pool_stats.incr('waited')
+                self._pool_stats.incr('wait_time', time.time() - request.queued_at)
+            self._start(request)
+
+    def _start(self, request):
+        # 重发的请求用新连接, 其他空闲连接可能也已经被服务端关闭
+        idle = None if request.retried else self._idle.get(request.key())
+        reused = bool(idle)
+        if reused:
+            conn = idle.pop()
+            self._pool_stats.incr('reused')
+        else:
+            try:
+                conn = _HttpConnection(self, request.key(), self._resolve(request.key()))
+            except Exception as e:
+                result = request.make_error(str(e))
+                self._record(request, result)
+                request.future.set_result(result)
+                return
+            self._pool_stats.incr('created')
+        self._active.add(conn)
+        conn.start(request, self.config.get_keep_alive(), reused)
+
+    def _resolve(self, key):
+        if key not in self._addresses:
+            self._addresses[key] = socket.getaddrinfo(key[0], key[1], 0, socket.SOCK_STREAM)[0]
+        return self._addresses[key]
+
+    def _check_timeout(self):
+        now = time.time()
+        for conn in list(self._active):
+            if conn.request is not None and conn.deadline < now:
+                request = conn.request
+                conn.abort()
+                self.complete(request, request.make_error('timeout'))
+
+    def _shutdown(self):
+        for conn in list(self._active):
+            request = conn.request
+            conn.abort()
+            if request is not None:
+                request.future.set_result(request.make_error('event loop is closed'))
+        for conns in self._idle.values():
+            for conn in conns:
+                conn.abort()
+        with self._lock:
+            pending, self._pending = self._pending, deque()
+        for request in pending:
+            request.future.set_result(request.make_error('event loop is closed'))
+        self._waker.close()
+
+    def complete(self, request, result):
+        if not isinstance(request.body, str):
+            # 出错时文件流可能没读完, 及时关掉文件
+            request.body.close()
+        self._record(request, result)
+        request.future.set_result(result)
+        self._dispatch()
+
+    def _record(self, request, result):
+        self.config.get_metrics().record(request.timer, result.get(u'code'), request.status)
+
+    def retry(self, request):
+        request.limited = False
+        with self._lock:
+            self._pending.appendleft(request)
+        self._dispatch()
+
+    def release(self, conn):
+        self._active.discard(conn)
+        self._idle.setdefault(conn.key, []).append(conn)
+
+    def discard(self, conn):
+        self._active.discard(conn)
+        idle = self._idle.get(conn.key)
+        if idle and conn in idle:
+            idle.remove(conn)
+
+
+class _AsyncOpMixin(object):
+    """把BaseOp.send_request换成提交到事件循环, 各op的请求构造逻辑不变, 返回CosFuture
+
+    请求数限速在提交请求的线程里等待; 在回调里(事件循环线程)发请求时, 改到单独的线程里等待再提交,
+    事件循环线程不能阻塞. 上传带宽不限速, 事件循环上只适合发小请求
+    """
+
+    def send_request(self, method, bucket, cos_path, op=None, **kwargs):
+        rate_limiter = self._config.get_rate_limiter()
+        if threading.current_thread() is self._loop._thread and rate_limiter.is_active():
+            future = CosFuture()
+
+            def submit():
+                try:
+                    self._submit(rate_limiter, method, bucket, cos_path, op, kwargs).add_done_callback(
+                        lambda f: future.set_result(f.result()))
+                except Exception as e:
+                    logger.exception("request failed")
+                    future.set_result(CosErr.get_err_msg(CosErr.UNKNOWN_ERROR, str(e)))
+
+            t = threading.Thread(target=submit)
+            t.daemon = True
+            t.start()
+            return future
+        return self._submit(rate_limiter, method, bucket, cos_path, op, kwargs)
+
+    def _submit(self, rate_limiter, method, bucket, cos_path, op, kwargs):
+        rate_limiter.acquire_request()
+        url = self._build_url(bucket, cos_path)
+        if kwargs.get('params'):
+            url += '?' + _encode_params(kwargs['params'])
+        headers = dict(kwargs.get('headers') or {})
+        body = ''
+        if kwargs.get('files') is not None:
+            body, headers['Content-Type'] = encode_multipart(kwargs['files'])
+        elif kwargs.get('data') is not None:
+            body = kwargs['data']
+        logger.debug("sending request, method: %s, bucket: %s, cos_path: %s" % (method, bucket, cos_path))
+        return self._loop.submit(method, url, headers, body, kwargs.get('timeout'), op=op)
+
+
+class _AsyncFileOp(_AsyncOpMixin, FileOp):
+
+    def __init__(self, cred, config, http_session, loop):
+        FileOp.__init__(self, cred, config, http_session)
+        self._loop = loop
+
+
+class _AsyncFolderOp(_AsyncOpMixin, FolderOp):
+
+    def __init__(self, cred, config, http_session, loop):
+        FolderOp.__init__(self, cred, config, http_session)
+        self._loop = loop
+
+
+def _as_future(ret):
+    # 参数检查失败时op直接返回dict
+    if isinstance(ret, CosFuture):
+        return ret
+    return CosFuture.resolved(ret)
+
+
+class AsyncCosClient(object):
+    """异步Cos客户端, 接口和CosClient相同, 但返回CosFuture, 用future.result()得到同样的dict
+
+    所有请求在一个事件循环线程里执行, 上千个并发请求也不需要对应数量的线程;
+    只支持http, 8MB以上的文件仍用同步的分片上传(在单独的线程里执行)
+    """
+
+    def __init__(self, appid, secret_id, secret_key, region="shanghai", max_concurrency=1000):
+        """ 设置用户的相关信息
+
+        :param appid: appid
+        :param secret_id: secret_id
+        :param secret_key: secret_key
+        :param max_concurrency: 同时进行的最大请求数
+        """
+        self._cred = CredInfo(appid, secret_id, secret_key)
+        self._config = CosConfig(region=region)
+        self._pool_stats = PoolStats()
+        self._loop = CosEventLoop(self._config, self._pool_stats, max_concurrency)
+        self._http_session = new_http_session(self._config, self._pool_stats)
+        self._file_op = _AsyncFileOp(self._cred, self._config, self._http_session, self._loop)
+        self._folder_op = _AsyncFolderOp(self._cred, self._config, self._http_session, self._loop)
+        self._sync_file_op = FileOp(self._cred, self._config, self._http_session)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """停止事件循环"""
+        self._loop.close()
+
+    def set_config(self, config):
+        """设置config"""
+        assert isinstance(config, CosConfig)
+        self._config = config
+        self._loop.config = config
+        configure_http_session(self._http_session, config, self._pool_stats)
+        for op in [self._file_op, self._folder_op, self._sync_file_op]:
+            op.set_config(config)
+
+    def get_config(self):
+        """获取config"""
+        return self._config
+
+    def get_pool_stats(self):
+        """获取连接统计, waited表示因为超过max_concurrency而排队的请求"""
+        return self._pool_stats
+
+    def set_cred(self, cred):
+        """设置用户的身份信息
+
+        :param cred:
+        :return:
+        """
+        assert isinstance(cred, CredInfo)
+        self._cred = cred
+        for op in [self._file_op, self._folder_op, self._sync_file_op]:
+            op.set_cred(cred)
+
+    def get_cred(self):
+        """获取用户的相关信息
+
+        :return:
+        """
+        return self._cred
+
+    def upload_file(self, request):
+        """ 上传文件, 8MB以下在事件循环里单文件上传, 8MB(含)以上在单独的线程里分片上传
+
+        :param request:
+        :return: CosFuture
+        """
+        assert isinstance(request, UploadFileRequest)
+        check_params_ret = self._file_op._check_params(request)
+        if check_params_ret is not None:
+            return CosFuture.resolved(check_params_ret)
+
+        if os.path.getsize(request.get_local_path()) >= 8 * 1024 * 1024:
+            return self._run_in_thread(self._sync_file_op.upload_file, request)
+
+        future = self._file_op._post_single_file(request)
+        if request.get_insert_only() != 0:
+            return future
+
+        # 和FileOp.upload_single_file一样, 覆盖失败时删除后重传
+        def on_upload(ret):
+            if ret[u'code'] == 0:
+                return ret
+            del_request = DelFileRequest(bucket_name=request.get_bucket_name(), cos_path=request.get_cos_path())
+            return self._file_op.del_file(del_request).then(
+                lambda ret: self._file_op._post_single_file(request) if ret[u'code'] == 0 else ret)
+
+        return future.then(on_upload)
+
+    def del_file(self, request):
+        """ 删除文件
+
+        :param request:
+        :return: CosFuture
+        """
+        assert isinstance(request, DelFileRequest)
+        return _as_future(self._file_op.del_file(request))
+
+    def move_file(self, request):
+        """ 移动文件
+
+        :param request:
+        :return: CosFuture
+        """
+        assert isinstance(request, MoveFileRequest)
+        return _as_future(self._file_op.move_file(request))
+
+    def stat_file(self, request):
+        """ 获取文件信息
+
+        :param request:
+        :return: CosFuture
+        """
+        assert isinstance(request, StatFileRequest)
+        return _as_future(self._file_op.stat_file(request))
+
+    def download_file(self, request):
+        """ 下载文件
+
+        :param request:
+        :return: CosFuture
+        """
+        assert isinstance(request, DownloadFileRequest)
+        auth = cos_auth.Auth(self._cred)
+        expired = int(time.time()) + self._config.get_sign_expired()
+        sign = auth.sign_download(request.get_bucket_name(), request.get_cos_path(), expired)
+        url = self._file_op.build_download_url(request.get_bucket_name(), request.get_cos_path(), sign)
+        return self.download_url(url, request._local_filename, request._custom_headers)
+
+    def download_url(self, url, local_filename, headers=None):
+        """ 下载url(例如stat结果中的source_url加签名)到本地文件
+
+        :param url:
+        :param local_filename:
+        :param headers:
+        :return: CosFuture
+        """
+        return self._loop.submit('GET', url, dict(headers or {}), '', self._config.get_timeout(), local_filename)
+
+    def create_folder(self, request):
+        """ 创建目录
+
+        :param request:
+        :return: CosFuture
+        """
+        assert isinstance(request, CreateFolderRequest)
+        return _as_future(self._folder_op.create_folder(request))
+
+    def del_folder(self, request):
+        """ 删除目录
+
+        :param request:
+        :return: CosFuture
+        """
+        assert isinstance(request, DelFolderRequest)
+        return _as_future(self._folder_op.del_folder(request))
+
+    def stat_folder(self, request):
+        """ 获取目录信息
+
+        :param request:
+        :return: CosFuture
+        """
+        assert isinstance(request, StatFolderRequest)
+        return _as_future(self._folder_op.stat_folder(request))
+
+    def list_folder(self, request):
+        """ 获取目录下的文件和目录列表
+
+        :param request:
+        :return: CosFuture
+        """
+        assert isinstance(request, ListFolderRequest)
+        return _as_future(self._folder_op.list_folder(request))
+
+    @staticmethod
+    def _run_in_thread(func, *args):
+        future = CosFuture()
+
+        def run():
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                logger.exception("request failed")
+                future.set_result(CosErr.get_err_msg(CosErr.UNKNOWN_ERROR, str(e)))
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+        return future
@@ -8,13 +8,86 @@ import hmac
 import hashlib
 import binascii
 import base64
+from threading import Lock
+from collections import OrderedDict
+
+from cos_metrics import add_pending, SIGN
+
+
+class SignCache(object):
+    """SignCache 多次签名的缓存
+
+    签名剩余的有效期不少于调用方要求的一半时直接复用, 同时按操作类型统计命中次数
+    """
+
+    def __init__(self, max_entries=4096):
+        self._max_entries = max_entries
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._stats = dict()
+
+    def get(self, key, expired, op):
+        """查找可以复用的签名
+
+        :param key: 缓存的key
+        :param expired: 调用方要求的过期时间, UNIX时间戳
+        :param op: 操作类型, 用于统计
+        :return: 签名字符串, 没有可用的签名时返回None
+        """
+        now = int(time.time())
+        with self._lock:
+            sign = None
+            entry = self._entries.get(key)
+            if entry is not None:
+                sign_expired, cached_sign = entry
+                if sign_expired - now >= (expired - now) / 2:
+                    sign = cached_sign
+                else:
+                    del self._entries[key]
+
+            counter = self._stats.setdefault(op, {'hit': 0, 'miss': 0})
+            counter['hit' if sign is not None else 'miss'] += 1
+            return sign
+
+    def put(self, key, expired, sign):
+        """缓存签名
+
+        :param key: 缓存的key
+        :param expired: 签名的过期时间, UNIX时间戳
+        :param sign: 签名字符串
+        :return:
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expired, sign)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self):
+        """获取各操作类型的命中统计
+
+        :return: dict like {'upload_slice_data': {'hit': 99, 'miss': 1}}
+        """
+        with self._lock:
+            return dict((op, dict(counter)) for op, counter in self._stats.items())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._stats.clear()
+
+
+# 所有Auth实例共享的签名缓存
+default_sign_cache = SignCache()
 
 
 class Auth(object):
-    def __init__(self, cred):
+    def __init__(self, cred, sign_cache=None):
         self.cred = cred
+        self.sign_cache = sign_cache if sign_cache is not None else default_sign_cache
 
     def app_sign(self, bucket, cos_path, expired, upload_sign=True):
+        begin_at = time.time()
         appid = self.cred.get_appid()
         bucket = bucket.encode('utf8')
         secret_id = self.cred.get_secret_id().encode('utf8')
@@ -38,6 +111,8 @@ class Auth(object):
         hmac_digest = binascii.unhexlify(hmac_digest)
         sign_hex = hmac_digest + plain_text
         sign_base64 = base64.b64encode(sign_hex)
+        # 计入随后发出的请求的sign阶段
+        add_pending(SIGN, time.time() - begin_at)
         return sign_base64
 
     def sign_once(self, bucket, cos_path):
@@ -49,15 +124,25 @@ class Auth(object):
         """
         return self.app_sign(bucket, cos_path, 0)
 
-    def sign_more(self, bucket, cos_path, expired):
+    def sign_more(self, bucket, cos_path, expired, op='more'):
         """多次签名(针对上传文件，创建目录, 获取文件目录属性, 拉取目录列表)
 
+        签名在有效期内可以重复使用, 因此会被缓存复用
+
         :param bucket: bucket名称
         :param cos_path: 要操作的cos路径, 以'/'开始
         :param expired: 签名过期时间, UNIX时间戳, 如想让签名在30秒后过期, 即可将expired设成当前时间加上30秒
+        :param op: 操作类型, 仅用于统计缓存命中
         :return: 签名字符串
         """
-        return self.app_sign(bucket, cos_path, expired)
+        # 缓存会长期保留key, 不放secret_key的明文
+        key_digest = hashlib.sha1(self.cred.get_secret_key().encode('utf8')).hexdigest()
+        key = (self.cred.get_appid(), self.cred.get_secret_id(), key_digest, bucket, cos_path, 'more')
+        sign = self.sign_cache.get(key, expired, op)
+        if sign is None:
+            sign = self.app_sign(bucket, cos_path, expired)
+            self.sign_cache.put(key, expired, sign)
+        return sign
 
     def sign_download(self, bucket, cos_path, expired):
         """下载签名(用于获取后拼接成下载链接，下载私有bucket的文件)
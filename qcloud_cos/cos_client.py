@@ -4,10 +4,14 @@
 import requests
 from cos_cred import CredInfo
 from cos_config import CosConfig
+from cos_http import PoolStats
+from cos_http import new_http_session
+from cos_http import configure_http_session
 from cos_op import FileOp
 from cos_op import FolderOp
 from cos_request import UploadFileRequest
 from cos_request import UploadSliceFileRequest
+from cos_request import UploadStreamRequest
 from cos_request import UpdateFileRequest
 from cos_request import UpdateFolderRequest
 from cos_request import DelFileRequest
@@ -36,7 +40,8 @@ class CosClient(object):
         """
         self._cred = CredInfo(appid, secret_id, secret_key)
         self._config = CosConfig(region=region)
-        self._http_session = requests.session()
+        self._pool_stats = PoolStats()
+        self._http_session = new_http_session(self._config, self._pool_stats)
         self._file_op = FileOp(self._cred, self._config, self._http_session)
         self._folder_op = FolderOp(self._cred, self._config, self._http_session)
 
@@ -44,6 +49,7 @@ class CosClient(object):
         """设置config"""
         assert isinstance(config, CosConfig)
         self._config = config
+        configure_http_session(self._http_session, config, self._pool_stats)
         self._file_op.set_config(config)
         self._folder_op.set_config(config)
 
@@ -51,6 +57,14 @@ class CosClient(object):
         """获取config"""
         return self._config
 
+    def get_http_session(self):
+        """获取共享的http会话, 下载等自行发送的请求也应使用它以复用连接池"""
+        return self._http_session
+
+    def get_pool_stats(self):
+        """获取连接池统计(新建/复用/等待的连接数)"""
+        return self._pool_stats
+
     def set_cred(self, cred):
         """设置用户的身份信息
 
@@ -96,6 +110,15 @@ class CosClient(object):
         assert isinstance(request, UploadSliceFileRequest)
         return self._file_op.upload_slice_file(request)
 
+    def upload_stream(self, request):
+        """ 从流上传, 需要预先知道数据的总大小, 上传策略和upload_file相同
+
+        :param request:
+        :return:
+        """
+        assert isinstance(request, UploadStreamRequest)
+        return self._file_op.upload_stream(request)
+
     def del_file(self, request):
         """ 删除文件
 
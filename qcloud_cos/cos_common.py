@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function
+import os
+import uuid
 import struct
 import io
+import sys
+import hashlib
+import ctypes
+import ctypes.util
+from threading import Lock
 
 try:
     range = xrange
@@ -158,6 +165,104 @@ def sha1(data):
     return Sha1Hash().update(data).hexdigest()
 
 
+class _ShaCtx(ctypes.Structure):
+    """Mirror of OpenSSL's SHA_CTX, h0..h4 is the intermediate state"""
+
+    _fields_ = [
+        ('h0', ctypes.c_uint32),
+        ('h1', ctypes.c_uint32),
+        ('h2', ctypes.c_uint32),
+        ('h3', ctypes.c_uint32),
+        ('h4', ctypes.c_uint32),
+        ('Nl', ctypes.c_uint32),
+        ('Nh', ctypes.c_uint32),
+        ('data', ctypes.c_uint32 * 16),
+        ('num', ctypes.c_uint),
+    ]
+
+
+def _load_libcrypto():
+    """Load libcrypto's low level SHA1 functions, return None if unavailable."""
+    lib_path = ctypes.util.find_library('crypto')
+    if lib_path is None:
+        return None
+    # the unversioned libcrypto shipped with macOS aborts the process when loaded
+    if sys.platform == 'darwin' and lib_path.startswith('/usr/lib/'):
+        return None
+
+    try:
+        lib = ctypes.CDLL(lib_path)
+        lib.SHA1_Init.argtypes = [ctypes.POINTER(_ShaCtx)]
+        lib.SHA1_Update.argtypes = [ctypes.POINTER(_ShaCtx), ctypes.c_char_p, ctypes.c_size_t]
+        lib.SHA1_Final.argtypes = [ctypes.c_char_p, ctypes.POINTER(_ShaCtx)]
+    except (OSError, AttributeError):
+        return None
+
+    # make sure the struct layout matches before trusting it
+    ctx = _ShaCtx()
+    md = ctypes.create_string_buffer(20)
+    lib.SHA1_Init(ctypes.byref(ctx))
+    lib.SHA1_Update(ctypes.byref(ctx), b'abc', 3)
+    lib.SHA1_Final(md, ctypes.byref(ctx))
+    if md.raw != hashlib.sha1(b'abc').digest():
+        return None
+    return lib
+
+
+_libcrypto = _load_libcrypto()
+
+
+class NativeSha1Hash(object):
+    """SHA-1 backed by libcrypto, with the same api (including inner_digest) as Sha1Hash."""
+
+    name = 'openssl-sha1'
+    digest_size = 20
+    block_size = 64
+
+    def __init__(self):
+        if _libcrypto is None:
+            raise RuntimeError('libcrypto is not available')
+        self._ctx = _ShaCtx()
+        _libcrypto.SHA1_Init(ctypes.byref(self._ctx))
+
+    def update(self, arg):
+        """Update the current digest.
+
+        Arguments:
+            arg: bytes, bytearray, or a file-like object to read from.
+        """
+        if isinstance(arg, bytearray):
+            arg = bytes(arg)
+        elif not isinstance(arg, bytes):
+            arg = arg.read()
+
+        _libcrypto.SHA1_Update(ctypes.byref(self._ctx), arg, len(arg))
+        return self
+
+    def digest(self):
+        """Produce the final hash value (big-endian) as a bytes object"""
+        ctx = _ShaCtx.from_buffer_copy(self._ctx)
+        md = ctypes.create_string_buffer(20)
+        _libcrypto.SHA1_Final(md, ctypes.byref(ctx))
+        return md.raw
+
+    def hexdigest(self):
+        """Produce the final hash value (big-endian) as a hex string"""
+        return '%08x%08x%08x%08x%08x' % struct.unpack(b'>5I', self.digest())
+
+    def inner_digest(self):
+        ctx = self._ctx
+        tmp = struct.unpack(">5I", struct.pack("<5I", ctx.h0, ctx.h1, ctx.h2, ctx.h3, ctx.h4))
+        return '%08x%08x%08x%08x%08x' % tmp
+
+
+def new_sha1_hash():
+    """Return the fastest available hash object exposing inner_digest()"""
+    if _libcrypto is not None:
+        return NativeSha1Hash()
+    return Sha1Hash()
+
+
 class Sha1Util(object):
 
     @staticmethod
@@ -174,7 +279,7 @@ class Sha1Util(object):
 
             result = []
             file_size = path.getsize(file_name)
-            sha1_obj = Sha1Hash()
+            sha1_obj = new_sha1_hash()
             for current_offset in range(0, file_size, slice_size):
 
                 data_length = min(slice_size, file_size - current_offset)
@@ -185,11 +290,250 @@ class Sha1Util(object):
             result[-1]['datasha'] = sha1_obj.hexdigest()
             return result
 
+    @staticmethod
+    def get_sha1_by_file(file_name, block_size=64 * 1024):
+        """ Get SHA of the whole file, reading block_size bytes at a time
+
+        :param file_name: local file path
+        :param block_size: read buffer size in bytes
+        :return: hex digest
+        """
+        sha1_obj = hashlib.sha1()
+        with open(file_name, 'rb') as f:
+            while True:
+                data = f.read(block_size)
+                if not data:
+                    break
+                sha1_obj.update(data)
+        return sha1_obj.hexdigest()
+
+
+class SliceSizer(object):
+    """根据文件大小和观测到的RTT/吞吐量选择分片大小
+
+    分片越大请求次数越少(每个请求都要签名, 组multipart, 等一个RTT), 但必须是服务端接受的值
+    """
+
+    # upload_slice_init接受的分片大小中不小于原来默认值(1MB)的部分
+    SLICE_SIZES = (1024 * 1024, 2 * 1024 * 1024, 3 * 1024 * 1024)
+    # 分片数超过该值时使用更大的分片
+    MAX_SLICE_COUNT = 1000
+    # 单个分片的传输时间至少是RTT的这么多倍, 使等待RTT的时间占比不超过约20%
+    RTT_FACTOR = 4
+
+    def __init__(self, alpha=0.3):
+        """
+
+        :param alpha: 指数移动平均的权重
+        """
+        self._alpha = alpha
+        self._lock = Lock()
+        self._rtt = None
+        self._bandwidth = None
+
+    def _ewma(self, old, new):
+        if old is None:
+            return new
+        return old * (1 - self._alpha) + new * self._alpha
+
+    def record_rtt(self, seconds):
+        """记录一个不带数据的请求的耗时, 作为RTT的估计"""
+        with self._lock:
+            self._rtt = self._ewma(self._rtt, seconds)
+
+    def record_transfer(self, nbytes, seconds):
+        """记录一个数据分片请求的大小和耗时, 扣除RTT后估计单连接吞吐量"""
+        with self._lock:
+            transfer_time = seconds - (self._rtt or 0)
+            if transfer_time <= 0:
+                return
+            self._bandwidth = self._ewma(self._bandwidth, nbytes / transfer_time)
+
+    def get_estimate(self):
+        """返回(rtt秒数, 吞吐量字节/秒), 尚未观测到时为None"""
+        with self._lock:
+            return self._rtt, self._bandwidth
+
+    def choose(self, file_size):
+        """选择分片大小
+
+        :param file_size: 文件大小
+        :return: SLICE_SIZES中的一个值
+        """
+        slice_size = self.SLICE_SIZES[-1]
+        for size in self.SLICE_SIZES:
+            if file_size <= size * self.MAX_SLICE_COUNT:
+                slice_size = size
+                break
+
+        rtt, bandwidth = self.get_estimate()
+        if rtt is not None and bandwidth is not None:
+            wanted = bandwidth * rtt * self.RTT_FACTOR
+            for size in self.SLICE_SIZES:
+                if size >= wanted or size == self.SLICE_SIZES[-1]:
+                    slice_size = max(slice_size, size)
+                    break
+        return slice_size
+
+
+def read_full(stream, size):
+    """从流中读取size字节, 管道、socket等一次read可能只返回一部分
+
+    :param stream: 有read方法的对象
+    :param size: 字节数
+    :return: str, 流提前结束时不足size字节
+    """
+    parts = []
+    left = size
+    while left > 0:
+        data = stream.read(left)
+        if not data:
+            break
+        parts.append(data)
+        left -= len(data)
+    return ''.join(parts)
+
+
+def readinto_full(stream, buf):
+    """把流中的数据读满buf, 流有readinto方法时直接读进buf, 不产生中间的str
+
+    :param stream: 有read方法的对象
+    :param buf: bytearray
+    :return: 读到的字节数, 流提前结束时小于len(buf)
+    """
+    view = memoryview(buf)
+    size = len(buf)
+    n = 0
+    readinto = getattr(stream, 'readinto', None)
+    while n < size:
+        if readinto is not None:
+            got = readinto(view[n:])
+        else:
+            data = stream.read(size - n)
+            got = len(data)
+            view[n:n + got] = data
+        if not got:
+            break
+        n += got
+    return n
+
+
+def encode_multipart(fields):
+    """按requests的files参数格式编码multipart/form-data
+
+    :param fields: dict, 值为str、unicode或memoryview
+    :return: (body, content_type)
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif isinstance(value, memoryview):
+            value = value.tobytes()
+        elif not isinstance(value, str):
+            value = str(value)
+        parts.append('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n\r\n' % (boundary, name, name))
+        parts.append(value)
+        parts.append('\r\n')
+    parts.append('--%s--\r\n' % boundary)
+    return ''.join(parts), 'multipart/form-data; boundary=%s' % boundary
+
+
+class MultipartFileStream(object):
+    """边读文件边生成multipart/form-data请求体, 内存中只有当前读到的一块数据
+
+    字段的编码方式和requests的files参数一致, 文件内容作为最后一个字段.
+    长度预先算好, 可以直接作为requests的data参数(带Content-Length发送), 支持seek(0)后重发
+    """
+
+    def __init__(self, fields, file_field, file_path, boundary=None):
+        """ 初始化类
+
+        :param fields: [(name, value), ...], 普通字段, 按顺序放在文件内容之前
+        :param file_field: 文件内容的字段名
+        :param file_path: 本地文件路径
+        :param boundary: multipart分隔符, 默认随机生成
+        """
+        self.boundary = boundary or uuid.uuid4().hex
+        head = []
+        for name, value in fields:
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            head.append(self._part_header(name) + str(value) + '\r\n')
+        head.append(self._part_header(file_field))
+        self._head = ''.join(head)
+        self._tail = '\r\n--%s--\r\n' % self.boundary
+        self._file_path = file_path
+        self._file_size = os.path.getsize(file_path)
+        self._file = None
+        self._file_pos = 0
+        self._pos = 0
+        self.len = len(self._head) + self._file_size + len(self._tail)
+
+    def _part_header(self, name):
+        return '--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n\r\n' % (
+            self.boundary, name, name)
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=' + self.boundary
+
+    def __len__(self):
+        return self.len
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self.len
+        self._pos = max(0, min(offset, self.len))
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len - self._pos
+        chunks = []
+        while size > 0 and self._pos < self.len:
+            chunk = self._read_at(self._pos, size)
+            self._pos += len(chunk)
+            size -= len(chunk)
+            chunks.append(chunk)
+        if self._pos >= self.len:
+            self.close()
+        return ''.join(chunks)
+
+    def _read_at(self, pos, size):
+        head_len = len(self._head)
+        if pos < head_len:
+            return self._head[pos:pos + size]
+        pos -= head_len
+        if pos < self._file_size:
+            if self._file is None:
+                self._file = open(self._file_path, 'rb')
+                self._file_pos = 0
+            if self._file_pos != pos:
+                self._file.seek(pos)
+            data = self._file.read(min(size, self._file_size - pos))
+            self._file_pos = pos + len(data)
+            if not data:
+                # 文件在上传过程中被截断, 无法凑够Content-Length
+                raise IOError('file truncated while uploading: %s' % self._file_path)
+            return data
+        pos -= self._file_size
+        return self._tail[pos:pos + size]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
 
 if __name__ == '__main__':
     # Imports required for command line parsing. No need for these elsewhere
     import argparse
-    import sys
     import os
 
     # Parse the incoming arguments
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from cos_retry import RetryPolicy
+from cos_ratelimit import RateLimiter
+from cos_metrics import Metrics
 
 class CosRegionInfo(object):
 
@@ -54,6 +57,17 @@ class CosConfig(object):
         self._timeout = timeout
         self._sign_expired = sign_expired
         self._enable_https = enable_https
+        self._journal_dir = None
+        self._pool_connections = 10
+        self._pool_maxsize = 10
+        self._pool_block = False
+        self._keep_alive = True
+        self._tcp_nodelay = True
+        self._tcp_keepalive = True
+        self._adaptive_slice_size = True
+        self._retry_policy = RetryPolicy()
+        self._rate_limiter = RateLimiter()
+        self._metrics = Metrics()
         if self._enable_https:
             self._protocol = "https"
         else:
@@ -109,6 +123,157 @@ class CosConfig(object):
         """
         return self._sign_expired
 
+    def set_journal_dir(self, journal_dir):
+        """设置分片上传断点记录的存放目录, 为None时不记录(不支持续传)
+
+        :param journal_dir:
+        :return:
+        """
+        self._journal_dir = journal_dir
+
+    def get_journal_dir(self):
+        """获取分片上传断点记录的存放目录
+
+        :return:
+        """
+        return self._journal_dir
+
+    def set_pool_size(self, pool_connections, pool_maxsize):
+        """设置http连接池大小
+
+        :param pool_connections: 缓存连接池的host数量
+        :param pool_maxsize: 每个host最多保持的连接数, 应不小于并发的线程数
+        :return:
+        """
+        assert isinstance(pool_connections, int)
+        assert isinstance(pool_maxsize, int)
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+
+    def get_pool_connections(self):
+        """获取缓存连接池的host数量
+
+        :return:
+        """
+        return self._pool_connections
+
+    def get_pool_maxsize(self):
+        """获取每个host最多保持的连接数
+
+        :return:
+        """
+        return self._pool_maxsize
+
+    def set_pool_block(self, pool_block):
+        """设置连接池满时是否等待空闲连接, False表示新建一个用完即关闭的连接
+
+        :param pool_block:
+        :return:
+        """
+        self._pool_block = pool_block
+
+    def get_pool_block(self):
+        """获取连接池满时是否等待空闲连接
+
+        :return:
+        """
+        return self._pool_block
+
+    def set_keep_alive(self, keep_alive):
+        """设置是否使用http keep-alive复用连接
+
+        :param keep_alive:
+        :return:
+        """
+        self._keep_alive = keep_alive
+
+    def get_keep_alive(self):
+        """获取是否使用http keep-alive
+
+        :return:
+        """
+        return self._keep_alive
+
+    def set_socket_options(self, tcp_nodelay=True, tcp_keepalive=True):
+        """设置tcp选项
+
+        :param tcp_nodelay: 是否设置TCP_NODELAY
+        :param tcp_keepalive: 是否设置SO_KEEPALIVE
+        :return:
+        """
+        self._tcp_nodelay = tcp_nodelay
+        self._tcp_keepalive = tcp_keepalive
+
+    def get_tcp_nodelay(self):
+        return self._tcp_nodelay
+
+    def get_tcp_keepalive(self):
+        return self._tcp_keepalive
+
+    def set_adaptive_slice_size(self, adaptive):
+        """设置upload_file是否根据文件大小和网络状况自动选择分片大小, False时固定为1MB
+
+        :param adaptive:
+        :return:
+        """
+        self._adaptive_slice_size = adaptive
+
+    def get_adaptive_slice_size(self):
+        """获取upload_file是否自动选择分片大小
+
+        :return:
+        """
+        return self._adaptive_slice_size
+
+    def set_retry_policy(self, retry_policy):
+        """设置重试策略(cos_retry.RetryPolicy), 多个client可以共享同一个策略的重试预算和统计
+
+        :param retry_policy:
+        :return:
+        """
+        self._retry_policy = retry_policy
+
+    def get_retry_policy(self):
+        """获取重试策略
+
+        :return:
+        """
+        return self._retry_policy
+
+    def set_rate_limiter(self, rate_limiter):
+        """设置限速(cos_ratelimit.RateLimiter), 限制请求数和上传/下载带宽
+
+        :param rate_limiter:
+        :return:
+        """
+        self._rate_limiter = rate_limiter
+
+    def get_rate_limiter(self):
+        """获取限速
+
+        :return:
+        """
+        return self._rate_limiter
+
+    def set_metrics(self, metrics):
+        """设置请求统计(cos_metrics.Metrics), 记录每个请求各阶段的耗时、流量和错误码
+
+        :param metrics:
+        :return:
+        """
+        self._metrics = metrics
+
+    def get_metrics(self):
+        """获取请求统计
+
+        :return:
+        """
+        return self._metrics
+
+    def set_region(self, *args, **kwargs):
+        """设置地域, 参数同CosRegionInfo(region或者hostname, download_hostname)"""
+        self._region = CosRegionInfo(*args, **kwargs)
+
     @property
     def enable_https(self):
         assert self._enable_https is not None
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""http连接池, 按CosConfig配置大小、keep-alive和tcp选项, 并统计连接的创建和复用"""
+
+import socket
+import time
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool
+from requests.packages.urllib3.connectionpool import HTTPSConnectionPool
+
+from cos_metrics import add_pending, CONNECT
+
+
+class PoolStats(object):
+    """PoolStats 连接池统计
+
+    created: 新建的tcp连接数, reused: 复用已有连接的次数,
+    waited: 连接池已满(pool_block=True)时等待空闲连接的次数, wait_time: 等待的总秒数
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._stats = {'created': 0, 'reused': 0, 'waited': 0, 'wait_time': 0.0}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return 'created: %d, reused: %d, waited: %d (%.3fs)' % (
+            stats['created'], stats['reused'], stats['waited'], stats['wait_time'])
+
+
+def _timed_connection_class(base):
+    """生成记录建连耗时的连接类, 耗时计入同一个线程随后结束的请求"""
+
+    class TimedConnection(base):
+
+        def connect(self):
+            begin_at = time.time()
+            try:
+                base.connect(self)
+            finally:
+                add_pending(CONNECT, time.time() - begin_at)
+
+    return TimedConnection
+
+
+def _stat_pool_class(base, stats):
+    """生成在取连接时记录统计的连接池类"""
+
+    class StatConnectionPool(base):
+        ConnectionCls = _timed_connection_class(base.ConnectionCls)
+
+        def _get_conn(self, timeout=None):
+            must_wait = self.block and self.pool is not None and self.pool.empty()
+            begin_at = time.time()
+            conn = base._get_conn(self, timeout)
+            if must_wait:
+                stats.incr('waited')
+                stats.incr('wait_time', time.time() - begin_at)
+
+            # 新建的连接或者被服务端断开后重置的连接, sock都是None
+            if conn.sock is None:
+                stats.incr('created')
+            else:
+                stats.incr('reused')
+            return conn
+
+    return StatConnectionPool
+
+
+class CosHTTPAdapter(HTTPAdapter):
+    """CosHTTPAdapter 带统计和tcp选项的HTTPAdapter"""
+
+    def __init__(self, stats, socket_options=None, **kwargs):
+        self._stats = stats
+        self._socket_options = socket_options
+        super(CosHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self._socket_options is not None:
+            pool_kwargs['socket_options'] = self._socket_options
+        super(CosHTTPAdapter, self).init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _stat_pool_class(HTTPConnectionPool, self._stats),
+            'https': _stat_pool_class(HTTPSConnectionPool, self._stats),
+        }
+
+
+def configure_http_session(session, config, stats):
+    """按config给session挂载连接池
+
+    :param session: requests.Session
+    :param config: CosConfig
+    :param stats: PoolStats
+    :return:
+    """
+    socket_options = []
+    if config.get_tcp_nodelay():
+        socket_options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+    if config.get_tcp_keepalive():
+        socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+
+    adapter = CosHTTPAdapter(stats, socket_options,
+                             pool_connections=config.get_pool_connections(),
+                             pool_maxsize=config.get_pool_maxsize(),
+                             pool_block=config.get_pool_block())
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    if config.get_keep_alive():
+        session.headers.pop('Connection', None)
+    else:
+        session.headers['Connection'] = 'close'
+
+
+def new_http_session(config, stats):
+    """创建按config配置的requests.Session
+
+    :param config: CosConfig
+    :param stats: PoolStats
+    :return:
+    """
+    session = requests.session()
+    configure_http_session(session, config, stats)
+    return session
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import errno
+import json
+import hashlib
+from threading import Lock
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+class UploadJournal(object):
+    """UploadJournal 分片上传的断点记录
+
+    文件格式: 第一行是json头(session, 分片大小, 本地文件标识), 之后每行是一个服务端已确认的分片offset
+    """
+
+    def __init__(self, journal_dir, bucket, cos_path, local_path):
+        """
+
+        :param journal_dir: 断点记录的存放目录
+        :param bucket: bucket的名称
+        :param cos_path: cos的绝对路径(目的路径)
+        :param local_path: 上传的本地文件路径(源路径)
+        """
+        self._journal_dir = journal_dir
+        self._header = {
+            'bucket': bucket,
+            'cos_path': cos_path,
+            'local_path': os.path.abspath(local_path),
+        }
+        key = hashlib.sha1(json.dumps(self._header, sort_keys=True)).hexdigest()
+        self._path = os.path.join(journal_dir, key + '.journal')
+        self._lock = Lock()
+        self._file = None
+        self.session = None
+        self.slice_size = None
+        self.serial_upload = False
+        self.acked = set()
+
+    @staticmethod
+    def file_identity(local_path):
+        """获取本地文件的标识(大小, 修改时间, inode), 任何一项变化都不能续传
+
+        :param local_path:
+        :return:
+        """
+        st = os.stat(local_path)
+        return {'size': st.st_size, 'mtime': int(st.st_mtime), 'inode': st.st_ino}
+
+    def get_path(self):
+        return self._path
+
+    def load(self):
+        """读取已有的断点记录
+
+        :return: 可以续传时返回True, 记录不存在或者已失效返回False(失效的记录会被删除)
+        """
+        try:
+            with open(self._path, 'r') as f:
+                lines = f.read().split('\n')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning("read journal %s failed: %s" % (self._path, str(e)))
+            return False
+
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            logger.warning("broken journal %s, discard it" % self._path)
+            self.remove()
+            return False
+
+        identity = self.file_identity(self._header['local_path'])
+        for key, value in self._header.items():
+            if header.get(key) != value:
+                self.remove()
+                return False
+        if header.get('identity') != identity:
+            logger.info("local file changed since last upload, discard journal %s" % self._path)
+            self.remove()
+            return False
+
+        acked = set()
+        for line in lines[1:]:
+            # 进程在写入时退出, 最后一行可能不完整
+            if line.isdigit():
+                acked.add(int(line))
+
+        self.session = header['session']
+        self.slice_size = header['slice_size']
+        self.serial_upload = header.get('serial_upload', False)
+        self.acked = acked
+        return True
+
+    def start(self, session, slice_size, serial_upload=False):
+        """新建断点记录
+
+        :param session: upload_slice_init返回的session
+        :param slice_size: 服务端确认的分片大小
+        :param serial_upload: 服务端是否要求串行上传
+        :return:
+        """
+        try:
+            os.makedirs(self._journal_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        header = dict(self._header)
+        header['identity'] = self.file_identity(self._header['local_path'])
+        header['session'] = session
+        header['slice_size'] = slice_size
+        header['serial_upload'] = serial_upload
+
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(header) + '\n')
+        os.rename(tmp_path, self._path)
+
+        self.session = session
+        self.slice_size = slice_size
+        self.serial_upload = serial_upload
+        self.acked = set()
+
+    def ack(self, offset):
+        """记录一个已上传成功的分片
+
+        :param offset:
+        :return:
+        """
+        with self._lock:
+            if self._file is None:
+                self._file = open(self._path, 'a')
+            self._file.write('%d\n' % offset)
+            self._file.flush()
+            self.acked.add(offset)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        """上传完成或记录失效后删除"""
+        self.close()
+        self.session = None
+        try:
+            os.unlink(self._path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""请求的耗时和流量统计: 按操作类型汇总各阶段耗时的直方图、收发字节数和错误码, 可导出为json或prometheus文本格式"""
+
+import os
+import json
+import time
+import threading
+from threading import Lock
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# 一次请求的各个阶段
+SIGN = 'sign'  # 计算签名, 命中签名缓存时不计
+CONNECT = 'connect'  # 建立tcp连接, 复用连接时不计
+TTFB = 'ttfb'  # 发出请求(包括上传请求体)到收到响应头
+BODY = 'body'  # 接收响应体
+DECODE = 'decode'  # 解析json响应
+TOTAL = 'total'  # 从开始计时到结束的总时间
+PHASES = (SIGN, CONNECT, TTFB, BODY, DECODE, TOTAL)
+
+# 直方图各桶的上限(秒)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+FORMAT_JSON = 'json'
+FORMAT_PROMETHEUS = 'prometheus'
+
+# 签名、建连发生在发请求的函数里面, 先记在线程局部变量里, 由同一个线程随后的请求认领
+_local = threading.local()
+
+
+def add_pending(phase, seconds):
+    """ 记录当前线程里还没有归属到请求的耗时
+
+    :param phase:
+    :param seconds:
+    :return:
+    """
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        pending = _local.pending = {}
+    pending[phase] = pending.get(phase, 0.0) + seconds
+
+
+def take_pending():
+    """ 取出并清空当前线程里未归属的耗时
+
+    :return: {phase: seconds}
+    """
+    pending = getattr(_local, 'pending', None)
+    _local.pending = None
+    return pending or {}
+
+
+class Histogram(object):
+    """Histogram 固定桶的直方图, 分位数按桶内线性插值估算"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """ 估算分位数
+
+        :param p: 0到1之间
+        :return: 秒
+        """
+        if self.count == 0:
+            return 0.0
+        rank = p * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': list(self.counts),
+        }
+
+
+class RequestTimer(object):
+    """RequestTimer 一次请求的计时, 创建时认领当前线程里未归属的签名和建连耗时"""
+
+    def __init__(self, op):
+        self.op = op
+        self.phases = take_pending()
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.begin_at = self._last_at = time.time()
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def mark(self, phase):
+        """ 把上次mark(或开始计时)到现在的时间计入phase, 期间当前线程里记录的建连等耗时单独计入各自的阶段
+
+        :param phase:
+        :return:
+        """
+        now = time.time()
+        elapsed = now - self._last_at
+        self._last_at = now
+        for name, seconds in take_pending().items():
+            self.add(name, seconds)
+            elapsed -= seconds
+        self.add(phase, max(elapsed, 0.0))
+
+    def mark_failed(self, phases=(TTFB, BODY, DECODE)):
+        """ 请求出错时调用, 把上次mark到现在的时间计入还没完成的第一个阶段
+
+        :param phases: 请求依次经过的阶段
+        :return:
+        """
+        for phase in phases:
+            if phase not in self.phases:
+                self.mark(phase)
+                return
+
+
+class _OpStats(object):
+
+    def __init__(self):
+        self.count = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.errors = {}
+        self.http_errors = {}
+        self.phases = dict((phase, Histogram()) for phase in PHASES)
+
+
+class Metrics(object):
+    """Metrics 按操作类型汇总的请求统计, 线程安全"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._ops = {}
+        self._since = time.time()
+
+    def record(self, timer, code=0, http_status=None):
+        """ 记录一次结束的请求
+
+        :param timer: RequestTimer
+        :param code: cos返回的错误码, 0表示成功
+        :param http_status: http状态码, 没有收到响应时为None
+        :return:
+        """
+        total = time.time() - timer.begin_at
+        with self._lock:
+            stats = self._ops.get(timer.op)
+            if stats is None:
+                stats = self._ops[timer.op] = _OpStats()
+            stats.count += 1
+            stats.bytes_out += timer.bytes_out
+            stats.bytes_in += timer.bytes_in
+            if code:
+                stats.errors[code] = stats.errors.get(code, 0) + 1
+            if http_status is not None and http_status >= 400:
+                stats.http_errors[http_status] = stats.http_errors.get(http_status, 0) + 1
+            for phase, seconds in timer.phases.items():
+                if phase in stats.phases:
+                    stats.phases[phase].observe(seconds)
+            stats.phases[TOTAL].observe(total)
+
+    def reset(self):
+        with self._lock:
+            self._ops = {}
+            self._since = time.time()
+
+    def get_stats(self):
+        """ 各操作类型的统计
+
+        :return: {op: {'count', 'bytes_out', 'bytes_in', 'errors': {code: n}, 'http_errors': {status: n},
+                  'phases': {phase: Histogram.to_dict()}}}
+        """
+        with self._lock:
+            return dict((op, {
+                'count': stats.count,
+                'bytes_out': stats.bytes_out,
+                'bytes_in': stats.bytes_in,
+                'errors': dict(stats.errors),
+                'http_errors': dict(stats.http_errors),
+                'phases': dict((phase, hist.to_dict()) for phase, hist in stats.phases.items() if hist.count),
+            }) for op, stats in self._ops.items())
+
+    def to_json(self):
+        now = time.time()
+        return json.dumps({'time': now, 'since': self._since, 'buckets': BUCKETS, 'ops': self.get_stats()},
+                          sort_keys=True)
+
+    def to_prometheus(self, prefix='cos'):
+        """ prometheus文本格式
+
+        :param prefix: 指标名的前缀
+        :return:
+        """
+        stats = self.get_stats()
+        ops = sorted(stats)
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help_text))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+
+        header('requests_total', 'counter', 'Requests by operation.')
+        for op in ops:
+            lines.append('%s_requests_total{op="%s"} %d' % (prefix, op, stats[op]['count']))
+
+        header('request_errors_total', 'counter', 'Requests that returned a non-zero cos error code.')
+        for op in ops:
+            for code, n in sorted(stats[op]['errors'].items()):
+                lines.append('%s_request_errors_total{op="%s",code="%s"} %d' % (prefix, op, code, n))
+
+        header('http_errors_total', 'counter', 'Responses with http status >= 400.')
+        for op in ops:
+            for status, n in sorted(stats[op]['http_errors'].items()):
+                lines.append('%s_http_errors_total{op="%s",status="%s"} %d' % (prefix, op, status, n))
+
+        header('request_bytes_total', 'counter', 'Bytes sent and received in request and response bodies.')
+        for op in ops:
+            lines.append('%s_request_bytes_total{op="%s",direction="out"} %d' % (prefix, op, stats[op]['bytes_out']))
+            lines.append('%s_request_bytes_total{op="%s",direction="in"} %d' % (prefix, op, stats[op]['bytes_in']))
+
+        header('request_seconds', 'histogram', 'Time spent in each phase of a request.')
+        for op in ops:
+            for phase in PHASES:
+                hist = stats[op]['phases'].get(phase)
+                if hist is None:
+                    continue
+                labels = 'op="%s",phase="%s"' % (op, phase)
+                cumulative = 0
+                for le, n in zip([repr(b) for b in BUCKETS] + ['+Inf'], hist['buckets']):
+                    cumulative += n
+                    lines.append('%s_request_seconds_bucket{%s,le="%s"} %d' % (prefix, labels, le, cumulative))
+                lines.append('%s_request_seconds_sum{%s} %.6f' % (prefix, labels, hist['sum']))
+                lines.append('%s_request_seconds_count{%s} %d' % (prefix, labels, hist['count']))
+        return '\n'.join(lines) + '\n'
+
+    def format_stats(self):
+        """ 每个操作类型一行的摘要
+
+        :return: 没有请求时为''
+        """
+        stats = self.get_stats()
+        lines = []
+        for op in sorted(stats):
+            s = stats[op]
+            phases = s['phases']
+            parts = ['%s: %d reqs' % (op, s['count'])]
+            if s['errors']:
+                parts.append('errors %s' % ' '.join('%s*%d' % (code, n) for code, n in sorted(s['errors'].items())))
+            total = phases[TOTAL]
+            parts.append('total p50/p99/max %s/%s/%s' % (_ms(total['p50']), _ms(total['p99']), _ms(total['max'])))
+            for phase in (SIGN, CONNECT, TTFB, BODY, DECODE):
+                if phase in phases:
+                    parts.append('%s p50 %s (x%d)' % (phase, _ms(phases[phase]['p50']), phases[phase]['count']))
+            parts.append('out %s, in %s' % (_size(s['bytes_out']), _size(s['bytes_in'])))
+            lines.append(', '.join(parts))
+        return '\n'.join(lines)
+
+
+def _ms(seconds):
+    return '%.1fms' % (seconds * 1000)
+
+
+def _size(nbytes):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if nbytes < 1024:
+            return '%.1f%s' % (nbytes, unit)
+        nbytes /= 1024.0
+    return '%.1fTB' % nbytes
+
+
+class MetricsDumper(object):
+    """MetricsDumper 每隔interval秒把统计写到文件(先写临时文件再改名, 读者不会看到写了一半的内容)"""
+
+    def __init__(self, metrics, path, interval=10, fmt=FORMAT_JSON):
+        """ 初始化类
+
+        :param metrics: Metrics
+        :param path: 输出文件
+        :param interval: 间隔秒数
+        :param fmt: FORMAT_JSON或FORMAT_PROMETHEUS
+        """
+        if fmt not in (FORMAT_JSON, FORMAT_PROMETHEUS):
+            raise ValueError('unsupported metrics format: %s' % fmt)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.fmt = fmt
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='cos-metrics-dumper')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止并写最后一次"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.dump()
+
+    def dump(self):
+        if self.fmt == FORMAT_PROMETHEUS:
+            content = self.metrics.to_prometheus()
+        else:
+            content = self.metrics.to_json() + '\n'
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.rename(tmp_path, self.path)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.dump()
+            except (IOError, OSError) as e:
+                logger.warning("dump metrics to %s failed: %s" % (self.path, str(e)))
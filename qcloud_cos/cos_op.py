@@ -2,15 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import os
+import io
 import time
 import json
 import hashlib
+import Queue
 import urllib
 from contextlib import closing
 import cos_auth
 from cos_err import CosErr
 from cos_request import UploadFileRequest
 from cos_request import UploadSliceFileRequest
+from cos_request import UploadStreamRequest
 from cos_request import UpdateFileRequest
 from cos_request import DelFileRequest
 from cos_request import StatFileRequest
@@ -20,6 +23,14 @@ from cos_request import StatFolderRequest
 from cos_request import DelFolderRequest
 from cos_request import ListFolderRequest, DownloadFileRequest, MoveFileRequest
 from cos_common import Sha1Util
+from cos_common import SliceSizer
+from cos_common import MultipartFileStream
+from cos_common import encode_multipart
+from cos_common import read_full
+from cos_common import readinto_full
+from cos_journal import UploadJournal
+from cos_retry import classify_result, THROTTLED
+from cos_metrics import RequestTimer, TTFB, BODY, DECODE
 
 from logging import getLogger
 from traceback import format_exc
@@ -84,35 +95,79 @@ class BaseOp(object):
 
         return url_tmpl.format(bucket=bucket, appid=appid, hostname=hostname, cos_path=cos_path, sign=sign)
 
-    def send_request(self, method, bucket, cos_path, **kwargs):
+    def send_request(self, method, bucket, cos_path, op=None, **kwargs):
         """ 发送http请求
 
         :param method:
         :param bucket:
         :param cos_path:
+        :param op: 操作类型, 用于按操作统计耗时
         :param args:
         :return:
         """
         url = self._build_url(bucket, cos_path)
         logger.debug("sending request, method: %s, bucket: %s, cos_path: %s" % (method, bucket, cos_path))
 
+        rate_limiter = self._config.get_rate_limiter()
+        rate_limiter.acquire_request()
+        if rate_limiter.limits_upload():
+            kwargs = self._throttle_upload(rate_limiter, kwargs)
+
+        metrics = self._config.get_metrics()
+        timer = RequestTimer(op or method.lower())
         try:
+            # stream=True: 收到响应头就返回, 分开统计等待响应和接收响应体的时间
             if method == 'POST':
-                http_resp = self._http_session.post(url, verify=False, **kwargs)
+                http_resp = self._http_session.post(url, verify=False, stream=True, **kwargs)
             else:
-                http_resp = self._http_session.get(url, verify=False, **kwargs)
+                http_resp = self._http_session.get(url, verify=False, stream=True, **kwargs)
+            timer.mark(TTFB)
+            timer.bytes_out = int(http_resp.request.headers.get('Content-Length') or 0)
+            timer.bytes_in = len(http_resp.content)
+            timer.mark(BODY)
 
             status_code = http_resp.status_code
             if status_code < 500:
-                return http_resp.json()
+                ret = http_resp.json()
+                timer.mark(DECODE)
+                metrics.record(timer, ret.get(u'code'), status_code)
+                return ret
             else:
                 logger.warning("request failed, response message: %s" % http_resp.text)
                 err_detail = 'url:%s, status_code:%d' % (url, status_code)
-                return CosErr.get_err_msg(CosErr.NETWORK_ERROR, err_detail)
+                ret = CosErr.get_err_msg(CosErr.NETWORK_ERROR, err_detail)
+                # 供重试策略区分限流(429/503)
+                ret[u'http_status'] = status_code
+                metrics.record(timer, ret[u'code'], status_code)
+                return ret
         except Exception as e:
             logger.exception("request failed, return SERVER_ERROR")
             err_detail = 'url:%s, exception:%s traceback:%s' % (url, str(e), format_exc())
-            return CosErr.get_err_msg(CosErr.SERVER_ERROR, err_detail)
+            ret = CosErr.get_err_msg(CosErr.SERVER_ERROR, err_detail)
+            timer.mark_failed()
+            metrics.record(timer, ret[u'code'])
+            return ret
+
+    @staticmethod
+    def _throttle_upload(rate_limiter, kwargs):
+        """把请求体换成按上传限速读取的流
+
+        :param rate_limiter:
+        :param kwargs: send_request的参数
+        :return: 新的kwargs
+        """
+        kwargs = dict(kwargs)
+        if kwargs.get('files') is not None:
+            body, content_type = encode_multipart(kwargs.pop('files'))
+            kwargs['headers'] = dict(kwargs.get('headers') or {})
+            kwargs['headers']['Content-Type'] = content_type
+            kwargs['data'] = body
+        data = kwargs.get('data')
+        if isinstance(data, str) and data:
+            kwargs['data'] = rate_limiter.wrap_upload(io.BytesIO(data), len(data))
+        elif hasattr(data, 'read'):
+            kwargs['data'] = rate_limiter.wrap_upload(data, len(data))
+        return kwargs
 
     def _check_params(self, request):
         """检查用户输入参数, 检查通过返回None, 否则返回一个代表错误原因的dict
@@ -149,7 +204,7 @@ class BaseOp(object):
         http_body = {'op': 'delete'}
 
         timeout = self._config.get_timeout()
-        return self.send_request('POST', bucket, cos_path, headers=http_header, data=json.dumps(http_body), timeout=timeout)
+        return self.send_request('POST', bucket, cos_path, 'delete', headers=http_header, data=json.dumps(http_body), timeout=timeout)
 
     def stat_base(self, request):
         """获取文件和目录的属性
@@ -165,7 +220,7 @@ class BaseOp(object):
         bucket = request.get_bucket_name()
         cos_path = request.get_cos_path()
         expired = int(time.time()) + self._expired_period
-        sign = auth.sign_more(bucket, cos_path, expired)
+        sign = auth.sign_more(bucket, cos_path, expired, op='stat')
 
         http_header = dict()
         http_header['Authorization'] = sign
@@ -175,7 +230,7 @@ class BaseOp(object):
         http_body['op'] = 'stat'
 
         timeout = self._config.get_timeout()
-        return self.send_request('GET', bucket, cos_path, headers=http_header, params=http_body, timeout=timeout)
+        return self.send_request('GET', bucket, cos_path, 'stat', headers=http_header, params=http_body, timeout=timeout)
 
 
 class FileOp(BaseOp):
@@ -191,6 +246,10 @@ class FileOp(BaseOp):
         BaseOp.__init__(self, cred, config, http_session)
         # 单文件上传的最大上限是20MB
         self.max_single_file = 20 * 1024 * 1024
+        # 小于8MB的文件适合单文件上传, 否则分片上传
+        self.suit_single_file_size = 8 * 1024 * 1024
+        # 同一个client上传的文件共享对网络状况的估计
+        self._slice_sizer = SliceSizer()
 
     @staticmethod
     def _sha1_content(content):
@@ -239,7 +298,7 @@ class FileOp(BaseOp):
             http_body['custom_headers'] = request.get_custom_headers()
         logger.debug("Update Request Header: " + json.dumps(http_body))
         timeout = self._config.get_timeout()
-        return self.send_request('POST', bucket, cos_path, headers=http_header, data=json.dumps(http_body), timeout=timeout)
+        return self.send_request('POST', bucket, cos_path, 'update', headers=http_header, data=json.dumps(http_body), timeout=timeout)
 
     def del_file(self, request):
         """删除文件
@@ -273,14 +332,15 @@ class FileOp(BaseOp):
         local_path = request.get_local_path()
         file_size = os.path.getsize(local_path)
 
-        suit_single_file_zie = 8 * 1024 * 1024
-        if file_size < suit_single_file_zie:
+        if file_size < self.suit_single_file_size:
             return self.upload_single_file(request)
         else:
             bucket = request.get_bucket_name()
             cos_path = request.get_cos_path()
             local_path = request.get_local_path()
             slice_size = 1024 * 1024
+            if self._config.get_adaptive_slice_size():
+                slice_size = self._slice_sizer.choose(file_size)
             biz_attr = request.get_biz_attr()
             upload_slice_request = UploadSliceFileRequest(bucket, cos_path, local_path, slice_size, biz_attr)
             upload_slice_request.set_insert_only(request.get_insert_only())
@@ -304,42 +364,177 @@ class FileOp(BaseOp):
         if file_size > self.max_single_file:
             return CosErr.get_err_msg(CosErr.NETWORK_ERROR, 'file is too big, please use upload_file interface')
 
+        ret = self._post_single_file(request)
+
+        if request.get_insert_only() != 0:
+            return ret
+
+        if ret[u'code'] == 0:
+            return ret
+
+        # try to delete object, and re-post request
+        del_request = DelFileRequest(bucket_name=request.get_bucket_name(), cos_path=request.get_cos_path())
+        ret = self.del_file(del_request)
+        if ret[u'code'] == 0:
+            return self._post_single_file(request)
+        else:
+            return ret
+
+    def _post_single_file(self, request):
+        """ 发送单文件上传请求, 返回send_request的结果
+
+        :param request:
+        :return:
+        """
+        local_path = request.get_local_path()
         auth = cos_auth.Auth(self._cred)
         bucket = request.get_bucket_name()
         cos_path = request.get_cos_path()
         expired = int(time.time()) + self._expired_period
-        sign = auth.sign_more(bucket, cos_path, expired)
+        sign = auth.sign_more(bucket, cos_path, expired, op='upload')
 
         http_header = dict()
         http_header['Authorization'] = sign
         http_header['User-Agent'] = self._config.get_user_agent()
 
-        with open(local_path, 'rb') as f:
-            file_content = f.read()
+        # 先分块计算sha1, 再从文件流式发送请求体, 不把整个文件读进内存
+        http_body = [
+            ('op', 'upload'),
+            ('sha', Sha1Util.get_sha1_by_file(local_path)),
+            ('biz_attr', request.get_biz_attr()),
+            ('insertOnly', str(request.get_insert_only())),
+        ]
+        body = MultipartFileStream(http_body, 'filecontent', local_path)
+        http_header['Content-Type'] = body.content_type
+
+        timeout = self._config.get_timeout()
+        return self.send_request('POST', bucket, cos_path, 'upload', headers=http_header, data=body, timeout=timeout)
+
+    def upload_stream(self, request):
+        """ 从流上传文件, 不需要本地文件. 小于8MB的文件读进内存后单文件上传,
+        否则边读边分片上传, 内存中最多有max_con + 1个分片; stream.read抛出的异常直接抛出.
+        分片上传的upload_slice_init需要文件大小, 大小未知(file_size为None)时只能读进内存单文件上传, 最大20MB.
+        流只能读一遍, 调用者没法整体重试, 所以每个请求都按config的重试策略单独重试
+
+        :param request:
+        :return:
+        """
+        assert isinstance(request, UploadStreamRequest)
+        check_params_ret = self._check_params(request)
+        if check_params_ret is not None:
+            return check_params_ret
+
+        file_size = request.get_file_size()
+        if file_size is None:
+            content = read_full(request.get_stream(), self.max_single_file + 1)
+            if len(content) > self.max_single_file:
+                return CosErr.get_err_msg(CosErr.PARAMS_ERROR, 'stream is larger than %d bytes, file_size is required for slice upload' % self.max_single_file)
+        elif file_size >= self.suit_single_file_size:
+            if self._config.get_adaptive_slice_size():
+                request.set_slice_size(self._slice_sizer.choose(file_size))
+            return self._upload_slice_stream(request)
+        else:
+            content = read_full(request.get_stream(), file_size)
+            if len(content) != file_size:
+                return CosErr.get_err_msg(CosErr.PARAMS_ERROR, 'stream ended at %d bytes, expect %d' % (len(content), file_size))
+
+        retry_policy = self._config.get_retry_policy()
+        ret = retry_policy.call_result(self._post_single_content, (request, content))
+        if request.get_insert_only() != 0 or ret[u'code'] == 0:
+            return ret
+
+        # 和upload_single_file一样, 覆盖失败时删除后重新上传
+        del_request = DelFileRequest(bucket_name=request.get_bucket_name(), cos_path=request.get_cos_path())
+        ret = self.del_file(del_request)
+        if ret[u'code'] == 0:
+            return retry_policy.call_result(self._post_single_content, (request, content))
+        return ret
+
+    def _post_single_content(self, request, content):
+        """ 把内存中的content作为单文件上传
+
+        :param request:
+        :param content:
+        :return:
+        """
+        auth = cos_auth.Auth(self._cred)
+        bucket = request.get_bucket_name()
+        cos_path = request.get_cos_path()
+        expired = int(time.time()) + self._expired_period
+        sign = auth.sign_more(bucket, cos_path, expired, op='upload')
+
+        http_header = dict()
+        http_header['Authorization'] = sign
+        http_header['User-Agent'] = self._config.get_user_agent()
 
         http_body = dict()
         http_body['op'] = 'upload'
-        http_body['filecontent'] = file_content
-        http_body['sha'] = FileOp._sha1_content(file_content)
+        http_body['filecontent'] = content
+        http_body['sha'] = self._sha1_content(content)
         http_body['biz_attr'] = request.get_biz_attr()
         http_body['insertOnly'] = str(request.get_insert_only())
 
         timeout = self._config.get_timeout()
-        ret = self.send_request('POST', bucket, cos_path, headers=http_header, files=http_body, timeout=timeout)
+        return self.send_request('POST', bucket, cos_path, 'upload', headers=http_header, files=http_body, timeout=timeout)
 
-        if request.get_insert_only() != 0:
-            return ret
+    def _upload_slice_stream(self, request):
+        """ 分片上传流中的数据: max_con + 1个分片大小的缓冲区轮流使用, 主线程把流读进空闲的缓冲区后交给线程池上传,
+        上传完成后缓冲区还回去; 缓冲区都在使用时读取阻塞, 内存占用不随文件大小增长
 
-        if ret[u'code'] == 0:
-            return ret
+        :param request:
+        :return:
+        """
+        file_size = request.get_file_size()
+        retry_policy = self._config.get_retry_policy()
+        control_ret = retry_policy.call_result(self._upload_slice_control, (request, file_size))
+        if control_ret[u'code'] != 0:
+            return control_ret
 
-        # try to delete object, and re-post request
-        del_request = DelFileRequest(bucket_name=request.get_bucket_name(), cos_path=request.get_cos_path())
-        ret = self.del_file(del_request)
-        if ret[u'code'] == 0:
-            return self.send_request('POST', bucket, cos_path, headers=http_header, files=http_body, timeout=timeout)
-        else:
-            return ret
+        slice_size = control_ret[u'data'][u'slice_size']
+        session = control_ret[u'data'][u'session']
+        serial_upload = u'serial_upload' in control_ret[u'data'] and control_ret[u'data'][u'serial_upload'] == 1
+        # 只有一个worker时按offset顺序上传, 读下一个分片和上传上一个分片仍然是并行的
+        max_con = 1 if serial_upload else max(request.get_max_con(), 1)
+
+        from threadpool import SimpleThreadPool
+        pool = SimpleThreadPool(max_con)
+        failed = []
+        ring = Queue.Queue()
+        for i in range(min(max_con + 1, (file_size + slice_size - 1) // slice_size)):
+            ring.put(bytearray(slice_size))
+
+        def upload(buf, length, offset):
+            try:
+                if not failed:
+                    ret = self._upload_slice_data(request, memoryview(buf)[:length], session, offset)
+                    if ret[u'code'] != 0:
+                        failed.append(ret)
+            finally:
+                ring.put(buf)
+
+        stream = request.get_stream()
+        offset = 0
+        try:
+            while offset < file_size and not failed:
+                length = min(slice_size, file_size - offset)
+                buf = ring.get()
+                got = readinto_full(stream, memoryview(buf)[:length])
+                if got != length:
+                    failed.append(CosErr.get_err_msg(CosErr.PARAMS_ERROR, 'stream ended at %d bytes, expect %d' %
+                                                     (offset + got, file_size)))
+                    break
+                pool.add_task(upload, buf, length, offset)
+                offset += length
+        finally:
+            # 读流出错时也要等已经提交的分片结束
+            pool.wait_completion()
+
+        if failed:
+            return failed[0]
+        result = pool.get_result()
+        if not result['success_all']:
+            return {u'code': 1, u'message': str(result)}
+        return retry_policy.call_result(self._upload_slice_finish, (request, session, file_size))
 
     def _upload_slice_file(self, request):
         assert isinstance(request, UploadSliceFileRequest)
@@ -359,64 +554,149 @@ class FileOp(BaseOp):
             request.sha1_list = None
             request.sha1_content = None
 
+        journal = self._open_journal(request)
+        if journal is not None and journal.load():
+            logger.info("resume upload from %s, %d slices acked" % (journal.get_path(), len(journal.acked)))
+            ret = self._upload_slices(request, journal.session, journal.slice_size, journal.serial_upload, journal)
+            # 网络错误和限流时保留断点, 下次继续
+            if ret[u'code'] == 0 or not self._session_rejected(ret):
+                return ret
+            # session被拒绝了, 重新init: 成功时新的session覆盖断点, init也被拒绝时才删除断点
+            logger.warning("resume failed, upload from scratch: %s" % ret[u'message'])
+
         control_ret = self._upload_slice_control(request)
 
         # 表示控制分片已经产生错误信息
         if control_ret[u'code'] != 0:
+            if journal is not None and self._session_rejected(control_ret):
+                journal.remove()
             return control_ret
 
         # 命中秒传
         if u'access_url' in control_ret[u'data']:
+            if journal is not None:
+                journal.remove()
             return control_ret
 
-        local_path = request.get_local_path()
-        file_size = os.path.getsize(local_path)
         slice_size = control_ret[u'data'][u'slice_size']
-        offset = 0
         session = control_ret[u'data'][u'session']
+        serial_upload = u'serial_upload' in control_ret[u'data'] and control_ret[u'data'][u'serial_upload'] == 1
+        if journal is not None:
+            journal.start(session, slice_size, serial_upload)
+
+        return self._upload_slices(request, session, slice_size, serial_upload, journal)
+
+    def _open_journal(self, request):
+        """根据config里的journal_dir打开断点记录, 未配置时返回None
+
+        :param request:
+        :return:
+        """
+        journal_dir = self._config.get_journal_dir()
+        if journal_dir is None:
+            return None
+        return UploadJournal(journal_dir, request.get_bucket_name(), request.get_cos_path(), request.get_local_path())
+
+    def _upload_slices(self, request, session, slice_size, serial_upload, journal=None):
+        """上传journal中尚未确认的数据分片, 然后结束分片上传
+
+        :param request:
+        :param session:
+        :param slice_size:
+        :param serial_upload: 是否串行上传
+        :param journal: 断点记录, 可以为None
+        :return:
+        """
+        local_path = request.get_local_path()
+        file_size = os.path.getsize(local_path)
+        acked = journal.acked if journal is not None else set()
         # ?concurrency
-        if request._max_con <= 1 or (
-                u'serial_upload' in control_ret[u'data'] and control_ret[u'data'][u'serial_upload'] == 1):
+        if request._max_con <= 1 or serial_upload:
 
             logger.info("upload file serially")
-            slice_idx = 0
             with open(local_path, 'rb') as local_file:
 
-                while offset < file_size:
+                for offset in xrange(0, file_size, slice_size):
+                    if offset in acked:
+                        continue
+
+                    local_file.seek(offset)
                     file_content = local_file.read(slice_size)
 
-                    data_ret = self._upload_slice_data(request, file_content, session, offset)
+                    data_ret = self._upload_slice_part(request, file_content, session, offset, journal)
 
                     if data_ret[u'code'] == 0:
                         if u'access_url' in data_ret[u'data']:
+                            if journal is not None:
+                                journal.remove()
                             return data_ret
                     else:
+                        if journal is not None:
+                            journal.close()
                         return data_ret
-
-                    offset += slice_size
-                    slice_idx += 1
         else:
             logger.info('upload file concurrently')
             from threadpool import SimpleThreadPool
-            pool = SimpleThreadPool(request._max_con)
-
-            slice_idx = 0
-            with open(local_path, 'rb') as local_file:
-
-                while offset < file_size:
-                    file_content = local_file.read(slice_size)
+            # 队列里只放offset, 由worker自己读取分片, 内存占用不超过 并发数 x slice_size
+            pool = SimpleThreadPool(request._max_con, max_queue_size=request._max_con)
 
-                    pool.add_task(self._upload_slice_data, request, file_content, session, offset)
+            for offset in xrange(0, file_size, slice_size):
+                if offset in acked:
+                    continue
 
-                    offset += slice_size
-                    slice_idx += 1
+                length = min(slice_size, file_size - offset)
+                pool.add_task(self._upload_slice_range, request, session, offset, length, journal)
 
             pool.wait_completion()
             result = pool.get_result()
-            if not result['success_all']:
-                return {u'code': 1, u'message': str(result)}
+            # _upload_slice_data返回错误码而不抛异常, 需要逐个检查; 返回第一个失败分片的错误码, 调用者据此判断能否续传
+            failed = [ret for _, _, rets in result['detail'] for ret in rets
+                      if isinstance(ret, Exception) or ret[u'code'] != 0]
+            if not result['success_all'] or failed:
+                if journal is not None:
+                    journal.close()
+                if failed and not isinstance(failed[0], Exception):
+                    return failed[0]
+                return CosErr.get_err_msg(CosErr.SERVER_ERROR, str(failed[0] if failed else result))
 
         data_ret = self._upload_slice_finish(request, session, file_size)
+        if journal is not None:
+            # finish拒绝了session时断点不能再用, 网络错误和限流时保留
+            if data_ret[u'code'] == 0 or self._session_rejected(data_ret):
+                journal.remove()
+            else:
+                journal.close()
+        return data_ret
+
+    @staticmethod
+    def _session_rejected(ret):
+        """判断错误是否说明服务端拒绝了session(而不是网络错误或限流)
+
+        :param ret:
+        :return:
+        """
+        if ret[u'code'] in (0, CosErr.NETWORK_ERROR, CosErr.SERVER_ERROR):
+            return False
+        return classify_result(ret) != THROTTLED
+
+    def _upload_slice_range(self, request, session, offset, length, journal=None):
+        """读取本地文件的[offset, offset + length)并上传, 供并发上传的worker调用
+
+        :return:
+        """
+        with open(request.get_local_path(), 'rb') as local_file:
+            local_file.seek(offset)
+            file_content = local_file.read(length)
+        return self._upload_slice_part(request, file_content, session, offset, journal)
+
+    def _upload_slice_part(self, request, file_content, session, offset, journal=None):
+        """上传一个数据分片, 成功后记录到journal
+
+        :return:
+        """
+        data_ret = self._upload_slice_data(request, file_content, session, offset)
+        if data_ret[u'code'] == 0 and journal is not None:
+            journal.ack(offset)
         return data_ret
 
     def upload_slice_file(self, request):
@@ -445,7 +725,7 @@ class FileOp(BaseOp):
         bucket = request.get_bucket_name()
         cos_path = request.get_cos_path()
         expired = int(time.time()) + self._expired_period
-        sign = auth.sign_more(bucket, cos_path, expired)
+        sign = auth.sign_more(bucket, cos_path, expired, op='upload_slice_finish')
 
         http_header = dict()
         http_header['Authorization'] = sign
@@ -459,26 +739,27 @@ class FileOp(BaseOp):
             http_body['sha'] = request.sha1_list[-1]["datasha"]
         timeout = self._config.get_timeout()
 
-        return self.send_request('POST', bucket, cos_path, headers=http_header, files=http_body, timeout=timeout)
+        return self.send_request('POST', bucket, cos_path, 'upload_slice_finish', headers=http_header, files=http_body, timeout=timeout)
 
-    def _upload_slice_control(self, request):
+    def _upload_slice_control(self, request, file_size=None):
         """串行分片第一步, 上传控制分片
 
         :param request:
+        :param file_size: 文件大小, 默认为本地文件的大小
         :return:
         """
         auth = cos_auth.Auth(self._cred)
         bucket = request.get_bucket_name()
         cos_path = request.get_cos_path()
         expired = int(time.time()) + self._expired_period
-        sign = auth.sign_more(bucket, cos_path, expired)
+        sign = auth.sign_more(bucket, cos_path, expired, op='upload_slice_init')
 
         http_header = dict()
         http_header['Authorization'] = sign
         http_header['User-Agent'] = self._config.get_user_agent()
 
-        local_path = request.get_local_path()
-        file_size = os.path.getsize(local_path)
+        if file_size is None:
+            file_size = os.path.getsize(request.get_local_path())
         slice_size = request.get_slice_size()
         biz_atrr = request.get_biz_attr()
 
@@ -493,7 +774,11 @@ class FileOp(BaseOp):
         http_body['insertOnly'] = str(request.get_insert_only())
 
         timeout = self._config.get_timeout()
-        return self.send_request('POST', bucket, cos_path, headers=http_header, files=http_body, timeout=timeout)
+        begin_at = time.time()
+        ret = self.send_request('POST', bucket, cos_path, 'upload_slice_init', headers=http_header, files=http_body, timeout=timeout)
+        if ret[u'code'] == 0:
+            self._slice_sizer.record_rtt(time.time() - begin_at)
+        return ret
 
     def _upload_slice_data(self, request, file_content, session, offset, retry=3):
         """串行分片第二步, 上传数据分片
@@ -502,13 +787,14 @@ class FileOp(BaseOp):
         :param file_content:
         :param session:
         :param offset:
+        :param retry: 最多尝试的次数, 两次之间按config的重试策略退避
         :return:
         """
         bucket = request.get_bucket_name()
         cos_path = request.get_cos_path()
         auth = cos_auth.Auth(self._cred)
         expired = int(time.time()) + self._expired_period
-        sign = auth.sign_more(bucket, cos_path, expired)
+        sign = auth.sign_more(bucket, cos_path, expired, op='upload_slice_data')
 
         http_header = dict()
         http_header['Authorization'] = sign
@@ -524,41 +810,58 @@ class FileOp(BaseOp):
 
         timeout = self._config.get_timeout()
 
-        for _ in range(retry):
-            ret = self.send_request('POST', bucket, cos_path, headers=http_header, files=http_body, timeout=timeout)
+        def send():
+            begin_at = time.time()
+            ret = self.send_request('POST', bucket, cos_path, 'upload_slice_data', headers=http_header, files=http_body, timeout=timeout)
             if ret['code'] == 0:
-                return ret
-        else:
+                self._slice_sizer.record_transfer(len(file_content), time.time() - begin_at)
             return ret
 
+        # 按错误类型退避重试, 不可重试的错误直接返回
+        return self._config.get_retry_policy().call_result(send, max_attempts=retry)
+
     def __download_url(self, uri, filename, headers):
         session = self._http_session
+        timer = RequestTimer('download')
+        code, status_code = CosErr.SERVER_ERROR, None
 
-        with closing(session.get(uri, stream=True, timeout=30, headers=headers)) as ret:
-            if ret.status_code in [200, 206]:
+        try:
+            with closing(session.get(uri, stream=True, timeout=30, headers=headers)) as ret:
+                timer.mark(TTFB)
+                status_code = ret.status_code
+                if ret.status_code in [200, 206]:
 
-                if 'Content-Length' in ret.headers:
-                    content_len = int(ret.headers['Content-Length'])
+                    if 'Content-Length' in ret.headers:
+                        content_len = int(ret.headers['Content-Length'])
+                    else:
+                        raise IOError("download failed without Content-Length header")
+
+                    rate_limiter = self._config.get_rate_limiter()
+                    with open(filename, 'wb') as f:
+                        for chunk in rate_limiter.iter_download(ret.iter_content(chunk_size=1024)):
+                            if chunk:
+                                timer.bytes_in += len(chunk)
+                                f.write(chunk)
+                        f.flush()
+                    timer.mark(BODY)
+                    if timer.bytes_in != content_len:
+                        raise IOError("download failed with incomplete file")
+                    code = 0
                 else:
-                    raise IOError("download failed without Content-Length header")
-
-                file_len = 0
-                with open(filename, 'wb') as f:
-                    for chunk in ret.iter_content(chunk_size=1024):
-                        if chunk:
-                            file_len += len(chunk)
-                            f.write(chunk)
-                    f.flush()
-                if file_len != content_len:
-                    raise IOError("download failed with incomplete file")
-            else:
-                raise IOError("download failed with status code:" + str(ret.status_code))
+                    raise IOError("download failed with status code:" + str(ret.status_code))
+        finally:
+            if code != 0:
+                timer.mark_failed((TTFB, BODY))
+                if status_code is not None:
+                    code = CosErr.NETWORK_ERROR
+            self._config.get_metrics().record(timer, code, status_code)
 
     def download_file(self, request):
         assert isinstance(request, DownloadFileRequest)
 
         auth = cos_auth.Auth(self._cred)
-        sign = auth.sign_download(request.get_bucket_name(), request.get_cos_path(), self._config.get_sign_expired())
+        expired = int(time.time()) + self._config.get_sign_expired()
+        sign = auth.sign_download(request.get_bucket_name(), request.get_cos_path(), expired)
         url = self.build_download_url(request.get_bucket_name(), request.get_cos_path(), sign)
         logger.info("Uri is %s" % url)
         try:
@@ -584,7 +887,7 @@ class FileOp(BaseOp):
         http_body['to_over_write'] = str(1 if request.overwrite else 0)
 
         timeout = self._config.get_timeout()
-        return self.send_request('POST', bucket, cos_path, headers=http_header, params=http_body, timeout=timeout)
+        return self.send_request('POST', bucket, cos_path, 'move', headers=http_header, params=http_body, timeout=timeout)
 
     def move_file(self, request):
 
@@ -623,7 +926,7 @@ class FolderOp(BaseOp):
         http_body['biz_attr'] = request.get_biz_attr()
 
         timeout = self._config.get_timeout()
-        return self.send_request('POST', bucket, cos_path, headers=http_header, data=json.dumps(http_body), timeout=timeout)
+        return self.send_request('POST', bucket, cos_path, 'update', headers=http_header, data=json.dumps(http_body), timeout=timeout)
 
     def del_folder(self, request):
         """删除目录
@@ -658,7 +961,7 @@ class FolderOp(BaseOp):
         bucket = request.get_bucket_name()
         cos_path = request.get_cos_path()
         expired = int(time.time()) + self._expired_period
-        sign = auth.sign_more(bucket, cos_path, expired)
+        sign = auth.sign_more(bucket, cos_path, expired, op='create')
 
         http_header = dict()
         http_header['Authorization'] = sign
@@ -670,7 +973,7 @@ class FolderOp(BaseOp):
         http_body['biz_attr'] = request.get_biz_attr()
 
         timeout = self._config.get_timeout()
-        return self.send_request('POST', bucket, cos_path, headers=http_header, data=json.dumps(http_body), timeout=timeout)
+        return self.send_request('POST', bucket, cos_path, 'create', headers=http_header, data=json.dumps(http_body), timeout=timeout)
 
     def list_folder(self, request):
         """list目录
@@ -693,11 +996,11 @@ class FolderOp(BaseOp):
         bucket = request.get_bucket_name()
         list_path = request.get_cos_path() + request.get_prefix()
         expired = int(time.time()) + self._expired_period
-        sign = auth.sign_more(bucket, list_path, expired)
+        sign = auth.sign_more(bucket, list_path, expired, op='list')
 
         http_header = dict()
         http_header['Authorization'] = sign
         http_header['User-Agent'] = self._config.get_user_agent()
 
         timeout = self._config.get_timeout()
-        return self.send_request('GET', bucket, list_path, headers=http_header, params=http_body, timeout=timeout)
+        return self.send_request('GET', bucket, list_path, 'list', headers=http_header, params=http_body, timeout=timeout)
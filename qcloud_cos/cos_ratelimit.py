@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+from threading import Lock
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+REQUESTS = 'requests_per_second'
+UPLOAD = 'upload_rate'
+DOWNLOAD = 'download_rate'
+LIMIT_KEYS = (REQUESTS, UPLOAD, DOWNLOAD)
+
+_UNITS = {'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+
+
+def parse_rate(value):
+    """ 解析限速值, 支持K/M/G后缀(1024进制), 如'512K', '10M', 0表示不限制
+
+    :param value: 数字或字符串
+    :return: float
+    """
+    if isinstance(value, (int, long, float)):
+        return float(value)
+    value = value.strip().upper()
+    if value.endswith('B'):
+        value = value[:-1]
+    if value and value[-1] in _UNITS:
+        return float(value[:-1]) * _UNITS[value[-1]]
+    return float(value)
+
+
+def _format_rate(key, rate):
+    if rate <= 0:
+        return 'unlimited'
+    if key == REQUESTS:
+        return '%g/s' % rate
+    return '%.1fMB/s' % (rate / 1024 / 1024)
+
+
+class TokenBucket(object):
+    """TokenBucket 令牌桶, rate为每秒的令牌数, 不大于0时不限制
+
+    取令牌时可以透支, 调用者等到欠的令牌补上为止, 并发的调用者按先后顺序分摊等待时间
+    """
+
+    def __init__(self, rate=0, burst=None):
+        self._lock = Lock()
+        self._tokens = 0.0
+        self._updated_at = time.time()
+        self.rate = 0
+        self.burst = 1
+        self.waited = 0.0
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        """ 修改速率, burst为最多积攒的令牌数, 默认为一秒的量
+
+        :param rate:
+        :param burst:
+        :return:
+        """
+        with self._lock:
+            self._refill(time.time())
+            self.rate = rate
+            self.burst = burst or max(rate, 1)
+            # 换了速率后不再追究按旧速率欠下的令牌
+            self._tokens = max(0.0, min(self._tokens, self.burst))
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def consume(self, n):
+        """ 取n个令牌, 不够时等待
+
+        :param n:
+        :return: 等待的秒数
+        """
+        with self._lock:
+            if self.rate <= 0:
+                return 0
+            self._refill(time.time())
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class ThrottledReader(object):
+    """ThrottledReader 按令牌桶速率读取的请求体, 可以作为requests的data参数"""
+
+    def __init__(self, source, length, bucket):
+        """ 初始化类
+
+        :param source: 有read/seek/tell的文件对象
+        :param length: source的总长度
+        :param bucket: TokenBucket
+        """
+        self._source = source
+        self._length = length
+        self._bucket = bucket
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        data = self._source.read(size)
+        if data:
+            self._bucket.consume(len(data))
+        return data
+
+    def seek(self, offset, whence=0):
+        self._source.seek(offset, whence)
+
+    def tell(self):
+        return self._source.tell()
+
+
+class RateLimiter(object):
+    """RateLimiter 请求数、上传带宽、下载带宽的限速, 0表示不限制
+
+    设置了control_file时, 文件中的设置覆盖set_limits的值; 文件修改后最多CHECK_INTERVAL秒生效,
+    删除文件后恢复set_limits的值, 不需要重启进程. 文件格式为每行一个'key = value', 如:
+        requests_per_second = 50
+        upload_rate = 10M
+        download_rate = 0
+    """
+
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, requests_per_second=0, upload_rate=0, download_rate=0, control_file=None):
+        self._lock = Lock()
+        self._buckets = dict((key, TokenBucket()) for key in LIMIT_KEYS)
+        self._base = {}
+        self._overrides = {}
+        self._control_file = None
+        self._control_mtime = None
+        self._checked_at = 0
+        self.set_limits(requests_per_second, upload_rate, download_rate)
+        self.set_control_file(control_file)
+
+    def set_limits(self, requests_per_second=None, upload_rate=None, download_rate=None):
+        """ 修改限速, None表示不变
+
+        :param requests_per_second: 每秒请求数
+        :param upload_rate: 上传字节/秒, 可以是'10M'这样的字符串
+        :param download_rate: 下载字节/秒
+        :return:
+        """
+        with self._lock:
+            for key, value in zip(LIMIT_KEYS, (requests_per_second, upload_rate, download_rate)):
+                if value is not None:
+                    self._base[key] = parse_rate(value)
+            self._apply()
+
+    def set_control_file(self, control_file):
+        """ 设置运行时调整限速的控制文件, None表示不使用
+
+        :param control_file:
+        :return:
+        """
+        with self._lock:
+            self._control_file = control_file
+            self._control_mtime = None
+            self._checked_at = 0
+            self._overrides = {}
+            self._apply()
+        self._check_control_file()
+
+    def get_limits(self):
+        with self._lock:
+            return dict((key, bucket.rate) for key, bucket in self._buckets.items())
+
+    def is_active(self):
+        """是否设置了任何限速或控制文件"""
+        return self._control_file is not None or any(rate > 0 for rate in self.get_limits().values())
+
+    def _apply(self):
+        # 调用时需持有self._lock
+        for key in LIMIT_KEYS:
+            rate = self._overrides.get(key, self._base.get(key, 0))
+            if rate != self._buckets[key].rate:
+                self._buckets[key].set_rate(rate)
+
+    def _check_control_file(self):
+        if self._control_file is None:
+            return
+        now = time.time()
+        with self._lock:
+            if now - self._checked_at < self.CHECK_INTERVAL:
+                return
+            self._checked_at = now
+            control_file = self._control_file
+
+        try:
+            mtime = os.stat(control_file).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._control_mtime:
+            return
+
+        overrides = self._read_control_file(control_file) if mtime is not None else {}
+        with self._lock:
+            self._control_mtime = mtime
+            self._overrides = overrides
+            self._apply()
+        logger.info("rate limits changed by %s: %s" % (control_file, self.format_stats()))
+
+    @staticmethod
+    def _read_control_file(control_file):
+        overrides = {}
+        try:
+            with open(control_file) as f:
+                lines = f.readlines()
+        except IOError:
+            return overrides
+        for line in lines:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            key, _, value = line.partition('=')
+            key = key.strip()
+            try:
+                if key not in LIMIT_KEYS:
+                    raise ValueError('unknown key')
+                overrides[key] = parse_rate(value)
+            except ValueError as e:
+                logger.warning("invalid line in %s: %s (%s)" % (control_file, line, str(e)))
+        return overrides
+
+    def acquire_request(self):
+        """发送一个请求前调用"""
+        self._check_control_file()
+        self._buckets[REQUESTS].consume(1)
+
+    def limits_upload(self):
+        self._check_control_file()
+        return self._buckets[UPLOAD].rate > 0
+
+    def wrap_upload(self, source, length):
+        """ 把请求体包装成按上传限速读取的流
+
+        :param source: 有read/seek/tell的文件对象
+        :param length: 总长度
+        :return: ThrottledReader
+        """
+        return ThrottledReader(source, length, self._buckets[UPLOAD])
+
+    def throttle_download(self, nbytes):
+        """收到nbytes字节下载数据后调用"""
+        self._check_control_file()
+        self._buckets[DOWNLOAD].consume(nbytes)
+
+    def iter_download(self, chunks):
+        """ 按下载限速迭代chunks(如iter_content的返回值)
+
+        :param chunks:
+        :return:
+        """
+        for chunk in chunks:
+            if chunk:
+                self.throttle_download(len(chunk))
+            yield chunk
+
+    def get_stats(self):
+        """ 每种限速的当前值和累计等待的秒数
+
+        :return: {key: {'rate', 'waited'}}
+        """
+        with self._lock:
+            return dict((key, {'rate': bucket.rate, 'waited': bucket.waited}) for key, bucket in self._buckets.items())
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return ', '.join('%s: %s (waited %.3fs)' % (name, _format_rate(key, stats[key]['rate']), stats[key]['waited'])
+                         for name, key in [('requests', REQUESTS), ('upload', UPLOAD), ('download', DOWNLOAD)])
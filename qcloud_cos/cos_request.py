@@ -254,6 +254,124 @@ class UploadSliceFileRequest(UploadFileRequest):
         return self._param_check.check_slice_size(self._slice_size)
 
 
+class UploadStreamRequest(BaseRequest):
+    """
+    UploadStreamRequest  从流上传文件的请求, 数据来自有read方法的对象(如另一个文件的下载流), 不需要本地文件
+    """
+
+    def __init__(self, bucket_name, cos_path, stream, file_size, biz_attr=u'', insert_only=1, max_con=1):
+        """
+
+        :param bucket_name: bucket的名称
+        :param cos_path: cos的绝对路径(目的路径), 从bucket根/开始
+        :param stream: 有read方法的对象, 按顺序读出文件内容
+        :param file_size: 文件大小(字节), 流中的数据必须正好这么多; None表示未知, 只能单文件上传(不超过20MB)
+        :param biz_attr: 文件的属性
+        :param insert_only: 是否覆盖写, 0覆盖, 1不覆盖,返回错误
+        :param max_con: 分片上传的并发数
+        """
+        super(UploadStreamRequest, self).__init__(bucket_name, cos_path)
+        self._stream = stream
+        self._file_size = file_size
+        self._biz_attr = biz_attr
+        self._insert_only = insert_only
+        self._max_con = max_con
+        self._slice_size = 1024 * 1024
+        # 流只能读一遍, 不做sha1校验
+        self.enable_sha1 = False
+        self.sha1_list = None
+        self.sha1_content = None
+
+    def get_stream(self):
+        """获取stream
+
+        :return:
+        """
+        return self._stream
+
+    def get_file_size(self):
+        """获取file_size
+
+        :return:
+        """
+        return self._file_size
+
+    def set_biz_attr(self, biz_attr):
+        """设置biz_attr
+
+        :param biz_attr:
+        :return:
+        """
+        self._biz_attr = biz_attr
+
+    def get_biz_attr(self):
+        """获取biz_attr
+
+        :return:
+        """
+        return self._biz_attr
+
+    def set_insert_only(self, insert_only):
+        """设置insert_only，0表示如果文件存在, 则覆盖
+
+        :param insert_only:
+        :return:
+        """
+        self._insert_only = insert_only
+
+    def get_insert_only(self):
+        """获取insert_only
+
+        :return:
+        """
+        return self._insert_only
+
+    def set_slice_size(self, slice_size):
+        """设置分片大小
+
+        :param slice_size:
+        :return:
+        """
+        self._slice_size = slice_size
+
+    def get_slice_size(self):
+        """获取分片大小
+
+        :return:
+        """
+        return self._slice_size
+
+    def get_max_con(self):
+        """获取分片上传的并发数
+
+        :return:
+        """
+        return self._max_con
+
+    def check_params_valid(self):
+        """检查参数是否有效
+
+        :return:
+        """
+        if not super(UploadStreamRequest, self).check_params_valid():
+            return False
+        if not self._param_check.check_cos_path_valid(self._cos_path, is_file_path=True):
+            return False
+        if not self._param_check.check_param_unicode('biz_attr', self._biz_attr):
+            return False
+        if not hasattr(self._stream, 'read'):
+            self._param_check._err_tips = 'stream should have a read method'
+            return False
+        if self._file_size is not None and (not isinstance(self._file_size, (int, long)) or self._file_size < 0):
+            self._param_check._err_tips = 'file_size should be None or a non-negative integer'
+            return False
+        if not self._param_check.check_param_int('insert_only', self._insert_only):
+            return False
+        if not self._param_check.check_insert_only(self._insert_only):
+            return False
+        return self._param_check.check_slice_size(self._slice_size)
+
+
 class UpdateFolderRequest(BaseRequest):
     """UpdateFolderRequest 更新目录请求"""
 
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import errno
+import random
+import time
+from threading import Lock
+
+from cos_err import CosErr
+
+# 错误分类
+RETRYABLE = 'retryable'  # 网络错误等, 稍后重试可能成功
+THROTTLED = 'throttled'  # 被服务端限流, 退避时间更长
+FATAL = 'fatal'  # 重试也不会成功
+
+# 重试也不会成功的cos错误码
+FATAL_CODES = frozenset([
+    CosErr.PARAMS_ERROR,
+    -173,  # 目录非空
+    -177,  # 文件已存在
+    -178,  # 目录已存在
+    -197,  # 文件或目录不存在
+    -4018,  # 相同的文件已经上传过
+    -4024,  # ErrOffGoBack, 只能删除后重新上传
+])
+# cos频控
+THROTTLED_CODES = frozenset([-71])
+THROTTLED_STATUS = frozenset([429, 503])
+# 本地文件的错误
+FATAL_ERRNOS = frozenset([errno.ENOENT, errno.EACCES, errno.EISDIR, errno.ENOTDIR])
+
+
+def classify(code, http_status=None):
+    """ 根据cos错误码和http状态码判断错误类型
+
+    :param code: cos返回的错误码
+    :param http_status: http状态码, 没有时为None
+    :return: RETRYABLE, THROTTLED或FATAL
+    """
+    if http_status in THROTTLED_STATUS or code in THROTTLED_CODES:
+        return THROTTLED
+    if code in FATAL_CODES:
+        return FATAL
+    return RETRYABLE
+
+
+def classify_result(ret):
+    """ 判断sdk返回的错误dict的类型
+
+    :param ret: {u'code': ..., u'message': ..., u'http_status': ...}
+    :return:
+    """
+    return classify(ret.get(u'code'), ret.get(u'http_status'))
+
+
+def classify_exception(e):
+    """ 判断异常的类型, args[0]是int时当作cos错误码
+
+    :param e:
+    :return:
+    """
+    if isinstance(e, EnvironmentError) and e.errno in FATAL_ERRNOS:
+        return FATAL
+    if e.args and isinstance(e.args[0], (int, long)):
+        return classify(e.args[0], getattr(e, 'http_status', None))
+    return RETRYABLE
+
+
+class RetryPolicy(object):
+    """RetryPolicy 共享的重试策略
+
+    按错误类型决定是否重试, 等待时间是指数退避加full jitter(在[0, min(max_delay, base_delay * 2^n))中随机),
+    避免多个线程同时重试. 所有调用共享一个重试预算: 每次调用存入budget_ratio个令牌,
+    每次重试消耗一个, 令牌不足时不再重试, 服务端持续出错时不会被重试放大请求量.
+    """
+
+    def __init__(self, max_attempts=6, base_delay=1.0, max_delay=8.0, throttle_factor=2.0,
+                 budget=100, budget_ratio=0.2):
+        """ 初始化类
+
+        :param max_attempts: 最多尝试的次数(包括第一次)
+        :param base_delay: 第一次重试前等待时间的上限(秒), 之后每次翻倍
+        :param max_delay: 等待时间的上限(秒)
+        :param throttle_factor: 被限流时base_delay乘以这个倍数
+        :param budget: 重试预算的令牌上限, 也是初始值
+        :param budget_ratio: 每次调用存入的令牌数
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttle_factor = throttle_factor
+        self.budget = budget
+        self.budget_ratio = budget_ratio
+        self._sleep = time.sleep
+        self._lock = Lock()
+        self._tokens = float(budget)
+        self._stats = {'calls': 0, 'retries': 0, RETRYABLE: 0, THROTTLED: 0, FATAL: 0,
+                       'exhausted': 0, 'no_budget': 0, 'sleep_time': 0.0}
+
+    def get_delay(self, attempt, kind):
+        """ 第attempt次(从0开始)失败后的等待时间
+
+        :param attempt:
+        :param kind:
+        :return:
+        """
+        base = self.base_delay
+        if kind == THROTTLED:
+            base *= self.throttle_factor
+        return random.uniform(0, min(self.max_delay, base * 2 ** attempt))
+
+    def call(self, func, args=(), kwargs=None, classifier=classify_exception, on_error=None, max_attempts=None):
+        """ 调用func, 抛出的异常可以重试时等待后重试, 否则抛出最后一次的异常
+
+        :param func:
+        :param args:
+        :param kwargs:
+        :param classifier: 判断异常类型的函数
+        :param on_error: on_error(exception, attempt, kind), 每次失败时调用
+        :param max_attempts: 覆盖self.max_attempts
+        :return: func的返回值
+        """
+        self._begin()
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **(kwargs or {}))
+            except Exception as e:
+                kind = classifier(e)
+                if on_error is not None:
+                    on_error(e, attempt, kind)
+                if not self._should_retry(kind, attempt, max_attempts):
+                    raise
+            self._wait(attempt, kind)
+            attempt += 1
+
+    def call_result(self, func, args=(), kwargs=None, max_attempts=None):
+        """ 调用返回错误dict的func, code不为0且可以重试时等待后重试, 返回最后一次的结果
+
+        :param func:
+        :param args:
+        :param kwargs:
+        :param max_attempts: 覆盖self.max_attempts
+        :return:
+        """
+        self._begin()
+        attempt = 0
+        while True:
+            ret = func(*args, **(kwargs or {}))
+            if ret[u'code'] == 0:
+                return ret
+            kind = classify_result(ret)
+            if not self._should_retry(kind, attempt, max_attempts):
+                return ret
+            self._wait(attempt, kind)
+            attempt += 1
+
+    def retry_delay(self, ret, attempt, max_attempts=None):
+        """ 自己安排重试的调用者(例如在事件循环上发出的一批请求)使用, 和call/call_result共享重试预算和统计
+
+        :param ret: 第attempt次(从0开始)调用返回的dict, attempt为0时计入调用次数
+        :param attempt:
+        :param max_attempts: 覆盖self.max_attempts
+        :return: 需要重试时返回应等待的秒数, 成功或不再重试时返回None
+        """
+        if attempt == 0:
+            self._begin()
+        if ret[u'code'] == 0:
+            return None
+        kind = classify_result(ret)
+        if not self._should_retry(kind, attempt, max_attempts):
+            return None
+        return self.get_delay(attempt, kind)
+
+    def sleep(self, seconds):
+        """ 等待并计入统计, 和retry_delay配合使用
+
+        :param seconds:
+        :return:
+        """
+        with self._lock:
+            self._stats['sleep_time'] += seconds
+        self._sleep(seconds)
+
+    def _begin(self):
+        with self._lock:
+            self._stats['calls'] += 1
+            self._tokens = min(self.budget, self._tokens + self.budget_ratio)
+
+    def _should_retry(self, kind, attempt, max_attempts):
+        with self._lock:
+            self._stats[kind] += 1
+            if kind == FATAL:
+                return False
+            if attempt + 1 >= (max_attempts or self.max_attempts):
+                self._stats['exhausted'] += 1
+                return False
+            if self._tokens < 1:
+                self._stats['no_budget'] += 1
+                return False
+            self._tokens -= 1
+            self._stats['retries'] += 1
+            return True
+
+    def _wait(self, attempt, kind):
+        self.sleep(self.get_delay(attempt, kind))
+
+    def get_stats(self):
+        """ calls: 调用次数, retries: 重试次数, retryable/throttled/fatal: 各类错误的次数,
+        exhausted: 用完尝试次数后放弃的调用数, no_budget: 因预算不足放弃的调用数, sleep_time: 等待的总秒数
+
+        :return:
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return 'calls: %d, retries: %d, errors: %d retryable / %d throttled / %d fatal, gave up: %d exhausted / %d no budget, slept: %.3fs' % (
+            stats['calls'], stats['retries'], stats[RETRYABLE], stats[THROTTLED], stats[FATAL],
+            stats['exhausted'], stats['no_budget'], stats['sleep_time'])
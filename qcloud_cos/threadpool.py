@@ -20,7 +20,13 @@ class WorkerThread(Thread):
     def run(self):
 
         while True:
-            func, args, kwargs = self._task_queue.get()
+            task = self._task_queue.get()
+            # None表示线程池已结束
+            if task is None:
+                self._task_queue.task_done()
+                break
+
+            func, args, kwargs = task
 
             try:
                 ret = func(*args, **kwargs)
@@ -40,9 +46,10 @@ class WorkerThread(Thread):
 
 class SimpleThreadPool:
 
-    def __init__(self, num_threads=5):
+    def __init__(self, num_threads=5, max_queue_size=0):
         self._num_threads = num_threads
-        self._queue = Queue()
+        # max_queue_size > 0 时队列满了add_task会阻塞, 限制未处理任务的数量
+        self._queue = Queue(max_queue_size)
         self._lock = Lock()
         self._active = False
         self._workers = list()
@@ -63,6 +70,10 @@ class SimpleThreadPool:
 
     def wait_completion(self):
         self._queue.join()
+        for w in self._workers:
+            self._queue.put(None)
+        for w in self._workers:
+            w.join()
         self._finished = True
 
     def get_result(self):